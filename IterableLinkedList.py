@@ -33,16 +33,33 @@ class Link:
 def identity(x):
     return x
     
+# The list keeps its length and last link, so len, append and last are O(1).
+# They are kept up to date by the list methods, which all add and remove links
+# through _link_after, _link_chain and _unlink (delete_all relinks the list
+# itself); after changing the next references of links directly, hand the
+# chain back with set_first.
 class LinkedList:
     def __init__(self):
         self.__first = None
+        self.__last = None
+        self.__size = 0
 
     def get_first(self):
         return self.__first
+
+    def get_last(self):
+        return self.__last
     
     def set_first(self, link):
         if link is None or isinstance(link, Link):
             self.__first = link
+            # A whole chain may come with the link, count it and find its end
+            self.__size = 0
+            self.__last = None
+            while link:
+                self.__size += 1
+                self.__last = link
+                link = link.get_next()
         else:
             raise RuntimeError("First link must be Link or None")
         
@@ -60,6 +77,11 @@ class LinkedList:
             raise RuntimeError("No first item in empty list")
         return self.get_first().get_data()
 
+    def last(self):
+        if self.is_empty():
+            raise RuntimeError("No last item in empty list")
+        return self.__last.get_data()
+
     def __iter__(self):
         link = self.get_first()
         while link:
@@ -69,26 +91,100 @@ class LinkedList:
 
 
     def __len__(self):
-        length = 0
-        link = self.get_first()
-        while link:
-            length += 1
-            link = link.get_next()
-        return length
+        return self.__size
 
 
     def __str__(self):
-        result = "["
-        for elem in self:     # using __iter__
-            if len(result) > 1:
-                result += " > "
-            result += str(elem)
-        return result + "]"
+        return "[" + " > ".join(str(elem) for elem in self) + "]"   # using __iter__
     
+    def _link_after(self, previous, link):
+        # Puts link after previous (first if previous is None), keeping length and last link
+        if previous is None:
+            link.set_next(self.__first)
+            self.__first = link
+        else:
+            link.set_next(previous.get_next())
+            previous.set_next(link)
+        if link.get_next() is None:
+            self.__last = link
+        self.__size += 1
+
+    def _unlink(self, previous, link):
+        # Takes out link, which follows previous (None if it is the first), keeping length and last link
+        if previous is None:
+            self.__first = link.get_next()
+        else:
+            previous.set_next(link.get_next())
+        if link is self.__last:
+            self.__last = previous
+        self.__size -= 1
+
+    def _link_chain(self, first, last, count):
+        # Puts the chain of count links from first to last after the last link
+        if self.__last is None:
+            self.__first = first
+        else:
+            self.__last.set_next(first)
+        self.__last = last
+        self.__size += count
+
+    @classmethod
+    def from_iterable(cls, iterable, *args, **kwargs):
+        # a new list (made with args, e.g. the key of an IndexedLinkedList) with the items in order
+        linked_list = cls(*args, **kwargs)
+        linked_list.extend(iterable)
+        return linked_list
+
+    def extend(self, iterable):
+        # link the items back to front, one Link call per item, then the chain after the last link
+        items = list(iterable)
+        if not items:
+            return
+        first = last = Link(items[-1])
+        for data in reversed(items[:-1]):
+            first = Link(data, first)
+        self._link_chain(first, last, len(items))
+
+    def to_list(self):
+        result = []
+        add = result.append
+        link = self.__first
+        while link:
+            add(link.get_data())
+            link = link.get_next()
+        return result
+
+    def delete_all(self, pred):
+        # remove every item pred is true for in one pass, returns the number removed;
+        # pred is asked about every item before any link changes, so an exception leaves the list as it was
+        doomed = [pred(data) for data in self]
+        first = previous = None
+        removed = 0
+        link = self.__first
+        for gone in doomed:
+            if gone:
+                removed += 1
+            else:
+                if previous is None:
+                    first = link
+                elif previous.get_next() is not link:   # links were removed in between
+                    previous.set_next(link)
+                previous = link
+            link = link.get_next()
+        if previous is not None:
+            previous.set_next(None)
+        self.__first = first
+        self.__last = previous
+        self.__size -= removed
+        return removed
+
     def insert(self, data):
         # create a new Link with next referencing the list's current first 
-        link = Link(data, self.get_first())
-        self.set_first(link)
+        self._link_after(None, Link(data))
+
+    def append(self, data):
+        # create a new Link after the list's current last
+        self._link_after(self.__last, Link(data))
 
     def find(self, goal, key=identity):
         link = self.get_first()
@@ -108,17 +204,16 @@ class LinkedList:
         link = self.find(goal, key)
         if link is None:
             return False
-        # create a new Link with next referencing link's next
-        new_link = Link(new_data, link.get_next())
-        # update link's next to reference the new link
-        link.set_next(new_link)
+        # create a new Link with next referencing link's next,
+        # and update link's next to reference the new link
+        self._link_after(link, Link(new_data))
         return True
     
     def delete_first(self):
         if self.is_empty():
             raise RuntimeError("Cannot delete first of empty list")
         first = self.get_first()
-        self.set_first(first.get_next())
+        self._unlink(None, first)
         return first.get_data()    # Return data of deleted link
         
 
@@ -126,15 +221,13 @@ class LinkedList:
     def delete(self, goal, key=identity):
         if self.is_empty():
             raise RuntimeError("Cannot delete from empty list")
-        # Link before goal link
-        # At first LinkedList (self), works because we implemented
-        # get_next and set_next for LinkedList
-        previous = self
+        # Link before goal link, None while at the first link
+        previous = None
         current = self.get_next()
         # We need to track previous to update the next reference at deletion
         while current:
             if goal == key(current.get_data()): # Found the link to delete
-                previous.set_next(current.get_next())
+                self._unlink(previous, current)
                 return current.get_data()  # Return data of deleted link
             previous = current       # step to check next link
             current = current.get_next()
@@ -142,6 +235,119 @@ class LinkedList:
         raise RuntimeError("No item with matching key found in list")
     
 
+# A LinkedList that also keeps a dict from the key of every item to its link,
+# and from every link to the link before it. Finding, searching, inserting
+# after and deleting by the list's key take O(1) instead of a walk through the
+# list; other keys can still be given and use the walk. Keys must be unique
+# and must not change while the item is in the list.
+class IndexedLinkedList(LinkedList):
+    def __init__(self, key=identity):
+        super().__init__()
+        self.__key = key
+        self.__index = {}
+        self.__previous = {}
+
+    def get_key(self):
+        return self.__key
+
+    def set_first(self, link):
+        # build the index for the new chain first, so a duplicate key leaves the list as it was
+        index = {}
+        previous_links = {}
+        previous = None
+        current = link if isinstance(link, Link) else None
+        while current:
+            k = self.__key(current.get_data())
+            if k in index:
+                raise RuntimeError(f"Key {k!r} is already in list")
+            index[k] = current
+            previous_links[current] = previous
+            previous = current
+            current = current.get_next()
+        super().set_first(link)
+        self.__index = index
+        self.__previous = previous_links
+
+    def _link_after(self, previous, link):
+        k = self.__key(link.get_data())
+        if k in self.__index:
+            raise RuntimeError(f"Key {k!r} is already in list")
+        super()._link_after(previous, link)
+        self.__index[k] = link
+        self.__previous[link] = previous
+        if link.get_next() is not None:
+            self.__previous[link.get_next()] = link
+
+    def _link_chain(self, first, last, count):
+        # check all keys before linking, so a duplicate leaves the list as it was
+        index = {}
+        link = first
+        while link:
+            k = self.__key(link.get_data())
+            if k in self.__index or k in index:
+                raise RuntimeError(f"Key {k!r} is already in list")
+            index[k] = link
+            link = link.get_next()
+        previous = self.get_last()
+        super()._link_chain(first, last, count)
+        self.__index.update(index)
+        link = first
+        while link:
+            self.__previous[link] = previous
+            previous = link
+            link = link.get_next()
+
+    def delete_all(self, pred):
+        removed = []
+        def matches(data):
+            if pred(data):
+                removed.append(data)
+                return True
+            return False
+        count = super().delete_all(matches)
+        if count:
+            for data in removed:
+                del self.__previous[self.__index.pop(self.__key(data))]
+            # the links after removed ones have new predecessors
+            previous = None
+            link = self.get_first()
+            while link:
+                self.__previous[link] = previous
+                previous = link
+                link = link.get_next()
+        return count
+
+    def _unlink(self, previous, link):
+        super()._unlink(previous, link)
+        del self.__index[self.__key(link.get_data())]
+        del self.__previous[link]
+        if link.get_next() is not None:
+            self.__previous[link.get_next()] = previous
+
+    # key=None uses the index, any other key walks the list as in LinkedList
+    def find(self, goal, key=None):
+        if key is None:
+            return self.__index.get(goal)
+        return super().find(goal, key)
+
+    def search(self, goal, key=None):
+        return super().search(goal, key)
+
+    def insert_after(self, goal, new_data, key=None):
+        return super().insert_after(goal, new_data, key)
+
+    def delete(self, goal, key=None):
+        if key is not None:
+            return super().delete(goal, key)
+        if self.is_empty():
+            raise RuntimeError("Cannot delete from empty list")
+        link = self.__index.get(goal)
+        if link is None:
+            raise RuntimeError("No item with matching key found in list")
+        self._unlink(self.__previous[link], link)
+        return link.get_data()  # Return data of deleted link
+
+
 if __name__ == '__main__':
     # test link
     link = Link(3)
@@ -185,6 +391,125 @@ if __name__ == '__main__':
     for i in [2, 5, 8, 9]:
         print("search returned False:", linked_list.search(i) == False)
 
+    # length and last link are kept by every change
+    queue = LinkedList()
+    for i in range(3):
+        queue.append(i)
+    queue.insert(-1)
+    print("queue after appends and insert: ", str(queue))
+    print("len(queue) == 4 and queue.last() == 2", len(queue) == 4 and queue.last() == 2)
+    queue.insert_after(2, 3)
+    queue.delete(-1)
+    print("last follows insert_after, len(queue) == 4", queue.last() == 3 and len(queue) == 4)
+    queue.delete(3)
+    print("last follows delete of last, queue.last() == 2", queue.last() == 2)
+    while not queue.is_empty():
+        queue.delete_first()
+    queue.append(7)
+    print("append to emptied queue", queue.first() == 7 and queue.last() == 7 and len(queue) == 1)
+    queue.set_first(Link(1, Link(2, Link(3))))
+    print("set_first counts the chain", len(queue) == 3 and queue.last() == 3)
+
+    # indexed list: same behaviour, items found by key
+    records = IndexedLinkedList(key=lambda record: record[0])
+    for i in range(5):
+        records.append((i, f"record {i}"))
+    print("indexed search by key", records.search(3) == (3, "record 3") and records.search(7) == False)
+    records.insert_after(2, (10, "record 10"))
+    records.delete(0)
+    records.delete(4)
+    print("indexed list after insert_after and deletes: ", str(records))
+    print("len and last kept", len(records) == 4 and records.last() == (3, "record 3"))
+    records.delete_first()
+    records.delete(10)
+    print("index follows deletes", records.find(1) is None and records.find(10) is None
+          and records.find(2).get_data() == (2, "record 2"))
+    print("search with another key walks the list", records.search("record 3", key=lambda record: record[1]) == (3, "record 3"))
+    try:
+        records.insert((2, "again"))
+        print("No exception raised.")
+    except RuntimeError:
+        print("Exception raised for duplicate key as expected.")
+    records.set_first(Link((5, "a"), Link((6, "b"))))
+    print("set_first rebuilds the index", records.search(6) == (6, "b") and records.find(2) is None)
+
+    # bulk operations
+    bulk = LinkedList.from_iterable(range(6))
+    bulk.extend([6, 7])
+    print("from_iterable and extend keep the order", bulk.to_list() == list(range(8)) and len(bulk) == 8 and bulk.last() == 7)
+    print("delete_all removed 4", bulk.delete_all(lambda x: x % 2 == 0) == 4)
+    print("after delete_all: ", str(bulk), len(bulk) == 4 and bulk.first() == 1 and bulk.last() == 7)
+    bulk.delete_all(lambda x: x > 2)
+    bulk.append(9)
+    print("last kept by delete_all", bulk.to_list() == [1, 9])
+    print("delete_all of everything empties the list", bulk.delete_all(lambda x: True) == 2 and bulk.is_empty() and len(bulk) == 0)
+    records = IndexedLinkedList.from_iterable([(i, "record") for i in range(6)], key=lambda record: record[0])
+    records.delete_all(lambda record: record[0] % 3 == 0)
+    records.delete(4)
+    print("indexed bulk operations keep the index", records.to_list() == [(1, "record"), (2, "record"), (5, "record")]
+          and records.find(3) is None and records.last() == (5, "record"))
+    for kind in (LinkedList, IndexedLinkedList):
+        items = kind.from_iterable(range(10))
+        try:
+            items.delete_all(lambda x: 1 // (x - 6) < 0)
+        except ZeroDivisionError:
+            pass
+        print(kind.__name__, "unchanged when pred raises", items.to_list() == list(range(10)) and len(items) == 10
+              and items.last() == 9 and items.find(5).get_data() == 5)
+
+    # cost of len and append does not grow with the list
+    import time
+    for n in (10000, 100000, 1000000):
+        queue = LinkedList()
+        t0 = time.perf_counter()
+        for i in range(n):
+            queue.append(i)
+        t1 = time.perf_counter()
+        for i in range(1000):
+            len(queue)
+        t2 = time.perf_counter()
+        print(f"{n:>8} items: append {(t1 - t0) / n * 1e9:.0f} ns, len {(t2 - t1) / 1000 * 1e9:.0f} ns")
+
+    # lookups and deletes by id, walking the list compared to the index
+    import random
+    n = 100000
+    ids = random.Random(1).sample(range(n), 200)
+    for kind in (LinkedList, IndexedLinkedList):
+        records = kind() if kind is LinkedList else kind(key=lambda record: record[0])
+        for i in range(n):
+            records.append((i, "record"))
+        key = (lambda record: record[0]) if kind is LinkedList else None
+        t0 = time.perf_counter()
+        for i in ids:
+            records.search(i, key=key)
+        t1 = time.perf_counter()
+        for i in ids:
+            records.delete(i, key=key)
+        t2 = time.perf_counter()
+        print(f"{kind.__name__:>18}, {n} items: search {(t1 - t0) / len(ids) * 1e6:.1f} us, delete {(t2 - t1) / len(ids) * 1e6:.1f} us")
+
+    # building and draining a million items, one at a time compared to the bulk operations
+    n = 1000000
+    t0 = time.perf_counter()
+    items = LinkedList()
+    for i in range(n):
+        items.insert(i)
+    t1 = time.perf_counter()
+    while not items.is_empty():
+        items.delete_first()
+    t2 = time.perf_counter()
+    items = LinkedList.from_iterable(range(n))
+    t3 = time.perf_counter()
+    drained = items.to_list()
+    items.set_first(None)
+    t4 = time.perf_counter()
+    items = LinkedList.from_iterable(range(n))
+    t5 = time.perf_counter()
+    items.delete_all(lambda x: x % 2 == 0)
+    t6 = time.perf_counter()
+    print(f"{n} items: insert {t1 - t0:.2f} s, delete_first {t2 - t1:.2f} s, "
+          f"from_iterable {t3 - t2:.2f} s, to_list {t4 - t3:.2f} s, delete_all of half {t6 - t5:.2f} s")
+
 
     
 
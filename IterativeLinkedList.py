@@ -4,6 +4,9 @@
 #
 # using lower_case instead of mixedCase for functions and variables
 # __str__using __iter__
+#
+# Every walk through the list is a loop, so it uses constant stack space and
+# any length works (the recursive version stopped at about 1000 links).
 
 class Link:
     __slots__ = ('__data', '__next')
@@ -63,26 +66,21 @@ class LinkedList:
         return self.get_first().get_data()
 
     def __iter__(self):
-        def _iter(link):
-            if link:
-                yield link.get_data()
-                yield from _iter(link.get_next())
-        return _iter(self.get_first())
+        link = self.get_first()
+        while link:
+            yield link.get_data()
+            link = link.get_next()
 
     def __len__(self):
-        def _len(link):
-            if not link:
-                return 0
-            return 1 + _len(link.get_next())
-        return _len(self.get_first())
+        length = 0
+        link = self.get_first()
+        while link:
+            length += 1
+            link = link.get_next()
+        return length
 
     def __str__(self):
-        result = "["
-        for elem in self:  # using __iter__
-            if len(result) > 1:
-                result += " > "
-            result += str(elem)
-        return result + "]"
+        return "[" + " > ".join(str(elem) for elem in self) + "]"  # using __iter__
 
     def insert(self, data):
         # create a new Link with next referencing the list's current first
@@ -90,14 +88,12 @@ class LinkedList:
         self.set_first(link)
 
     def find(self, goal, key=identity):
-        def _find(link):
-            if not link:
-                return None
+        link = self.get_first()
+        while link:
             if key(link.get_data()) == goal:
                 return link
-            return _find(link.get_next())
-
-        return _find(self.get_first())
+            link = link.get_next()
+        return None
 
     def search(self, goal, key=identity):
         link = self.find(goal, key)
@@ -123,20 +119,20 @@ class LinkedList:
         return first.get_data()  # Return data of deleted link
 
     def delete(self, goal, key=identity):
-        def _delete(previous, current):
-            if not current:
-                raise RuntimeError("No item with matching key found in list")
-            if goal == key(current.get_data()):  # Found the link to delete
-                previous.set_next(current.get_next())
-                return current.get_data()  # Return data of deleted link
-            return _delete(current, current.get_next())
-
         if self.is_empty():
             raise RuntimeError("Cannot delete from empty list")
         # special case if the first link is to be deleted
         if key(self.get_first().get_data()) == goal:
             return self.delete_first()
-        return _delete(self, self.get_next())
+        previous = self.get_first()
+        current = previous.get_next()
+        while current:
+            if goal == key(current.get_data()):  # Found the link to delete
+                previous.set_next(current.get_next())
+                return current.get_data()  # Return data of deleted link
+            previous = current
+            current = current.get_next()
+        raise RuntimeError("No item with matching key found in list")
 
 
 if __name__ == '__main__':
@@ -181,3 +177,18 @@ if __name__ == '__main__':
     print("linked_list after deletions: ", str(linked_list))
     for i in [2, 5, 8, 9]:
         print("search returned False:", linked_list.search(i) == False)
+
+    # long lists, far deeper than the recursion limit, and time growing linearly with the length
+    import sys
+    import time
+    for n in (10 * sys.getrecursionlimit(), 100000, 1000000):
+        long_list = LinkedList()
+        for i in range(n):
+            long_list.insert(i)
+        t0 = time.perf_counter()
+        total = sum(long_list)
+        t1 = time.perf_counter()
+        ok = len(long_list) == n and total == n * (n - 1) // 2 and long_list.search(0) == 0
+        long_list.delete(0)
+        print(f"{n:>8} links: len, iter, search and delete of the last link work: {ok and len(long_list) == n - 1}, "
+              f"iteration {(t1 - t0) / n * 1e9:.0f} ns per link")
@@ -0,0 +1,366 @@
+# Listings from chapter 5, with the links stored in arrays
+
+# The same list as IterableLinkedList.LinkedList, but a link is not an object:
+# link i is _data[i] and _next[i], the index of the next link (NONE at the end).
+# Deleted links are chained into a free list through _next and reused by the
+# next insertion, so the arrays never shrink. get_first and find return
+# PooledLink cursors, made when asked for; a cursor must not be used after
+# its link is deleted, the slot may already hold another item. set_first takes
+# a cursor of the list: the links before it are deleted.
+#
+# using lower_case instead of mixedCase for functions and variables
+
+from array import array
+from IterableLinkedList import identity
+
+NONE = -1
+
+class PooledLink:
+    __slots__ = ('__list', '__index')
+
+    def __init__(self, linked_list, index):
+        self.__list = linked_list
+        self.__index = index
+
+    def get_list(self):
+        return self.__list
+
+    def get_index(self):
+        return self.__index
+
+    def get_data(self):
+        return self.__list._data[self.__index]
+
+    def set_data(self, data):
+        self.__list._data[self.__index] = data
+
+    def get_next(self):
+        next = self.__list._next[self.__index]
+        return None if next == NONE else PooledLink(self.__list, next)
+
+    def is_last(self):
+        return self.__list._next[self.__index] == NONE
+
+    def __str__(self):
+        return str(self.get_data())
+
+
+class PooledLinkedList:
+    def __init__(self):
+        self._data = []
+        self._next = array('q')
+        self.__free = NONE
+        self.__first = NONE
+        self.__last = NONE
+        self.__size = 0
+
+    def __new_link(self, data, next):
+        # take a link from the free list, or add one at the end of the arrays
+        index = self.__free
+        if index == NONE:
+            index = len(self._data)
+            self._data.append(data)
+            self._next.append(next)
+        else:
+            self.__free = self._next[index]
+            self._data[index] = data
+            self._next[index] = next
+        return index
+
+    def __free_link(self, index):
+        # put a link on the free list, returns its data
+        data = self._data[index]
+        self._data[index] = None    # let go of the item
+        self._next[index] = self.__free
+        self.__free = index
+        return data
+
+    def __cursor(self, index):
+        return None if index == NONE else PooledLink(self, index)
+
+    def get_first(self):
+        return self.__cursor(self.__first)
+
+    def get_last(self):
+        return self.__cursor(self.__last)
+
+    def set_first(self, link):
+        # the chain from link (a cursor of this list, or None) becomes the list, the links before it are deleted
+        if link is None:
+            index = NONE
+        elif isinstance(link, PooledLink) and link.get_list() is self:
+            index = link.get_index()
+        else:
+            raise RuntimeError("First link must be PooledLink of this list or None")
+        before = []
+        current = self.__first
+        while current != index:
+            if current == NONE:
+                raise RuntimeError("Link is not in list")
+            before.append(current)
+            current = self._next[current]
+        for current in before:
+            self.__free_link(current)
+        self.__first = index
+        # count the chain and find its end
+        self.__size = 0
+        self.__last = NONE
+        while index != NONE:
+            self.__size += 1
+            self.__last = index
+            index = self._next[index]
+
+    def is_empty(self):
+        return self.__first == NONE
+
+    def first(self):
+        if self.is_empty():
+            raise RuntimeError("No first item in empty list")
+        return self._data[self.__first]
+
+    def last(self):
+        if self.is_empty():
+            raise RuntimeError("No last item in empty list")
+        return self._data[self.__last]
+
+    def __iter__(self):
+        data = self._data
+        next = self._next
+        index = self.__first
+        while index != NONE:
+            yield data[index]
+            index = next[index]
+
+    def __len__(self):
+        return self.__size
+
+    def __str__(self):
+        return "[" + " > ".join(str(elem) for elem in self) + "]"   # using __iter__
+
+    def insert(self, data):
+        # the new link references the list's current first
+        self.__first = self.__new_link(data, self.__first)
+        if self.__last == NONE:
+            self.__last = self.__first
+        self.__size += 1
+
+    def append(self, data):
+        index = self.__new_link(data, NONE)
+        if self.__last == NONE:
+            self.__first = index
+        else:
+            self._next[self.__last] = index
+        self.__last = index
+        self.__size += 1
+
+    @classmethod
+    def from_iterable(cls, iterable):
+        linked_list = cls()
+        linked_list.extend(iterable)
+        return linked_list
+
+    def extend(self, iterable):
+        items = list(iterable)
+        # deleted links are reused first, the rest are added to the arrays in one go
+        reused = 0
+        while reused < len(items) and self.__free != NONE:
+            self.append(items[reused])
+            reused += 1
+        if reused == len(items):
+            return
+        if reused:
+            items = items[reused:]
+        start = len(self._data)
+        self._data.extend(items)
+        self._next.extend(range(start + 1, start + len(items) + 1))
+        self._next[-1] = NONE
+        if self.__last == NONE:
+            self.__first = start
+        else:
+            self._next[self.__last] = start
+        self.__last = len(self._data) - 1
+        self.__size += len(items)
+
+    def to_list(self):
+        return list(self)
+
+    def delete_all(self, pred):
+        # remove every item pred is true for in one pass, returns the number removed;
+        # pred is asked about every item before the list changes, so an exception leaves it as it was
+        data = self._data
+        next = self._next
+        indexes = []
+        index = self.__first
+        while index != NONE:
+            indexes.append(index)
+            index = next[index]
+        doomed = [pred(data[index]) for index in indexes]
+        previous = NONE
+        removed = 0
+        for index, gone in zip(indexes, doomed):
+            if gone:
+                self.__free_link(index)
+                removed += 1
+            else:
+                if previous == NONE:
+                    self.__first = index
+                else:
+                    next[previous] = index
+                previous = index
+        if previous == NONE:
+            self.__first = NONE
+        else:
+            next[previous] = NONE
+        self.__last = previous
+        self.__size -= removed
+        return removed
+
+    def __find(self, goal, key):
+        # index of the first link whose data has key goal, and of the link before it
+        data = self._data
+        next = self._next
+        previous = NONE
+        index = self.__first
+        while index != NONE:
+            if key(data[index]) == goal:
+                return previous, index
+            previous = index
+            index = next[index]
+        return previous, NONE
+
+    def find(self, goal, key=identity):
+        return self.__cursor(self.__find(goal, key)[1])
+
+    def search(self, goal, key=identity):
+        index = self.__find(goal, key)[1]
+        if index == NONE:
+            return False
+        return self._data[index]
+
+    def insert_after(self, goal, new_data, key=identity):
+        index = self.__find(goal, key)[1]
+        if index == NONE:
+            return False
+        # the new link references index's next, and index references the new link
+        new_index = self.__new_link(new_data, self._next[index])
+        self._next[index] = new_index
+        if index == self.__last:
+            self.__last = new_index
+        self.__size += 1
+        return True
+
+    def delete_first(self):
+        if self.is_empty():
+            raise RuntimeError("Cannot delete first of empty list")
+        index = self.__first
+        self.__first = self._next[index]
+        if self.__first == NONE:
+            self.__last = NONE
+        self.__size -= 1
+        return self.__free_link(index)    # Return data of deleted link
+
+    def delete(self, goal, key=identity):
+        if self.is_empty():
+            raise RuntimeError("Cannot delete from empty list")
+        previous, index = self.__find(goal, key)
+        if index == NONE:
+            raise RuntimeError("No item with matching key found in list")
+        if previous == NONE:
+            self.__first = self._next[index]
+        else:
+            self._next[previous] = self._next[index]
+        if index == self.__last:
+            self.__last = previous
+        self.__size -= 1
+        return self.__free_link(index)  # Return data of deleted link
+
+
+if __name__ == '__main__':
+    # same tests as IterableLinkedList
+    linked_list = PooledLinkedList()
+    print("linked_list is_empty()", linked_list.is_empty())
+    print("linked_list get_first is None", linked_list.get_first() is None)
+    print("len(linked_list) == 0", len(linked_list) == 0)
+    linked_list.insert(3)
+    print("linked_list get_first().get_data() == 3", linked_list.get_first().get_data() == 3)
+    print("len(linked_list) == 1", len(linked_list) == 1)
+    for i in range(5, 10):
+        linked_list.insert(i)
+    print("linked_list after insertions: ", str(linked_list))
+    print("len(linked_list) == 6", len(linked_list) == 6)
+
+    for i in range(0, 3):
+        print("search returned False:", linked_list.search(i) == False)
+    for i in range(5, 10):
+        print("search returned data", linked_list.search(i) == i)
+
+    linked_list.insert_after(5, 4)
+    linked_list.insert_after(3, 2)
+    print("linked_list after insert_after calls: ", str(linked_list))
+
+    linked_list.delete_first()
+    print("len(linked_list)==7", len(linked_list) == 7)
+
+    linked_list.delete(5)
+    linked_list.delete(2)
+    # test removing the first
+    linked_list.delete(8)
+    try:
+        linked_list.delete(2)
+        print("No exception raised.")
+    except RuntimeError:
+        print("Exception raised as expected.")
+    print("len(linked_list)==4", len(linked_list) == 4)
+    print("linked_list after deletions: ", str(linked_list))
+    for i in [2, 5, 8, 9]:
+        print("search returned False:", linked_list.search(i) == False)
+
+    # cursors and reuse of deleted links
+    cursor = linked_list.find(6)
+    print("cursor walks the list", cursor.get_data() == 6 and cursor.get_next().get_data() == 4 and linked_list.get_last().is_last())
+    slots = len(linked_list._data)
+    linked_list.append(11)
+    linked_list.insert(12)
+    print("deleted links are reused", len(linked_list._data) == slots and linked_list.to_list() == [12, 7, 6, 4, 3, 11])
+    print("last after append", linked_list.last() == 11)
+    linked_list.delete(7)
+    linked_list.delete(4)
+    linked_list.extend([13, 14, 15])
+    print("extend reuses deleted links first", len(linked_list._data) == slots
+          and linked_list.to_list() == [12, 6, 3, 11, 13, 14, 15] and len(linked_list) == 7 and linked_list.last() == 15)
+    print("delete_all removes matching items", linked_list.delete_all(lambda x: x % 2) == 4
+          and linked_list.to_list() == [12, 6, 14] and len(linked_list) == 3 and linked_list.last() == 14)
+    linked_list.set_first(linked_list.find(6))
+    print("set_first drops the links before it", linked_list.to_list() == [6, 14] and len(linked_list) == 2)
+    linked_list.extend(range(20))
+    print("extend after set_first", linked_list.to_list() == [6, 14] + list(range(20)))
+    try:
+        linked_list.delete_all(lambda x: 1 // (x - 7))
+    except ZeroDivisionError:
+        pass
+    print("delete_all leaves the list as it was when pred raises", linked_list.to_list() == [6, 14] + list(range(20)) and len(linked_list) == 22)
+    linked_list.set_first(None)
+    print("set_first(None) empties the list", linked_list.is_empty() and len(linked_list) == 0)
+
+    # memory per item and time to build and walk, compared to Link objects
+    import time
+    import tracemalloc
+    from IterableLinkedList import LinkedList
+
+    n = 1000000
+    item = "item"   # the same object everywhere, so only the list itself is measured
+    print(f"{'list':>18} {'bytes/item':>10} {'build s':>8} {'iterate s':>9}")
+    for kind in (LinkedList, PooledLinkedList):
+        tracemalloc.start()
+        items = kind.from_iterable(item for i in range(n))
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del items
+        t0 = time.perf_counter()
+        items = kind.from_iterable(item for i in range(n))
+        t1 = time.perf_counter()
+        for data in items:
+            pass
+        t2 = time.perf_counter()
+        print(f"{kind.__name__:>18} {size / n:>10.1f} {t1 - t0:>8.2f} {t2 - t1:>9.2f}")
+        del items
@@ -0,0 +1,135 @@
+#Module for an asyncio server front end for DVA248 Datorsystem
+#
+#   Serves all client connections from one event loop, using the same framed
+#   protocol as cscomm. Received planets are handed to a callback, no thread
+#   is started per connection.
+#
+import asyncio
+import threading
+from functools import partial
+from cscomm import serverInitSocket, serverRecvMessageAsync, KIND_PLANETS, OUTBOX_HIGH_WATER
+
+class aioclient:
+    '''
+    Class that stands in for the socket of a client served by the event loop.
+    It can be stored in planet.cSock and used with serverSendString or serverPostString from any thread.
+    '''
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+        # Bytes handed to the event loop but not yet given to the transport
+        self.lock = threading.Lock()
+        self.scheduled = 0
+
+    def sendall(self, data):
+        '''
+        Method that queues data for the client without waiting for it to be sent.
+            data:   the bytes to send
+        '''
+        with self.lock:
+            self.scheduled += len(data)
+        try:
+            self.loop.call_soon_threadsafe(self._write, data)
+        except RuntimeError:
+            raise OSError("Event loop is closed")
+
+    def send(self, data, flags=0):
+        '''
+        Method with the same meaning as socket.send, but either all data or nothing is accepted.
+        Raises BlockingIOError while more than OUTBOX_HIGH_WATER bytes wait to be sent.
+            data:   the bytes to send
+        '''
+        if self.writer.is_closing():
+            raise OSError("Connection is closed")
+        if self.buffered() > OUTBOX_HIGH_WATER:
+            raise BlockingIOError("Client is not keeping up")
+        self.sendall(bytes(data))
+        return len(data)
+
+    def buffered(self):
+        '''
+        Method that returns the number of bytes queued for the client but not yet sent.
+        '''
+        with self.lock:
+            return self.scheduled + self.writer.transport.get_write_buffer_size()
+
+    def notify_writable(self, callback):
+        '''
+        Method that calls callback, on the event loop, once the client has taken most of what is queued.
+            callback:   function called without arguments
+        '''
+        try:
+            self.loop.call_soon_threadsafe(self._notify, callback)
+        except RuntimeError:
+            raise OSError("Event loop is closed")
+
+    def _notify(self, callback):
+        self.loop.create_task(self._drained(callback))
+
+    async def _drained(self, callback):
+        try:
+            await self.writer.drain()
+        except (ConnectionError, RuntimeError):
+            pass
+        callback()
+
+    def _write(self, data):
+        with self.lock:
+            self.scheduled -= len(data)
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+    def close(self):
+        '''
+        Method that closes the connection to the client.
+        '''
+        try:
+            self.loop.call_soon_threadsafe(self.writer.close)
+        except RuntimeError:
+            pass
+
+async def _handle(on_planets, on_message, on_close, reader, writer):
+    '''Handles communication with a single client.'''
+    client = aioclient(asyncio.get_running_loop(), writer)
+    # Lets drain wait until the client is below the high-water mark send checks
+    writer.transport.set_write_buffer_limits(high=OUTBOX_HIGH_WATER)
+    print(f"New connection from {writer.get_extra_info('peername')}")
+    try:
+        while True:
+            message = await serverRecvMessageAsync(reader)
+            if message is None:
+                break
+            kind, value = message
+            if kind == KIND_PLANETS:
+                on_planets(value, client)
+            elif on_message is not None:
+                on_message(kind, value, client)
+    except Exception as e:
+        print(f"Error in client handler: {e}")
+    if on_close is not None:
+        on_close(client)
+    writer.close()
+
+async def serve(on_planets, ip='127.0.0.1', port=12347, backlog=1024, server_socket=None, on_message=None, on_close=None):
+    '''
+    Coroutine that accepts clients and receives planets from them until cancelled.
+        on_planets:     function called with (planets, client) for every received planet or batch,
+                        it runs on the event loop and must not block
+        ip,port:        address to listen on
+        backlog:        number of pending connections the operating system queues
+        server_socket:  optional socket from serverInitSocket to use instead of ip and port
+        on_message:     optional function called with (kind, value, client) for other messages, e.g. KIND_HELLO
+        on_close:       optional function called with (client) when a connection ends
+    '''
+    if server_socket is None:
+        server_socket = serverInitSocket(ip, port, backlog)
+    server = await asyncio.start_server(partial(_handle, on_planets, on_message, on_close),
+                                        sock=server_socket, backlog=backlog)
+    async with server:
+        await server.serve_forever()
+
+def run(on_planets, ip='127.0.0.1', port=12347, backlog=1024, server_socket=None, on_message=None, on_close=None):
+    '''
+    Function that runs the asyncio server in the calling thread, see serve.
+    '''
+    asyncio.run(serve(on_planets, ip, port, backlog, server_socket, on_message, on_close))
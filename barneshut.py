@@ -0,0 +1,171 @@
+#Module for Barnes-Hut gravity approximation for DVA248 Datorsystem
+#
+#   The quadtree is built from Morton codes of the bodies, one level at a time,
+#   and all bodies walk the tree in lockstep so that every level is a handful of
+#   NumPy operations. Force computation is O(n log n) instead of O(n^2).
+#
+import numpy as np
+from nbody import G
+
+DEPTH = 16
+'''Number of levels below the root, the smallest cells are 1/65536 of the domain'''
+
+BLOCK = 8192
+'''Number of target bodies that walk the tree together, bounds the size of the work lists'''
+
+def _spread(v):
+    # Insert a zero bit between each of the lower 16 bits of v
+    v = v & 0xFFFF
+    v = (v | (v << 8)) & 0x00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F
+    v = (v | (v << 2)) & 0x33333333
+    v = (v | (v << 1)) & 0x55555555
+    return v
+
+class quadtree:
+    '''
+    Class for a quadtree over a square domain with its lower left corner in (0,0).
+    Each level is stored as arrays over its non-empty cells: number of bodies, mass, centre
+    of mass and the range of child cells on the next level. Bodies outside the domain are
+    placed in the nearest border cell, their mass and position are still used exactly.
+    '''
+    def __init__(self, sx, sy, mass, size):
+        '''
+        Constructor that builds the tree.
+            sx,sy:  arrays with the positions of the bodies
+            mass:   array with the masses of the bodies
+            size:   side length of the square domain
+        '''
+        self.size = size
+        cells = 1 << DEPTH
+        ix = np.clip((sx * (cells / size)).astype(np.int64), 0, cells - 1)
+        iy = np.clip((sy * (cells / size)).astype(np.int64), 0, cells - 1)
+        codes = _spread(ix) | (_spread(iy) << 1)
+        self.order = np.argsort(codes, kind='stable')
+        self.rank = np.empty_like(self.order)
+        self.rank[self.order] = np.arange(len(codes))
+        codes = codes[self.order]
+        m = mass[self.order]
+        mx = m * sx[self.order]
+        my = m * sy[self.order]
+
+        self.count, self.mass, self.cx, self.cy, self.cell = [], [], [], [], []
+        for d in range(DEPTH + 1):
+            keys = codes >> (2 * (DEPTH - d))
+            first = np.empty(len(keys), bool)
+            first[:1] = True
+            np.not_equal(keys[1:], keys[:-1], out=first[1:])
+            starts = np.flatnonzero(first)
+            total = np.add.reduceat(m, starts) if len(starts) else np.zeros(0)
+            safe = np.where(total > 0, total, 1.0)
+            self.count.append(np.diff(np.append(starts, len(keys))))
+            self.mass.append(total)
+            self.cx.append(np.add.reduceat(mx, starts) / safe if len(starts) else total)
+            self.cy.append(np.add.reduceat(my, starts) / safe if len(starts) else total)
+            # cell[d][k] is the level d cell of the body with sorted position k
+            self.cell.append(np.cumsum(first) - 1)
+        # Children of a cell are the contiguous cells on the next level holding its bodies
+        self.child_lo, self.child_hi = [], []
+        for d in range(DEPTH):
+            starts = np.flatnonzero(np.diff(self.cell[d], prepend=-1))
+            ends = np.append(starts[1:], len(codes)) - 1
+            self.child_lo.append(self.cell[d + 1][starts])
+            self.child_hi.append(self.cell[d + 1][ends] + 1)
+
+    def accelerations(self, sx, sy, mass, targets, theta):
+        '''
+        Method that computes the approximate acceleration on some of the bodies the tree was built from.
+            sx,sy,mass: the arrays the tree was built from
+            targets:    index array of the bodies to compute the acceleration for
+            theta:      opening angle, a cell is used as a point mass when size/distance < theta
+        Returns two arrays (ax, ay), one entry per target.
+        '''
+        nt = len(targets)
+        ax = np.zeros(nt)
+        ay = np.zeros(nt)
+        if nt == 0 or len(sx) == 0:
+            return ax, ay
+        theta2 = theta * theta
+        body = np.arange(nt)
+        cell = np.zeros(nt, np.int64)
+        for d in range(DEPTH + 1):
+            t = targets[body]
+            dx = self.cx[d][cell] - sx[t]
+            dy = self.cy[d][cell] - sy[t]
+            m = self.mass[d][cell]
+            count = self.count[d][cell]
+            own = self.cell[d][self.rank[t]] == cell
+            if d == DEPTH:
+                # Cells that cannot be split further are used whole, minus the body itself
+                accept = np.ones(len(cell), bool)
+                rest = m - np.where(own, mass[t], 0.0)
+                safe = np.where(rest > 0, rest, 1.0)
+                dx = np.where(own, (m * (dx + sx[t]) - mass[t] * sx[t]) / safe - sx[t], dx)
+                dy = np.where(own, (m * (dy + sy[t]) - mass[t] * sy[t]) / safe - sy[t], dy)
+                m = rest
+            else:
+                r2 = dx * dx + dy * dy
+                side = self.size / (1 << d)
+                accept = ~own & ((count == 1) | (side * side < theta2 * r2))
+            r2 = dx[accept] * dx[accept] + dy[accept] * dy[accept]
+            r2[r2 == 0.0] = np.inf
+            f = G * m[accept] / (r2 * np.sqrt(r2))
+            ax += np.bincount(body[accept], f * dx[accept], minlength=nt)
+            ay += np.bincount(body[accept], f * dy[accept], minlength=nt)
+            if d == DEPTH:
+                break
+            # Open every remaining cell that holds more than the target itself
+            opened = ~accept & (count > 1)
+            lo = self.child_lo[d][cell[opened]]
+            n = self.child_hi[d][cell[opened]] - lo
+            if len(n) == 0:
+                break
+            body = np.repeat(body[opened], n)
+            offset = np.arange(len(body)) - np.repeat(np.cumsum(n) - n, n)
+            cell = np.repeat(lo, n) + offset
+        return ax, ay
+
+def accelerations(sx, sy, mass, targets=None, theta=0.5, width=800, height=600):
+    '''
+    Function that computes the gravitational acceleration on bodies with the Barnes-Hut approximation.
+    Drop-in replacement for nbody.accelerations; the tree is rebuilt on every call.
+        sx,sy:          arrays with the positions of all bodies
+        mass:           array with the masses of all bodies
+        targets:        optional index array, only these bodies get an acceleration computed
+        theta:          opening angle, 0 gives the exact sum
+        width,height:   size of the domain the tree is built over
+    Returns two arrays (ax, ay), one entry per target.
+    '''
+    if targets is None:
+        targets = np.arange(len(sx))
+    tree = quadtree(sx, sy, mass, max(width, height))
+    ax = np.empty(len(targets))
+    ay = np.empty(len(targets))
+    for lo in range(0, len(targets), BLOCK):
+        ax[lo:lo + BLOCK], ay[lo:lo + BLOCK] = tree.accelerations(sx, sy, mass, targets[lo:lo + BLOCK], theta)
+    return ax, ay
+
+
+if __name__ == '__main__':
+    # Accuracy and speed compared to the exact all-pairs sum
+    import time
+    import nbody
+
+    rng = np.random.default_rng(1)
+    print(f"{'bodies':>7} {'theta':>5} {'exact ms':>9} {'bh ms':>8} {'median err':>11} {'99% err':>9}")
+    for n in (1000, 4000, 16000):
+        sx = rng.uniform(0, 800, n)
+        sy = rng.uniform(0, 600, n)
+        mass = rng.uniform(500, 1500, n)
+        mass[0] = 10e8
+        t0 = time.perf_counter()
+        ex, ey = nbody.accelerations(sx, sy, mass)
+        exact = time.perf_counter() - t0
+        norm = np.hypot(ex, ey)
+        for theta in ((0.0, 0.3, 0.5, 0.8) if n <= 1000 else (0.3, 0.5, 0.8)):
+            t0 = time.perf_counter()
+            bx, by = accelerations(sx, sy, mass, theta=theta)
+            bh = time.perf_counter() - t0
+            err = np.hypot(bx - ex, by - ey) / norm
+            print(f"{n:>7} {theta:>5} {exact * 1000:>9.1f} {bh * 1000:>8.1f} "
+                  f"{np.median(err):>11.2e} {np.percentile(err, 99):>9.2e}")
@@ -0,0 +1,189 @@
+#Benchmarks for the planet server for DVA248 Datorsystem
+#
+#   Measures how the simulation and the client protocol behave as load grows:
+#     physics:  ticks per second and per-tick latency for synthetic universes
+#     ingest:   planets received per second from N fake clients over loopback
+#   Results are printed as a table and can be written as JSON to track regressions.
+#
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import threading
+import time
+import numpy as np
+import cscomm
+import aioserver
+from planet import planet
+from server import universe, SPACEX, SPACEY
+
+def synthetic_planets(n, seed=1):
+    '''
+    Function that creates n planets spread over the universe around a heavy sun.
+    Returns a list of planet objects.
+    '''
+    rng = random.Random(seed)
+    planets = [planet("Sun", SPACEX / 2, SPACEY / 2, 0, 0, 10e8, 10e8)]
+    for i in range(n - 1):
+        planets.append(planet("Comet", rng.uniform(50, SPACEX - 50), rng.uniform(50, SPACEY - 50),
+                              rng.uniform(-0.01, 0.01), rng.uniform(-0.01, 0.01), 1000, 10e8))
+    return planets[:n]
+
+def percentiles(samples):
+    '''
+    Function that summarizes tick durations (in seconds).
+    Returns a dict with the number of ticks, ticks per second and latency percentiles in milliseconds.
+    '''
+    ms = np.array(samples) * 1000
+    return {"ticks": len(samples),
+            "ticks_per_second": len(samples) / (ms.sum() / 1000),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p90_ms": float(np.percentile(ms, 90)),
+            "p99_ms": float(np.percentile(ms, 99)),
+            "max_ms": float(ms.max())}
+
+def bench_physics(n, engine, budget, max_ticks):
+    '''
+    Function that runs ticks of a universe with n planets until budget seconds or max_ticks are used.
+        engine:     "exact" or "barneshut" for universe.advance, "per-planet" for one
+                    calculate_planet_pos call per planet, made one after another in this thread.
+                    That is a lower bound for the thread-per-planet updater, which also pays for
+                    thread switches and for every planet waiting on the lock
+    Returns a result dict, see percentiles
+    '''
+    u = universe(gravity="barneshut" if engine == "barneshut" else "exact")
+    u.add_planets(synthetic_planets(n))
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_ticks and time.perf_counter() - started < budget:
+        t0 = time.perf_counter()
+        if engine == "per-planet":
+            with u.lock:
+                for p in list(u.planet_list):
+                    u.calculate_planet_pos(p)
+        else:
+            u.advance()
+        samples.append(time.perf_counter() - t0)
+    return dict(percentiles(samples), bench="physics", engine=engine, bodies=n, serial=engine == "per-planet")
+
+def fake_client(port, planets, batch, seed):
+    # Runs in its own process so the clients do not share the server's interpreter lock
+    s = cscomm.clientInitSocket(port=port)
+    ps = synthetic_planets(planets, seed)
+    for i in range(0, planets, batch):
+        if batch == 1:
+            cscomm.clientSendPlanet(s, ps[i])
+        else:
+            cscomm.clientSendPlanets(s, ps[i:i + batch])
+    s.close()
+
+def bench_ingest(frontend, clients, planets, batch, timeout=60):
+    '''
+    Function that measures how fast the server front end receives planets from fake clients over loopback.
+        frontend:   "threads" (one thread per connection) or "asyncio" (one event loop)
+        clients:    number of client processes
+        planets:    planets sent by each client
+        batch:      planets per message, 1 sends them one at a time
+    Returns a result dict with planets ingested per second
+    '''
+    expected = clients * planets
+    received = [0]
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def on_planets(ps, client):
+        with lock:
+            received[0] += len(ps)
+            if received[0] >= expected:
+                done.set()
+
+    server_socket = cscomm.serverInitSocket(port=0, backlog=max(clients, 1))
+    port = server_socket.getsockname()[1]
+    if frontend == "asyncio":
+        threading.Thread(target=aioserver.run, args=(on_planets,),
+                         kwargs={"server_socket": server_socket}, daemon=True).start()
+    else:
+        def handler(sock):
+            while True:
+                ps = cscomm.serverRecvPlanets(sock)
+                if ps is None:
+                    break
+                on_planets(ps, sock)
+            cscomm.serverForgetClient(sock)
+            sock.close()
+
+        def acceptor():
+            while True:
+                sock = cscomm.serverWaitForNewClient(server_socket)
+                threading.Thread(target=handler, args=(sock,), daemon=True).start()
+        threading.Thread(target=acceptor, daemon=True).start()
+
+    procs = [multiprocessing.Process(target=fake_client, args=(port, planets, batch, i)) for i in range(clients)]
+    started = time.perf_counter()
+    for proc in procs:
+        proc.start()
+    done.wait(timeout)
+    elapsed = time.perf_counter() - started
+    for proc in procs:
+        proc.terminate()
+        proc.join()
+    server_socket.close()
+    return {"bench": "ingest", "frontend": frontend, "clients": clients, "batch": batch,
+            "planets": received[0], "seconds": elapsed, "planets_per_second": received[0] / elapsed,
+            "complete": received[0] >= expected}
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Planet server benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000],
+                        help="number of bodies in the synthetic universes")
+    parser.add_argument("--engines", nargs="+", default=["per-planet", "exact", "barneshut"],
+                        choices=["per-planet", "exact", "barneshut"])
+    parser.add_argument("--max-bodies", type=int, nargs=2, default=[1000, 20000], metavar=("PER_PLANET", "EXACT"),
+                        help="largest universe run with the per-planet and exact engines")
+    parser.add_argument("--budget", type=float, default=3.0, help="seconds spent per physics benchmark")
+    parser.add_argument("--ticks", type=int, default=200, help="maximum ticks per physics benchmark")
+    parser.add_argument("--frontends", nargs="+", default=["threads", "asyncio"], choices=["threads", "asyncio"])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 64], help="numbers of fake clients")
+    parser.add_argument("--planets", type=int, default=2000, help="planets sent by each fake client")
+    parser.add_argument("--batches", type=int, nargs="+", default=[1, 100], help="planets per message")
+    parser.add_argument("--skip", nargs="+", default=[], choices=["physics", "ingest"])
+    parser.add_argument("--output", help="write all results to this JSON file")
+    args = parser.parse_args()
+
+    limits = {"per-planet": args.max_bodies[0], "exact": args.max_bodies[1], "barneshut": None}
+    results = []
+    if "physics" not in args.skip:
+        print(f"{'engine':>10} {'bodies':>7} {'ticks/s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+        for engine in args.engines:
+            for n in args.sizes:
+                if limits[engine] is not None and n > limits[engine]:
+                    continue
+                r = bench_physics(n, engine, args.budget, args.ticks)
+                results.append(r)
+                print(f"{engine:>10} {n:>7} {r['ticks_per_second']:>9.1f} {r['p50_ms']:>9.2f} "
+                      f"{r['p90_ms']:>9.2f} {r['p99_ms']:>9.2f}", flush=True)
+        if "per-planet" in args.engines:
+            print("per-planet runs the updates serially, a lower bound for the thread-per-planet scheduler")
+    if "ingest" not in args.skip:
+        print(f"{'frontend':>10} {'clients':>7} {'batch':>6} {'planets/s':>11}")
+        for frontend in args.frontends:
+            for clients in args.clients:
+                for batch in args.batches:
+                    # The front ends print every new connection, keep the table readable
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        r = bench_ingest(frontend, clients, args.planets, batch)
+                    results.append(r)
+                    print(f"{frontend:>10} {clients:>7} {batch:>6} {r['planets_per_second']:>11.0f}"
+                          f"{'' if r['complete'] else ' (incomplete)'}", flush=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"python": platform.python_version(), "numpy": np.__version__,
+                       "cpus": os.cpu_count(), "time": time.time(), "results": results}, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#Module for checkpoints of the universe for DVA248 Datorsystem
+#
+#   A checkpoint holds every planet of one snapshot: the columns as raw arrays,
+#   then the names and owners as string tables. It is written by a background
+#   thread from the immutable snapshot, so the tick loop never waits for the disk,
+#   and replaces the previous checkpoint only when it is complete.
+#
+import mmap
+import os
+import struct
+import threading
+import numpy as np
+from planetstore import COLUMNS
+
+HEADER = struct.Struct('<4sH2xqqQ')
+'''Start of a checkpoint: magic, format version, tick, next planet id and number of planets'''
+MAGIC = b'PCKP'
+VERSION = 1
+
+FIELDS = COLUMNS + ('ids',)
+DTYPES = ('<f8', '<f8', '<f8', '<f8', '<f8', '<i8', '<i8')
+
+def _strings(values):
+    # String table: offsets of each string (one more than the number of strings), then the UTF-8 bytes
+    encoded = [b'' if v is None else str(v).encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, '<u8')
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return offsets, b''.join(encoded)
+
+def writeCheckpoint(path, state):
+    '''
+    Function that writes a checkpoint. The file is written next to path and renamed over it when
+    complete, so a crash while writing leaves the previous checkpoint.
+        path:   name of the checkpoint file
+        state:  a snapshot, see planetstore.snapshot
+    '''
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, state.tick, state.next_id, len(state.ids)))
+        for name, dtype in zip(FIELDS, DTYPES):
+            f.write(np.ascontiguousarray(getattr(state, name), dtype).data)
+        for values in (state.names, state.owners):
+            offsets, data = _strings(values)
+            f.write(offsets.data)
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+class checkpoint:
+    '''
+    Class for a checkpoint loaded from a file. The arrays sx, sy, vx, vy, mass, life and ids are read-only
+    views of the memory-mapped file; names and owners are lists. It can be given to planetstore.load.
+    '''
+    def __init__(self, path):
+        '''
+        Constructor that maps a checkpoint file.
+            path:   name of the checkpoint file
+        '''
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.tick, self.next_id, count = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a checkpoint file")
+        offset = HEADER.size
+        for name, dtype in zip(FIELDS, DTYPES):
+            setattr(self, name, np.frombuffer(self.data, dtype, count, offset))
+            offset += 8 * count
+        tables = []
+        for i in range(2):
+            offsets = np.frombuffer(self.data, '<u8', count + 1, offset) + offset + 8 * (count + 1)
+            tables.append([str(self.data[lo:hi], 'utf-8') for lo, hi in zip(offsets[:-1].tolist(), offsets[1:].tolist())])
+            offset = int(offsets[-1])
+        self.names = tables[0]
+        self.owners = [owner or None for owner in tables[1]]
+
+    def __len__(self):
+        return len(self.ids)
+
+class checkpointwriter:
+    '''
+    Class for a thread that writes checkpoints in the background. If new snapshots arrive faster than
+    they can be written, only the newest one is written.
+    '''
+    def __init__(self, path):
+        '''
+        Constructor that starts the writer thread.
+            path:   name of the checkpoint file
+        '''
+        self.path = path
+        self.pending = None
+        self.written = 0
+        self.skipped = 0
+        self.wakeup = threading.Condition()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, state):
+        '''
+        Method that hands a snapshot to the writer without waiting for it to be written.
+            state:  a snapshot, see planetstore.snapshot
+        '''
+        with self.wakeup:
+            if self.pending is not None:
+                self.skipped += 1
+            self.pending = state
+            self.wakeup.notify()
+
+    def _run(self):
+        while True:
+            with self.wakeup:
+                while self.pending is None:
+                    self.wakeup.wait()
+                state, self.pending = self.pending, None
+            try:
+                writeCheckpoint(self.path, state)
+                self.written += 1
+            except OSError as e:
+                print(f"Could not write checkpoint {self.path}: {e}")
+
+
+if __name__ == '__main__':
+    import time
+    from planet import planet
+    from planetstore import planetstore
+
+    n = 200000
+    store = planetstore(n)
+    store.add_planets([planet("Comet" if i % 3 else "Jörd", i, 2.0 * i, 0.1, 0.2, 1000.0, 100 + i) for i in range(n)])
+    store.owners[:] = [f"client{i % 7}" if i % 5 else None for i in range(n)]
+    store.remove(3)
+    state = store.snapshot(42)
+    t0 = time.perf_counter()
+    writeCheckpoint('/tmp/checkpoint.pckp', state)
+    t1 = time.perf_counter()
+    loaded = checkpoint('/tmp/checkpoint.pckp')
+    restored = planetstore()
+    restored.load(loaded)
+    t2 = time.perf_counter()
+    same = all(np.array_equal(getattr(restored, c), getattr(store, c)) for c in FIELDS)
+    print("restored store is equal", same and restored.names == store.names and restored.owners == store.owners
+          and loaded.tick == 42 and restored.next_id == store.next_id)
+    print(f"{n - 1} planets, {os.path.getsize('/tmp/checkpoint.pckp') / (n - 1):.0f} bytes each, "
+          f"write {(t1 - t0) * 1000:.0f} ms, restore {(t2 - t1) * 1000:.0f} ms")
@@ -1,25 +1,75 @@
+import os
 import time
 import threading
+import random
+import uuid
+import argparse
+import getpass
 from planet import planet
-from cscomm import clientInitSocket, clientRecvString, clientSendPlanet
+from cscomm import clientInitSocket, clientRecvString, clientSendPlanet, clientSendPlanets, clientSendHello, clientSendSubscribe, planetview
 
 # Create the planets
 sun = planet("Sun", 300, 300, 0, 0, 10e8, 10e8)
 earth = planet("Earth", 200, 300, 0, 0.008, 1000, 10e8)
 
+parser = argparse.ArgumentParser(description="Planet client")
+parser.add_argument("--ip", default="127.0.0.1", help="address of the server")
+parser.add_argument("--port", type=int, default=12347, help="port of the server")
+parser.add_argument("--token-file",
+                    help="file that keeps the token of this client, default is one per user and server; "
+                         "clients running at the same time need different files")
+args = parser.parse_args()
+
+# The token tells the server who we are, so messages about our planets reach us after a reconnect.
+# Clients with the same token share their planets, so the file is kept per user and server
+token_file = args.token_file or f"client_token_{getpass.getuser()}_{args.ip}_{args.port}.txt"
+if os.path.exists(token_file):
+    with open(token_file) as f:
+        token = f.read().strip()
+else:
+    token = uuid.uuid4().hex
+    with open(token_file, "w") as f:
+        f.write(token)
+
+# Our planets and the watched region as last streamed by the server, and the subscription (rate, region)
+view = planetview()
+subscription = None
+
+def connect():
+    '''Connects to the server and says who we are, waits until the server is up.'''
+    while True:
+        try:
+            s = clientInitSocket(args.ip, args.port)
+            clientSendHello(s, token)
+            if subscription is not None: # The server starts the updates over on a new connection
+                view.clear()
+                clientSendSubscribe(s, *subscription)
+            return s
+        except OSError:
+            time.sleep(1)
+
 # Initialize the client socket
-s = clientInitSocket()
+s = connect()
 
-def client_thread(s):
+def client_thread():
+    global s
     while True:
-        message = clientRecvString(s)
+        try:
+            message = clientRecvString(s, view)
+        except OSError:
+            message = ""
+        if message == "": # The server has closed the connection, e.g. it restarted
+            print("\nLost the connection to the server, reconnecting...")
+            s.close()
+            s = connect()
+            continue
         print(f"\nMESSAGE FROM SERVER: {message}")
         time.sleep(0.1)
 
-threading.Thread(target=client_thread, args=(s,), daemon=True).start()    
+threading.Thread(target=client_thread, daemon=True).start()    
 
 while True:
-    choice = input("Would you like to create a new planet or choose from a preset? (c/p/END): ")
+    choice = input("Would you like to create a new planet, choose from a preset, subscribe to updates or view the planets? (c/p/s/v/END): ")
     if (choice == "c"):
         name = input("Enter the name of the planet: ")
         x = input("Enter the x coordinate of the planet: ")
@@ -34,19 +84,34 @@ while True:
         print("1. Earth and Sun")
         print("2. Comet")
         print("3. Oops")
+        print("4. Comet swarm")
         preset = input("Enter the number of the preset: ")
         if (preset == "1"):
-            clientSendPlanet(s, sun)
-            time.sleep(0.1)
-            clientSendPlanet(s, earth)
+            clientSendPlanets(s, [sun, earth])
         elif (preset == "2"):
             comet = planet("Comet", 500, 300, 0.1, 0, 1000, 10e8)
             clientSendPlanet(s, comet)
-            time.sleep(0.1)
         elif (preset == "3"):
             comet = planet("Oops", 500, 400, 0, 0, 10e9, 100)
             clientSendPlanet(s, comet)
-            time.sleep(0.1)
+        elif (preset == "4"):
+            count = int(input("Enter the number of comets: "))
+            comets = [planet("Comet", random.uniform(50, 750), random.uniform(50, 550),
+                             random.uniform(-0.05, 0.05), random.uniform(-0.05, 0.05), 1000, 10e8)
+                      for i in range(count)]
+            clientSendPlanets(s, comets)
+    elif (choice == "s"):
+        rate = float(input("Enter the number of updates per second (0 to stop): "))
+        region = input("Enter a region x0 y0 x1 y1 to watch, or nothing for only your planets: ").split()
+        subscription = (rate, tuple(float(v) for v in region) if len(region) == 4 else None)
+        clientSendSubscribe(s, *subscription)
+        if rate <= 0:
+            subscription = None
+            view.clear()
+    elif (choice == "v"):
+        print(f"Tick {view.tick}, {len(view.planets)} planets:")
+        for id, p in sorted(view.planets.items()):
+            print(f"{id:>6} {p.name:<12} x {p.sx:8.2f} y {p.sy:8.2f} vx {p.vx:8.4f} vy {p.vy:8.4f} mass {p.mass:10.4g} life {p.life}")
     elif (choice == "END"):
         break
 
@@ -2,24 +2,434 @@
 #
 #   author: Dag Nystrom, 2023
 #
+import asyncio
+import itertools
+import selectors
 import socket
-import pickle
+import struct
+import threading
+from collections import OrderedDict
+from functools import partial
+from planet import planet
+import metrics
+
+##########################
+#### WIRE FORMAT
+##########################
+
+FRAME_HEADER = struct.Struct('!IB')
+'''Header in front of every message: payload length in bytes and message kind'''
+PLANET = struct.Struct('!5dqH')
+'''Fixed part of an encoded planet: sx, sy, vx, vy, mass, life and name length, followed by the UTF-8 name'''
+
+COUNT = struct.Struct('!I')
+'''Number of planets in a batch, followed by the encoded planets'''
+
+KIND_PLANET = 1
+KIND_PLANETS = 2
+KIND_HELLO = 3
+'''First message of a client: a UTF-8 token that identifies the client across reconnects'''
+KIND_SUBSCRIBE = 4
+'''Client asks for delta updates, see SUBSCRIBE'''
+KIND_TEXT = 5
+'''Server message to a client: a UTF-8 string'''
+KIND_DELTA = 6
+'''Server message to a subscribed client: changes of the planets it follows, see DELTA_HEADER'''
+
+SUBSCRIBE = struct.Struct('!f4f')
+'''Subscription: updates per second (0 ends the subscription) and a watched rectangle x0, y0, x1, y1.
+A client follows its own planets and all planets in the rectangle; an empty rectangle watches nothing.'''
+DELTA_HEADER = struct.Struct('!qI')
+'''Start of a delta update: tick and number of planets, each a DELTA_PLANET followed by its changed fields'''
+DELTA_PLANET = struct.Struct('!qB')
+'''Planet id (64 bits, like planetstore ids) and a bit mask of the fields that follow, in bit order'''
+
+DELTA_FIELDS = ('sx', 'sy', 'vx', 'vy', 'mass', 'life')
+DELTA_FORMATS = ('h', 'h', 'e', 'e', 'f', 'i')
+'''Encoding of each field: positions in 1/POSITION_SCALE pixels, velocities as half and mass as single precision floats'''
+POSITION_SCALE = 16
+DELTA_NAME = 1 << 6
+'''Bit for a planet new to the client: its name follows the fields, as a length byte and UTF-8'''
+DELTA_GONE = 1 << 7
+'''Bit for a planet the client no longer follows (removed, or out of the watched rectangle)'''
+
+BUFFER_SIZE = 65536
+'''Initial size of the receive buffer of each socket, grows if a larger message arrives'''
+MAX_FRAME = 1 << 24
+'''Largest payload accepted in one message, a peer announcing more is disconnected'''
+
+def packPlanet(p:object):
+    '''
+    Function to encode the fields of a planet object.
+        p:      the planet to encode
+    Returns the encoded planet as bytes
+    '''
+    name = str(p.name).encode('utf-8')
+    return PLANET.pack(float(p.sx), float(p.sy), float(p.vx), float(p.vy), float(p.mass),
+                       int(float(p.life)), len(name)) + name
+
+def unpackPlanet(data, offset=0):
+    '''
+    Function to decode a planet encoded by packPlanet.
+        data:   buffer holding the encoded planet
+        offset: position of the planet in the buffer
+    Returns the new planet object and the offset just after it
+    '''
+    sx, sy, vx, vy, mass, life, length = PLANET.unpack_from(data, offset)
+    offset += PLANET.size
+    name = str(data[offset:offset + length], 'utf-8')
+    return planet(name, sx, sy, vx, vy, mass, life), offset + length
+
+def packPlanets(planets):
+    '''
+    Function to encode a list of planet objects as one batch.
+        planets:    the planets to encode
+    Returns the encoded batch as bytes
+    '''
+    return COUNT.pack(len(planets)) + b''.join(packPlanet(p) for p in planets)
+
+def unpackPlanets(data):
+    '''
+    Function to decode a batch encoded by packPlanets.
+        data:   buffer holding the encoded batch
+    Returns a list of new planet objects
+    '''
+    count, = COUNT.unpack_from(data)
+    offset = COUNT.size
+    planets = []
+    for i in range(count):
+        p, offset = unpackPlanet(data, offset)
+        planets.append(p)
+    return planets
+
+def packFrame(kind:int, payload:bytes):
+    '''
+    Function to put a header in front of a message.
+        kind:       the message kind
+        payload:    the message
+    Returns the framed message as bytes
+    '''
+    return FRAME_HEADER.pack(len(payload), kind) + payload
+
+def _checkLength(length):
+    # A corrupt or hostile header must not make the receiver allocate gigabytes
+    if length > MAX_FRAME:
+        raise ValueError(f"Message of {length} bytes is larger than MAX_FRAME ({MAX_FRAME} bytes)")
+
+class framereader:
+    '''
+    Class that reads framed messages from a socket into a preallocated buffer.
+    Messages that arrive back-to-back in one recv are kept and returned one at a time.
+    '''
+    def __init__(self, sock:socket, size=BUFFER_SIZE):
+        self.sock = sock
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+        self.selector = None
+
+    def _fill(self, need):
+        # Receive until at least need bytes are buffered, returns False if the connection closed
+        while self.end - self.start < need:
+            if self.start + need > len(self.buf):
+                pending = self.end - self.start
+                if need > len(self.buf):
+                    buf = bytearray(max(need, 2 * len(self.buf)))
+                    buf[:pending] = self.view[self.start:self.end]
+                    self.buf = buf
+                    self.view = memoryview(buf)
+                else:
+                    self.buf[:pending] = self.buf[self.start:self.end]
+                self.start = 0
+                self.end = pending
+            try:
+                n = self.sock.recv_into(self.view[self.end:])
+            except BlockingIOError:
+                # The outbox writer has made the socket non-blocking, wait for data here instead
+                if self.selector is None:
+                    self.selector = selectors.DefaultSelector()
+                    self.selector.register(self.sock, selectors.EVENT_READ)
+                self.selector.select()
+                continue
+            if n == 0:
+                return False
+            metrics.current.count("bytes in", n)
+            self.end += n
+        return True
+
+    def recvFrame(self):
+        '''
+        Method that waits for the next message.
+        Returns the message kind and a memoryview of the payload, which is valid until the next call,
+        or None if the connection was closed. Raises ValueError if the payload is larger than MAX_FRAME.
+        '''
+        if not self._fill(FRAME_HEADER.size):
+            return None
+        length, kind = FRAME_HEADER.unpack_from(self.buf, self.start)
+        _checkLength(length)
+        if not self._fill(FRAME_HEADER.size + length):
+            return None
+        begin = self.start + FRAME_HEADER.size
+        self.start = begin + length
+        if self.start == self.end:
+            self.start = self.end = 0
+        return kind, self.view[begin:begin + length]
+
+_readers = {}
+
+def _reader(sock:socket):
+    # Each socket keeps its own buffer so bytes of the next message are not lost
+    reader = _readers.get(sock)
+    if reader is None:
+        reader = _readers[sock] = framereader(sock)
+    return reader
+
+##########################
+#### OUTBOUND QUEUES
+##########################
+
+OUTBOX_CAPACITY = 256
+'''Maximum number of messages waiting for one client, further messages are dropped'''
+OUTBOX_HIGH_WATER = 65536
+'''Encoded bytes kept ready to send per client, more messages stay queued (and can be coalesced) until it drains'''
+
+class outbox:
+    '''
+    Class for the bounded queue of messages waiting to be sent to one client.
+    Messages posted with the same key replace each other while they wait, so only the latest is sent.
+    '''
+    def __init__(self, sock, capacity=OUTBOX_CAPACITY):
+        self.sock = sock
+        self.capacity = capacity
+        self.queue = OrderedDict()
+        self.buffer = bytearray()
+        self.closed = False
+        self.nonblocking = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def depth(self):
+        '''
+        Method that returns the number of messages waiting to be sent.
+        '''
+        return len(self.queue)
+
+    def put(self, data:bytes, key=None):
+        '''
+        Method that queues a message without blocking. Must be called with the writer lock held.
+            data:   the encoded message
+            key:    messages with the same key are coalesced, None never coalesces
+        Returns True if the message was queued
+        '''
+        if self.closed:
+            self.dropped += 1
+            return False
+        if key is not None and key in self.queue:
+            self.queue[key] = data
+            self.coalesced += 1
+            return True
+        if len(self.queue) >= self.capacity:
+            self.dropped += 1
+            return False
+        self.queue[next(_unkeyed) if key is None else key] = data
+        return True
+
+    def flush(self):
+        # Send as much as the socket accepts now, returns True if bytes are left over
+        while self.queue and len(self.buffer) < OUTBOX_HIGH_WATER:
+            self.buffer += self.queue.popitem(last=False)[1]
+            self.sent += 1
+        if self.buffer:
+            if not self.nonblocking:
+                # The writer takes the socket over, it must never wait for one client
+                if hasattr(self.sock, 'setblocking'):
+                    self.sock.setblocking(False)
+                self.nonblocking = True
+            n = self.sock.send(self.buffer)
+            metrics.current.count("bytes out", n)
+            del self.buffer[:n]
+        return bool(self.buffer or self.queue)
+
+    def close(self):
+        # The client is gone, everything still waiting is dropped
+        self.closed = True
+        self.dropped += len(self.queue)
+        self.queue.clear()
+        self.buffer.clear()
+
+_unkeyed = itertools.count()
+
+class outboxwriter:
+    '''
+    Class for the thread that sends the queued messages of all clients. It never waits on a single
+    client: sockets that cannot take more data are watched with a selector until they can.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.outboxes = {}
+        self.ready = set()
+        self.waiting = {}
+        self.retired = {"sent": 0, "dropped": 0, "coalesced": 0}
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_r, self.wakeup_w = socket.socketpair()
+        self.wakeup_r.setblocking(False)
+        self.wakeup_w.setblocking(False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def post(self, sock, data:bytes, key=None):
+        '''
+        Method that queues a message for a client, see outbox.put.
+        '''
+        with self.lock:
+            box = self.outboxes.get(sock)
+            if box is None:
+                box = self.outboxes[sock] = outbox(sock)
+            queued = box.put(data, key)
+            if queued and box not in self.ready:
+                self.ready.add(box)
+                try:
+                    self.wakeup_w.send(b'\0')
+                except BlockingIOError:
+                    pass
+        return queued
+
+    def pending(self, sock):
+        '''
+        Method that returns the number of messages and bytes waiting to be sent to a client.
+        '''
+        with self.lock:
+            box = self.outboxes.get(sock)
+            return (0, 0) if box is None else (box.depth(), len(box.buffer))
+
+    def discard(self, sock):
+        '''
+        Method that forgets a client whose connection is closing, what is still queued for it is dropped.
+        Call it before the socket is closed.
+        '''
+        with self.lock:
+            box = self.outboxes.get(sock)
+            if box is not None:
+                box.close()
+                self._retire(box)
+
+    def _retire(self, box):
+        # Remove a closed outbox, keeping its counts for stats. Must be called with the lock held
+        if self.outboxes.get(box.sock) is box:
+            del self.outboxes[box.sock]
+            for name in self.retired:
+                self.retired[name] += getattr(box, name)
+        self.ready.discard(box)
+        if self.waiting.get(box.sock) is box:
+            del self.waiting[box.sock]
+            try:
+                self.selector.unregister(box.sock)
+            except (KeyError, ValueError):
+                pass
+
+    def _writable(self, box):
+        # Called from another thread once a stand-in socket can take more
+        with self.lock:
+            if self.waiting.get(box.sock) is box:
+                del self.waiting[box.sock]
+                self.ready.add(box)
+                try:
+                    self.wakeup_w.send(b'\0')
+                except BlockingIOError:
+                    pass
+
+    def stats(self):
+        '''
+        Method that returns the number of clients, messages waiting and messages sent, dropped and coalesced.
+        '''
+        with self.lock:
+            boxes = list(self.outboxes.values())
+            return {"clients": len(boxes),
+                    "depth": sum(box.depth() for box in boxes),
+                    "sent": self.retired["sent"] + sum(box.sent for box in boxes),
+                    "dropped": self.retired["dropped"] + sum(box.dropped for box in boxes),
+                    "coalesced": self.retired["coalesced"] + sum(box.coalesced for box in boxes)}
+
+    def _run(self):
+        while True:
+            events = self.selector.select()
+            with self.lock:
+                for key, mask in events:
+                    if key.fileobj is self.wakeup_r:
+                        try:
+                            self.wakeup_r.recv(4096)
+                        except BlockingIOError:
+                            pass
+                    elif key.fileobj in self.waiting:
+                        # Not there if discard has just removed it
+                        self.selector.unregister(key.fileobj)
+                        self.ready.add(self.waiting.pop(key.fileobj))
+                ready, self.ready = self.ready, set()
+                for box in ready:
+                    if box.closed or box.sock in self.waiting:
+                        continue
+                    try:
+                        more = box.flush()
+                    except BlockingIOError:
+                        more = True
+                    except (OSError, ValueError):
+                        # The connection is gone
+                        box.close()
+                        self._retire(box)
+                        continue
+                    if not more:
+                        continue
+                    if box.buffer:
+                        # Wait until the socket can take more
+                        try:
+                            if hasattr(box.sock, 'notify_writable'):
+                                # A stand-in such as aioclient, it cannot be selected on
+                                box.sock.notify_writable(partial(self._writable, box))
+                            else:
+                                self.selector.register(box.sock, selectors.EVENT_WRITE)
+                            self.waiting[box.sock] = box
+                        except (OSError, ValueError):
+                            box.close()
+                            self._retire(box)
+                    else:
+                        self.ready.add(box)
+                if self.ready:
+                    try:
+                        self.wakeup_w.send(b'\0')
+                    except BlockingIOError:
+                        pass
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def _outboxes():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = outboxwriter()
+    return _writer
+
 
 ##########################
 #### SERVER-SIDE FUNCTIONS
 ##########################
 
-def serverInitSocket (ip='127.0.0.1', port=12347):
+def serverInitSocket (ip='127.0.0.1', port=12347, backlog=1):
     '''
     Server-side function to create a socket for new client connections.
-        ip:     a string containing the IP address to the server, default is localhost.
-        port:   an int containing the port to listen to, default is 12345
+        ip:         a string containing the IP address to the server, default is localhost.
+        port:       an int containing the port to listen to, default is 12345
+        backlog:    number of pending connections the operating system queues, default is 1
     Returns a socket object
     '''
     serverSocket: socket
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # A restarted server can listen again at once, without waiting for old connections to time out
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server_socket.bind((ip, port))
-    server_socket.listen(1)
+    server_socket.listen(backlog)
 
     return server_socket
 
@@ -37,36 +447,154 @@ def serverWaitForNewClient(serverSocket:socket):
 
 def serverSendString(clientSocket:socket, mess:str):
     '''
-    Server-side function to transmit a string from the server to the client via the client socket
+    Server-side function to transmit a string from the server to the client via the client socket.
+    Do not use it on a socket that messages have been posted to, the outbox writer makes that socket non-blocking.
         clientSocket:   the socket to transmit on
         mess:           the message to transmit
     '''
 #   Note: Function must transform UNICODE strings to byte strings
-    small_message = mess.encode('utf-8')
+    small_message = packFrame(KIND_TEXT, mess.encode('utf-8'))
     clientSocket.sendall(small_message)
+    metrics.current.count("bytes out", len(small_message))
 
     return
 
+def serverPostString(clientSocket:socket, mess:str, key=None):
+    '''
+    Server-side function to queue a string for the client without waiting for it to be sent.
+    A writer thread sends queued strings in the background, a slow or dead client only loses its own messages.
+        clientSocket:   the socket to transmit on
+        mess:           the message to transmit
+        key:            optional key, a waiting message with the same key is replaced by this one
+    Returns True if the message was queued, False if it was dropped
+    '''
+    return serverPostFrame(clientSocket, KIND_TEXT, mess.encode('utf-8'), key)
+
+def serverPostFrame(clientSocket:socket, kind:int, payload:bytes, key=None):
+    '''
+    Server-side function to queue any message for the client, see serverPostString.
+        clientSocket:   the socket to transmit on
+        kind:           the message kind
+        payload:        the encoded message
+        key:            optional key, a waiting message with the same key is replaced by this one
+    Returns True if the message was queued, False if it was dropped
+    '''
+    if clientSocket is None:
+        return False
+    return _outboxes().post(clientSocket, packFrame(kind, payload), key)
+
+def serverOutboxPending(clientSocket:socket):
+    '''
+    Server-side function that returns the number of messages and bytes still waiting to be sent to a client.
+    '''
+    return _outboxes().pending(clientSocket)
+
+def serverForgetClient(clientSocket:socket):
+    '''
+    Server-side function to drop the queued messages and the receive buffer of a client whose connection is closing.
+    Call it before the socket is closed, messages posted to the socket afterwards are queued again.
+        clientSocket:   the socket of the client
+    '''
+    _readers.pop(clientSocket, None)
+    if _writer is not None:
+        _writer.discard(clientSocket)
+
+def serverOutboxStats():
+    '''
+    Server-side function to get the state of the outbound queues.
+    Returns a dict with the number of clients, messages waiting and messages sent, dropped and coalesced
+    '''
+    return _outboxes().stats()
+
 def serverRecvPlanet(clientSocket:socket):
     '''
     Server-side function to receive a planet object from a client over the client socket.
     The function waits until it receives a planet.
         clientSocket:   the socket to receive from
-    Returns the planet object
+    Returns the planet object, or None if the client closed the connection
     '''
-#   Note: Function must recreate object from bytestring
-    data = b''
-    while True:
-        packet = clientSocket.recv(4096)
-        if not packet:
-            break
-        data += packet
-        try:
-            planet = pickle.loads(data)
-            return planet
-        except (pickle.UnpicklingError, EOFError):
-            continue
+    frame = _reader(clientSocket).recvFrame()
+    if frame is None:
+        return None
+    kind, payload = frame
+    if kind != KIND_PLANET:
+        raise ValueError(f"Unexpected message kind {kind}")
+    return unpackPlanet(payload)[0]
 
+def serverRecvPlanets(clientSocket:socket):
+    '''
+    Server-side function to receive the next planet or batch of planets from a client over the client socket.
+    The function waits until it receives a message.
+        clientSocket:   the socket to receive from
+    Returns a list of planet objects, or None if the client closed the connection
+    '''
+    frame = _reader(clientSocket).recvFrame()
+    if frame is None:
+        return None
+    return _planetsFromFrame(*frame)
+
+async def serverRecvPlanetsAsync(reader):
+    '''
+    Server-side coroutine to receive the next planet or batch of planets from an asyncio stream.
+        reader:     the asyncio.StreamReader of the client connection
+    Returns a list of planet objects, or None if the client closed the connection
+    '''
+    try:
+        length, kind = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+        _checkLength(length)
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+    metrics.current.count("bytes in", FRAME_HEADER.size + length)
+    return _planetsFromFrame(kind, payload)
+
+def serverRecvMessage(clientSocket:socket):
+    '''
+    Server-side function to receive the next message of any kind from a client over the client socket.
+    The function waits until it receives a message.
+        clientSocket:   the socket to receive from
+    Returns (KIND_HELLO, token), (KIND_SUBSCRIBE, (rate, region)) or (KIND_PLANETS, list of planet objects),
+    or None if the client closed the connection
+    '''
+    frame = _reader(clientSocket).recvFrame()
+    if frame is None:
+        return None
+    return _messageFromFrame(*frame)
+
+async def serverRecvMessageAsync(reader):
+    '''
+    Server-side coroutine to receive the next message of any kind from an asyncio stream, see serverRecvMessage.
+        reader:     the asyncio.StreamReader of the client connection
+    '''
+    try:
+        length, kind = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+        _checkLength(length)
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+    metrics.current.count("bytes in", FRAME_HEADER.size + length)
+    return _messageFromFrame(kind, payload)
+
+def _messageFromFrame(kind, payload):
+    if kind == KIND_HELLO:
+        return KIND_HELLO, str(payload, 'utf-8')
+    if kind == KIND_SUBSCRIBE:
+        rate, x0, y0, x1, y1 = SUBSCRIBE.unpack_from(payload)
+        return KIND_SUBSCRIBE, (rate, (x0, y0, x1, y1))
+    return KIND_PLANETS, _planetsFromFrame(kind, payload)
+
+def _planetsFromFrame(kind, payload):
+    m = metrics.current
+    start = m.clock()
+    if kind == KIND_PLANET:
+        planets = [unpackPlanet(payload)[0]]
+    elif kind == KIND_PLANETS:
+        planets = unpackPlanets(payload)
+    else:
+        raise ValueError(f"Unexpected message kind {kind}")
+    m.since("decode", start)
+    m.count("planets received", len(planets))
+    return planets
 
 
 
@@ -86,26 +614,126 @@ def clientInitSocket (ip='127.0.0.1',port=12347):
     client_socket.connect((ip, port))
     return client_socket
 
-def clientRecvString(clientSocket:socket):
+class planetview:
+    '''
+    Class for the client-side copy of the planets a subscribed client follows, kept up to date from delta updates.
+    planets maps planet ids to planet objects; positions are accurate to 1/POSITION_SCALE pixels.
+    '''
+    def __init__(self):
+        self.planets = {}
+        self.tick = -1
+        self.updates = 0
+        self.formats = {}
+
+    def _format(self, mask):
+        # Struct for the fields of one planet with a given mask, made once per mask
+        f = self.formats.get(mask)
+        if f is None:
+            f = self.formats[mask] = struct.Struct('!' + ''.join(fmt for bit, fmt in enumerate(DELTA_FORMATS) if mask >> bit & 1))
+        return f
+
+    def apply(self, payload):
+        '''
+        Method that applies one delta update.
+            payload:    the payload of a KIND_DELTA message
+        '''
+        self.tick, count = DELTA_HEADER.unpack_from(payload)
+        offset = DELTA_HEADER.size
+        for i in range(count):
+            id, mask = DELTA_PLANET.unpack_from(payload, offset)
+            offset += DELTA_PLANET.size
+            if mask & DELTA_GONE:
+                self.planets.pop(id, None)
+                continue
+            f = self._format(mask & ~DELTA_NAME)
+            values = f.unpack_from(payload, offset)
+            offset += f.size
+            p = self.planets.get(id)
+            if mask & DELTA_NAME:
+                length = payload[offset]
+                p = self.planets[id] = planet(str(payload[offset + 1:offset + 1 + length], 'utf-8'), 0.0, 0.0, 0.0, 0.0, 0.0, 0)
+                offset += 1 + length
+            elif p is None: # Changes of a planet forgotten by clear
+                continue
+            fields = (name for bit, name in enumerate(DELTA_FIELDS) if mask >> bit & 1)
+            for name, value in zip(fields, values):
+                setattr(p, name, value / POSITION_SCALE if name in ('sx', 'sy') else value)
+        self.updates += 1
+
+    def clear(self):
+        '''
+        Method that forgets all planets, e.g. after a reconnect, where the server starts over with full updates.
+        '''
+        self.planets.clear()
+        self.tick = -1
+
+def clientRecvString(clientSocket:socket, view:planetview=None):
     '''
-    Client-side function to receive a string from the server over a socket
+    Client-side function to receive a string from the server over a socket.
+    Delta updates that arrive before the string are applied to view (or skipped if there is no view).
         clientSocket:   the socket used for communication with the server
-    Returns the string.
+        view:           optional planetview to keep up to date
+    Returns the string, or an empty string if the server closed the connection.
     '''
     message:str
-    data = clientSocket.recv(4096)
-    return data.decode('utf-8')
+    while True:
+        frame = _reader(clientSocket).recvFrame()
+        if frame is None:
+            return ""
+        kind, payload = frame
+        if kind == KIND_TEXT:
+            return str(payload, 'utf-8')
+        if kind == KIND_DELTA and view is not None:
+            view.apply(payload)
 
 def clientSendPlanet(clientSocket:socket, p:object):
     '''
     Client-side function to send a planet object to the server over a socket
         clientSocket:   the socket used for communication with the server
         p:              the planet object to transmit'''
-#   Note: Function must transform object into bytestring
-    convert_byte = pickle.dumps(p)
-    clientSocket.sendall(convert_byte)
+    clientSocket.sendall(packFrame(KIND_PLANET, packPlanet(p)))
 
     return
 
     
-    
\ No newline at end of file
+    
+
+def clientSendHello(clientSocket:socket, token:str):
+    '''
+    Client-side function to tell the server who the client is. Sent first on every connection, the server
+    then sends messages about planets the client created earlier (before a reconnect) to this connection.
+        clientSocket:   the socket used for communication with the server
+        token:          a string that is the same every time this client connects'''
+    clientSocket.sendall(packFrame(KIND_HELLO, token.encode('utf-8')))
+
+    return
+
+def clientSendSubscribe(clientSocket:socket, rate:float, region=None):
+    '''
+    Client-side function to ask for delta updates of the client's own planets and a watched region, see planetview.
+        clientSocket:   the socket used for communication with the server
+        rate:           wanted updates per second, the server may send fewer; 0 ends the subscription
+        region:         optional rectangle (x0, y0, x1, y1) whose planets are followed too'''
+    clientSocket.sendall(packFrame(KIND_SUBSCRIBE, SUBSCRIBE.pack(rate, *(region or (0, 0, 0, 0)))))
+
+    return
+
+def clientSendPlanets(clientSocket:socket, planets:list):
+    '''
+    Client-side function to send a list of planet objects to the server as one message,
+    or several if they do not fit in MAX_FRAME bytes
+        clientSocket:   the socket used for communication with the server
+        planets:        the planet objects to transmit'''
+    batch = []
+    size = COUNT.size
+    for data in map(packPlanet, planets):
+        if batch and size + len(data) > MAX_FRAME:
+            clientSocket.sendall(packFrame(KIND_PLANETS, COUNT.pack(len(batch)) + b''.join(batch)))
+            batch = []
+            size = COUNT.size
+        batch.append(data)
+        size += len(data)
+    if batch or not planets:
+        clientSocket.sendall(packFrame(KIND_PLANETS, COUNT.pack(len(batch)) + b''.join(batch)))
+
+    return
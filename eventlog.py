@@ -0,0 +1,154 @@
+#Module for the event log of received planets for DVA248 Datorsystem
+#
+#   Every batch of planets is logged with the tick it entered the universe at.
+#   With the same settings (and start checkpoint, if any), replaying the log
+#   gives exactly the same simulation, as fast as the CPU allows.
+#
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+from cscomm import packPlanets, unpackPlanets
+
+HEADER = struct.Struct('<4sHI')
+'''Start of an event log: magic, format version and length of the settings, followed by the settings as JSON'''
+RECORD = struct.Struct('<qI')
+'''Start of each event: tick and length of the planets, followed by the planets encoded as by cscomm.packPlanets'''
+MAGIC = b'PEVL'
+VERSION = 1
+
+class eventlogwriter:
+    '''
+    Class that appends batches of planets to an event log.
+    '''
+    def __init__(self, path, settings):
+        '''
+        Constructor that creates (or truncates) the log.
+            path:       name of the log file
+            settings:   dict with the keyword arguments of the universe, the tick logging starts at and,
+                        if the universe was restored, the name of a copy of its start checkpoint next to the log
+        '''
+        self.f = open(path, 'wb')
+        settings = json.dumps(settings).encode('utf-8')
+        self.f.write(HEADER.pack(MAGIC, VERSION, len(settings)) + settings)
+        self.f.flush()
+        self.events = 0
+
+    def append(self, tick, planets):
+        '''
+        Method that logs a batch of planets.
+            tick:       the tick the planets entered the universe at
+            planets:    the planets
+        '''
+        payload = packPlanets(planets)
+        self.f.write(RECORD.pack(tick, len(payload)))
+        self.f.write(payload)
+        self.events += 1
+
+    def flush(self):
+        '''
+        Method that makes all logged batches reach the file, so it can be replayed while the server runs.
+        '''
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+def readEventLog(path):
+    '''
+    Function that opens an event log.
+        path:   name of the log file
+    Returns the settings and a generator of (tick, planets) pairs; a batch still being written is left out
+    '''
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, length = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not an event log")
+    settings = json.loads(data[HEADER.size:HEADER.size + length])
+
+    def events():
+        offset = HEADER.size + length
+        while offset + RECORD.size <= len(data):
+            tick, size = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            if offset + size > len(data):
+                break
+            yield tick, unpackPlanets(memoryview(data)[offset:offset + size])
+            offset += size
+    return settings, events()
+
+def replay(path, checkpoint_path=None, extra=0, workers=None):
+    '''
+    Function that runs a logged simulation again in a headless universe, without waiting between ticks.
+        path:               name of the log file
+        checkpoint_path:    checkpoint the server was restored from when the log was started,
+                            None uses the copy named in the log, if any
+        extra:              number of ticks to run after the last logged batch
+        workers:            number of processes for the force computation, see universe (not for sharded logs)
+    Returns the universe and a list with the duration of every tick in seconds
+    '''
+    # Imported here, the server imports this module for the writer
+    from server import universe
+    from shards import shardeduniverse
+    from checkpoint import checkpoint
+
+    settings, events = readEventLog(path)
+    start = settings.pop('tick')
+    saved = settings.pop('checkpoint', None)
+    if checkpoint_path is None and saved is not None:
+        checkpoint_path = os.path.join(os.path.dirname(path), saved)
+    u = shardeduniverse(**settings) if 'shards' in settings else universe(workers=workers, **settings)
+    if checkpoint_path is not None:
+        u.restore(checkpoint(checkpoint_path))
+    if u.tick != start:
+        raise ValueError(f"The log starts at tick {start} but the universe is at tick {u.tick}")
+    durations = []
+
+    def advance():
+        t0 = time.perf_counter()
+        u.advance()
+        durations.append(time.perf_counter() - t0)
+
+    for tick, planets in events:
+        while u.tick < tick:
+            advance()
+        u.submit(planets)
+    last = u.tick + (1 if u.pending else 0)
+    while u.tick < last + extra:
+        advance()
+    return u, durations
+
+def fingerprint(state):
+    '''
+    Function that returns a short hash of a snapshot (see planetstore.snapshot), equal for bit-identical states.
+    '''
+    digest = hashlib.sha1()
+    for column in ('ids', 'sx', 'sy', 'vx', 'vy', 'mass', 'life'):
+        digest.update(getattr(state, column).tobytes())
+    return digest.hexdigest()[:16]
+
+
+if __name__ == '__main__':
+    import argparse
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description="Replay a planet server event log")
+    parser.add_argument("path", help="event log written with server.py --event-log")
+    parser.add_argument("--checkpoint", help="checkpoint the server was restored from when the log was started "
+                                             "(default: the copy saved next to the log)")
+    parser.add_argument("--extra", type=int, default=0, help="ticks to run after the last logged batch")
+    parser.add_argument("--workers", type=int, help="split the force computation over this many processes")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    u, durations = replay(args.path, args.checkpoint, args.extra, args.workers)
+    elapsed = time.perf_counter() - t0
+    ms = np.array(durations) * 1000 if durations else np.zeros(1)
+    print(f"{len(durations)} ticks in {elapsed:.2f} s ({len(durations) / elapsed:.0f} ticks/s), "
+          f"{len(u.latest())} planets left at tick {u.tick}")
+    print(f"tick ms: p50 {np.percentile(ms, 50):.2f}, p90 {np.percentile(ms, 90):.2f}, "
+          f"p99 {np.percentile(ms, 99):.2f}, max {ms.max():.2f} (slowest tick {u.tick - len(durations) + int(ms.argmax())})")
+    print("state fingerprint", fingerprint(u.latest()))
@@ -0,0 +1,199 @@
+#Module for time integrators for DVA248 Datorsystem
+#
+#   An integrator advances positions and velocities of all bodies by one tick:
+#     euler:      the semi-implicit Euler formula of universe.calculate_planet_pos
+#     leapfrog:   velocity Verlet (kick-drift-kick), second order and time reversible
+#     blockstep:  leapfrog with a power-of-two sub-step per body, only bodies in
+#                 close encounters take short steps
+#   All of them take the acceleration function as a parameter, see nbody.accelerations.
+#
+import numpy as np
+import nbody
+
+class euler:
+    '''
+    Class for the semi-implicit Euler integrator, the same formula as universe.calculate_planet_pos.
+    '''
+    def __init__(self):
+        self.evaluations = 0
+
+    def step(self, sx, sy, vx, vy, mass, dt, accel, ids=None):
+        '''
+        Method that advances all bodies one timestep in place.
+            sx,sy,vx,vy,mass:   arrays holding the state of all bodies
+            dt:                 the timestep
+            accel:              function used to compute the accelerations
+            ids:                ids of the bodies, not used by this integrator
+        '''
+        ax, ay = accel(sx, sy, mass)
+        self.evaluations += len(sx)
+        vx += ax * dt
+        vy += ay * dt
+        sx += vx * dt
+        sy += vy * dt
+
+class leapfrog(euler):
+    '''
+    Class for the velocity Verlet (kick-drift-kick leapfrog) integrator.
+    The accelerations at the end of a step are kept for the start of the next one, so a step costs
+    one acceleration evaluation. They are recomputed when the set of bodies has changed.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.ids = None
+        self.ax = self.ay = None
+
+    def _start(self, sx, sy, mass, accel, ids):
+        # Accelerations at the start of the step, from the cache if the bodies are the same
+        if ids is None or self.ids is None or not np.array_equal(ids, self.ids):
+            self.ax, self.ay = accel(sx, sy, mass)
+            self.evaluations += len(sx)
+        return self.ax, self.ay
+
+    def _finish(self, ids):
+        self.ids = None if ids is None else np.array(ids)
+
+    def step(self, sx, sy, vx, vy, mass, dt, accel, ids=None):
+        '''
+        Method that advances all bodies one timestep in place, see euler.step.
+            ids:    ids of the bodies, used to tell if the cached accelerations still apply
+        '''
+        ax, ay = self._start(sx, sy, mass, accel, ids)
+        vx += ax * (dt / 2)
+        vy += ay * (dt / 2)
+        sx += vx * dt
+        sy += vy * dt
+        self.ax, self.ay = accel(sx, sy, mass)
+        self.evaluations += len(sx)
+        vx += self.ax * (dt / 2)
+        vy += self.ay * (dt / 2)
+        self._finish(ids)
+
+class blockstep(leapfrog):
+    '''
+    Class for a hierarchical block timestep leapfrog. A tick is divided into 2**levels sub-steps and every
+    body takes steps of a power-of-two number of sub-steps, the longest not over eta * sqrt(length / |a|)
+    (the free-fall time over length). A body picks its next step each time one ends, so it can go
+    to shorter steps at once when it enters a close encounter. All bodies drift together, but only
+    bodies at the end of a step get new accelerations, so bodies far from others cost as much as with leapfrog.
+    '''
+    def __init__(self, eta=0.1, length=1.0, levels=10):
+        '''
+        Constructor for the integrator.
+            eta:        accuracy parameter, smaller gives shorter steps
+            length:     length scale of the timestep criterion, in pixels
+            levels:     maximum number of halvings of the timestep
+        '''
+        super().__init__()
+        self.eta = eta
+        self.length = length
+        self.levels = levels
+        self.substeps = 0
+
+    def _strides(self, ax, ay, dt, now):
+        # Longest allowed step of each body in sub-steps, it must start and end on a multiple of itself
+        with np.errstate(divide='ignore'):
+            wanted = self.eta * np.sqrt(self.length / np.sqrt(ax * ax + ay * ay))
+            level = np.ceil(np.log2(dt / wanted))
+        level = np.clip(np.nan_to_num(level, nan=0.0, neginf=0.0), 0, self.levels).astype(np.int64)
+        stride = (1 << self.levels) >> level
+        while True:
+            early = now % stride != 0
+            if not early.any():
+                return stride
+            stride[early] >>= 1
+
+    def step(self, sx, sy, vx, vy, mass, dt, accel, ids=None):
+        '''
+        Method that advances all bodies one timestep in place, see leapfrog.step.
+        '''
+        if len(sx) == 0:
+            # No bodies, no steps to schedule
+            self._finish(ids)
+            return
+        ax, ay = self._start(sx, sy, mass, accel, ids)
+        end = 1 << self.levels
+        h = dt / end
+        stride = self._strides(ax, ay, dt, 0)
+        vx += ax * (stride * h / 2)
+        vy += ay * (stride * h / 2)
+        now = 0
+        until = stride.copy()
+        while now < end:
+            later = int(until.min())
+            sx += vx * ((later - now) * h)
+            sy += vy * ((later - now) * h)
+            now = later
+            ending = np.flatnonzero(until == now)
+            ax[ending], ay[ending] = accel(sx, sy, mass, ending)
+            self.evaluations += len(ending)
+            self.substeps += 1
+            vx[ending] += ax[ending] * (stride[ending] * h / 2)
+            vy[ending] += ay[ending] * (stride[ending] * h / 2)
+            if now < end:
+                # Start the next step of these bodies, with a step length for their new acceleration
+                stride[ending] = self._strides(ax[ending], ay[ending], dt, now)
+                vx[ending] += ax[ending] * (stride[ending] * h / 2)
+                vy[ending] += ay[ending] * (stride[ending] * h / 2)
+                until[ending] = now + stride[ending]
+        self._finish(ids)
+
+INTEGRATORS = {"euler": euler, "leapfrog": leapfrog, "block": blockstep}
+'''Integrators by the names used on the server command line'''
+
+def energy(sx, sy, vx, vy, mass):
+    '''
+    Function that computes the total (kinetic plus potential) energy of the bodies.
+        sx,sy,vx,vy,mass:   arrays holding the state of all bodies
+    '''
+    kinetic = 0.5 * (mass * (vx * vx + vy * vy)).sum()
+    potential = 0.0
+    rows_per_block = max(1, nbody.BLOCK // max(1, len(sx)))
+    for lo in range(0, len(sx), rows_per_block):
+        rows = np.arange(lo, min(lo + rows_per_block, len(sx)))
+        r = np.hypot(sx[None, :] - sx[rows, None], sy[None, :] - sy[rows, None])
+        # Each pair once, coincident bodies are skipped as in nbody.accelerations
+        keep = (np.arange(len(sx))[None, :] > rows[:, None]) & (r > 0)
+        potential -= nbody.G * (mass[rows, None] * mass[None, :] / np.where(keep, r, np.inf)).sum()
+    return kinetic + potential
+
+
+if __name__ == '__main__':
+    # Energy drift of each integrator over the same simulated time, for growing timesteps
+    import time
+    from planet import planet
+
+    def system(name):
+        sun = planet("Sun", 300, 300, 0, 0, 10e8, 10e8)
+        earth = planet("Earth", 200, 300, 0, 0.008, 1000, 10e8)
+        if name == "Comet":
+            # Eccentric orbit that passes a few pixels from the sun
+            return [sun, earth, planet("Comet", 500, 300, 0, 0.004, 1000, 10e8)]
+        # The Oops preset, moving so that it passes the sun instead of falling straight into it
+        return [sun, earth, planet("Oops", 500, 400, 0, -0.03, 10e9, 100)]
+
+    # An empty universe, as the server starts with
+    for key, make in INTEGRATORS.items():
+        empty = [np.zeros(0) for i in range(5)]
+        make().step(*empty, 10, nbody.accelerations, np.zeros(0, np.int64))
+    print("all integrators step an empty universe")
+
+    duration = 30000
+    print(f"{'system':>7} {'dt':>4} {'integrator':>10} {'energy drift':>13} {'evaluations':>12} {'ms/tick':>8}")
+    for name in ("Comet", "Oops"):
+        for dt in (10, 40, 160):
+            for key, make in INTEGRATORS.items():
+                state = nbody.nbody(system(name))
+                integrator = make()
+                ids = np.arange(len(state))
+                ticks = duration // dt
+                e0 = energy(state.sx, state.sy, state.vx, state.vy, state.mass)
+                worst = elapsed = 0.0
+                for i in range(ticks):
+                    t0 = time.perf_counter()
+                    integrator.step(state.sx, state.sy, state.vx, state.vy, state.mass, dt, nbody.accelerations, ids)
+                    elapsed += time.perf_counter() - t0
+                    e = energy(state.sx, state.sy, state.vx, state.vy, state.mass)
+                    worst = max(worst, abs((e - e0) / e0))
+                print(f"{name:>7} {dt:>4} {key:>10} {worst:>13.2e} {integrator.evaluations / ticks / len(state):>12.2f} "
+                      f"{elapsed / ticks * 1000:>8.3f}")
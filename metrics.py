@@ -0,0 +1,250 @@
+#Module for server metrics for DVA248 Datorsystem
+#
+#   Durations are recorded in histograms with four buckets per power of two
+#   nanoseconds, so recording is a few integer operations and percentiles are
+#   within 25%. Counters count events and bytes. Updates from all threads take
+#   one lock, so no count is lost. The module-level object current is a null
+#   object that ignores everything until enable is called, so turned off
+#   metrics cost one empty method call per hook.
+#
+import socket
+import threading
+import time
+
+clock = time.perf_counter
+'''Clock used for all durations, in seconds'''
+
+BUCKETS = 256
+
+class histogram:
+    '''
+    Class for a histogram of durations. It has no lock of its own, metrics updates it under its lock.
+    '''
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        '''
+        Method that adds one duration.
+            seconds:    the duration
+        '''
+        ns = int(seconds * 1e9)
+        if ns < 4:
+            index = max(ns, 0)
+        else:
+            e = ns.bit_length() - 1
+            index = min(4 * (e - 1) + ((ns >> (e - 2)) & 3), BUCKETS - 1)
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @staticmethod
+    def _upper(index):
+        # Largest duration (in seconds) that falls in a bucket
+        if index < 4:
+            return (index + 1) * 1e-9
+        e, sub = index // 4 + 1, index % 4
+        return ((5 + sub) << (e - 2)) * 1e-9
+
+    def quantile(self, q):
+        '''
+        Method that returns an upper bound of the q quantile (0 <= q <= 1) of the durations, in seconds.
+        '''
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(histogram._upper(index), self.max)
+        return self.max
+
+    def summary(self):
+        '''
+        Method that returns a dict with the count and the mean, p50, p90, p99 and max durations in milliseconds.
+        '''
+        return {"count": self.count,
+                "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+                "p50_ms": self.quantile(0.5) * 1000,
+                "p90_ms": self.quantile(0.9) * 1000,
+                "p99_ms": self.quantile(0.99) * 1000,
+                "max_ms": self.max * 1000}
+
+class metrics:
+    '''
+    Class that collects named histograms and counters, from any thread.
+    '''
+    enabled = True
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.started = clock()
+        self.lock = threading.Lock()
+
+    def clock(self):
+        '''
+        Method that returns the time to pass to since later.
+        '''
+        return clock()
+
+    def record(self, name, seconds):
+        '''
+        Method that adds a duration to a histogram.
+            name:       name of the histogram, created on first use
+            seconds:    the duration
+        '''
+        with self.lock:
+            h = self.histograms.get(name)
+            if h is None:
+                h = self.histograms[name] = histogram()
+            h.record(seconds)
+
+    def since(self, name, start):
+        '''
+        Method that records the time since start (from clock) in a histogram. Returns the current time.
+        '''
+        now = clock()
+        self.record(name, now - start)
+        return now
+
+    def count(self, name, n=1):
+        '''
+        Method that adds n to a counter.
+            name:   name of the counter, created on first use
+        '''
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        '''
+        Method that returns all metrics as a dict: uptime in seconds, counters and histogram summaries.
+        '''
+        with self.lock:
+            return {"uptime": clock() - self.started,
+                    "counters": dict(self.counters),
+                    "histograms": {name: h.summary() for name, h in self.histograms.items()}}
+
+    def format(self):
+        '''
+        Method that returns all metrics as a text table.
+        '''
+        report = self.report()
+        lines = [f"uptime {report['uptime']:.1f} s"]
+        for name, value in sorted(report["counters"].items()):
+            lines.append(f"{name:<24} {value:>14}")
+        lines.append(f"{'duration':<24} {'count':>8} {'mean ms':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for name, h in sorted(report["histograms"].items()):
+            lines.append(f"{name:<24} {h['count']:>8} {h['mean_ms']:>9.3f} {h['p50_ms']:>9.3f} "
+                         f"{h['p90_ms']:>9.3f} {h['p99_ms']:>9.3f} {h['max_ms']:>9.3f}")
+        return "\n".join(lines) + "\n"
+
+class nullmetrics:
+    '''
+    Class with the same methods as metrics that does nothing, used when metrics are turned off.
+    '''
+    enabled = False
+
+    def clock(self):
+        return 0.0
+
+    def record(self, name, seconds):
+        pass
+
+    def since(self, name, start):
+        return 0.0
+
+    def count(self, name, n=1):
+        pass
+
+    def report(self):
+        return {}
+
+    def format(self):
+        return "Metrics are turned off\n"
+
+current = nullmetrics()
+'''The metrics object all hooks report to'''
+
+def enable(on=True):
+    '''
+    Function that turns metrics on (with empty histograms and counters) or off.
+    Returns the new metrics object.
+    '''
+    global current
+    current = metrics() if on else nullmetrics()
+    return current
+
+def serveStats(port, ip='127.0.0.1', extra=None):
+    '''
+    Function that starts a thread answering every connection to a local port with the metrics table,
+    e.g. read it with "nc localhost port".
+        port:   port to listen on
+        ip:     address to listen on, local only by default
+        extra:  optional function returning more text to add to the table
+    '''
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind((ip, port))
+    server_socket.listen(4)
+
+    def run():
+        while True:
+            conn, addr = server_socket.accept()
+            try:
+                conn.sendall((current.format() + (extra() if extra else "")).encode('utf-8'))
+            except OSError:
+                pass
+            conn.close()
+    threading.Thread(target=run, daemon=True).start()
+    return server_socket
+
+def dumpStats(every, extra=None):
+    '''
+    Function that starts a thread printing the metrics table every few seconds.
+        every:  seconds between tables
+        extra:  optional function returning more text to add to the table
+    '''
+    def run():
+        while True:
+            time.sleep(every)
+            print(current.format() + (extra() if extra else ""), end="", flush=True)
+    threading.Thread(target=run, daemon=True).start()
+
+
+if __name__ == '__main__':
+    # Cost of a hook with metrics on and off, and accuracy of the percentiles
+    import random
+
+    for m in (nullmetrics(), metrics()):
+        t0 = clock()
+        for i in range(200000):
+            m.since("hook", m.clock())
+        print(f"{type(m).__name__}: {(clock() - t0) / 200000 * 1e9:.0f} ns per hook")
+    m = metrics()
+    samples = sorted(random.expovariate(1000) for i in range(100000))
+    for s in samples:
+        m.record("test", s)
+    h = m.histograms["test"]
+    for q in (0.5, 0.9, 0.99):
+        exact = samples[int(q * len(samples)) - 1]
+        print(f"p{int(q * 100)}: exact {exact * 1000:.3f} ms, histogram {h.quantile(q) * 1000:.3f} ms")
+
+    # No counts are lost when threads count at the same time
+    m = metrics()
+    def work():
+        for i in range(100000):
+            m.count("events")
+            m.record("hook", 1e-6)
+    threads = [threading.Thread(target=work) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print("8 threads counted 800000:", m.counters["events"] == 800000 and m.histograms["hook"].count == 800000)
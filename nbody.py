@@ -0,0 +1,149 @@
+#Module for vectorized N-body stepping for DVA248 Datorsystem
+#
+#   All bodies are kept in contiguous NumPy arrays and advanced in one pass,
+#   using the same semi-implicit Euler formula as universe.calculate_planet_pos.
+#
+import numpy as np
+
+G = 6.67259 * pow(10, -11)
+'''Gravitational constant, same value as used by universe.calculate_planet_pos'''
+
+BLOCK = 1 << 20
+'''Number of body pairs handled per block, bounds the size of the temporary pair matrices'''
+
+def accelerations(sx, sy, mass, targets=None):
+    '''
+    Function that computes the gravitational acceleration on bodies from all other bodies.
+        sx,sy:      arrays with the positions of all bodies
+        mass:       array with the masses of all bodies
+        targets:    optional index array, only these bodies get an acceleration computed
+    Returns two arrays (ax, ay), one entry per target.
+    Bodies at exactly the same position do not attract each other (the pair is skipped).
+    '''
+    if targets is None:
+        targets = np.arange(len(sx))
+    ax = np.zeros(len(targets))
+    ay = np.zeros(len(targets))
+    rows_per_block = max(1, BLOCK // max(1, len(sx)))
+    for lo in range(0, len(targets), rows_per_block):
+        rows = targets[lo:lo + rows_per_block]
+        x = sx[None, :] - sx[rows, None]
+        y = sy[None, :] - sy[rows, None]
+        r2 = x * x + y * y
+        # Self-interaction and coincident bodies contribute nothing
+        r2[r2 == 0.0] = np.inf
+        inv_r3 = 1.0 / (r2 * np.sqrt(r2))
+        ax[lo:lo + rows_per_block] = G * ((x * inv_r3) @ mass)
+        ay[lo:lo + rows_per_block] = G * ((y * inv_r3) @ mass)
+    return ax, ay
+
+def step(sx, sy, vx, vy, mass, life, dt, accel=accelerations):
+    '''
+    Function that advances all bodies one timestep in place. All accelerations are computed
+    from the positions at the start of the step, then velocity, position and life are updated.
+        sx,sy,vx,vy,mass,life:  arrays holding the state of all bodies
+        dt:                     the timestep
+        accel:                  function used to compute the accelerations
+    '''
+    ax, ay = accel(sx, sy, mass)
+    vx += ax * dt
+    vy += ay * dt
+    sx += vx * dt
+    sy += vy * dt
+    life -= 1
+
+class nbody:
+    '''
+    Class that holds the state of a set of bodies in contiguous arrays.
+    '''
+    def __init__(self, planets=()):
+        '''
+        Constructor that copies the state of a list of planet objects into arrays.
+            planets:    the planets to load
+        '''
+        n = len(planets)
+        self.sx = np.fromiter((p.sx for p in planets), float, n)
+        self.sy = np.fromiter((p.sy for p in planets), float, n)
+        self.vx = np.fromiter((p.vx for p in planets), float, n)
+        self.vy = np.fromiter((p.vy for p in planets), float, n)
+        self.mass = np.fromiter((p.mass for p in planets), float, n)
+        self.life = np.fromiter((p.life for p in planets), np.int64, n)
+
+    @classmethod
+    def fromcolumns(cls, source):
+        '''
+        Method that creates an nbody object with copies of the arrays of another object.
+            source:     any object with the arrays sx, sy, vx, vy, mass and life, e.g. a planetstore
+        '''
+        self = cls()
+        for column in ('sx', 'sy', 'vx', 'vy', 'mass', 'life'):
+            setattr(self, column, getattr(source, column).copy())
+        return self
+
+    def __len__(self):
+        return len(self.sx)
+
+    def step(self, dt, accel=accelerations):
+        '''
+        Method that advances all bodies one timestep.
+            dt:     the timestep
+        '''
+        step(self.sx, self.sy, self.vx, self.vy, self.mass, self.life, dt, accel)
+
+    def store(self, planets):
+        '''
+        Method that writes the state back into the planet objects it was loaded from.
+            planets:    the planets, in the same order as when loaded
+        '''
+        for i, p in enumerate(planets):
+            p.sx = float(self.sx[i])
+            p.sy = float(self.sy[i])
+            p.vx = float(self.vx[i])
+            p.vy = float(self.vy[i])
+            p.life = int(self.life[i])
+
+
+if __name__ == '__main__':
+    import random
+    import time
+    from math import sqrt
+    from planet import planet
+
+    def reference_step(planets, dt):
+        # The per-planet formula, evaluated against the positions at the start of the step
+        old = [(p.sx, p.sy) for p in planets]
+        acc = []
+        for p, (px, py) in zip(planets, old):
+            atotx = atoty = 0.0
+            for cur, (cx, cy) in zip(planets, old):
+                if cur is not p:
+                    x = cx - px
+                    y = cy - py
+                    r = sqrt(pow(x, 2) + pow(y, 2))
+                    a = G * (cur.mass / pow(r, 2))
+                    atotx += a * (x / r)
+                    atoty += a * (y / r)
+            acc.append((atotx, atoty))
+        for p, (atotx, atoty) in zip(planets, acc):
+            p.vx += atotx * dt
+            p.vy += atoty * dt
+            p.sx += p.vx * dt
+            p.sy += p.vy * dt
+            p.life -= 1
+
+    random.seed(1)
+    planets = [planet("Sun", 300, 300, 0, 0, 10e8, 10e8), planet("Earth", 200, 300, 0, 0.008, 1000, 10e8)]
+    for i in range(200):
+        planets.append(planet("Comet", random.uniform(0, 800), random.uniform(0, 600),
+                              random.uniform(-0.1, 0.1), random.uniform(-0.1, 0.1), 1000, 10e8))
+    engine = nbody(planets)
+    t0 = time.perf_counter()
+    for i in range(20):
+        engine.step(10)
+    t1 = time.perf_counter()
+    for i in range(20):
+        reference_step(planets, 10)
+    t2 = time.perf_counter()
+    err = max(max(abs(engine.sx[i] - p.sx), abs(engine.sy[i] - p.sy)) for i, p in enumerate(planets))
+    print("max position difference after 20 steps:", err, "ok" if err < 1e-9 else "FAILED")
+    print(f"vectorized: {(t1 - t0) / 20 * 1000:.2f} ms/step, per-planet: {(t2 - t1) / 20 * 1000:.2f} ms/step")
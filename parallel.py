@@ -0,0 +1,163 @@
+#Module for parallel force computation for DVA248 Datorsystem
+#
+#   The columns of the planetstore are allocated in shared memory, so worker
+#   processes see the positions and masses without any copying. Each tick the
+#   target bodies are split into one range per worker; the workers write their
+#   accelerations into a shared output array.
+#
+import multiprocessing
+import weakref
+from multiprocessing import shared_memory
+import numpy as np
+import nbody
+import barneshut
+
+class sharedarrays:
+    '''
+    Class that allocates NumPy arrays in shared memory and finds the block an array lives in.
+    A block is freed when its array (and all views of it) are garbage collected.
+    '''
+    def __init__(self):
+        self.blocks = {}
+
+    def empty(self, shape, dtype=float):
+        '''
+        Method that creates an uninitialized array in a new shared memory block, like numpy.empty.
+        '''
+        dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(shape)) * dtype.itemsize)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        array = np.ndarray(shape, dtype, shm.buf)
+        start = array.__array_interface__['data'][0]
+        self.blocks[shm.name] = (start, size)
+        weakref.finalize(array, sharedarrays._free, self.blocks, shm)
+        return array
+
+    @staticmethod
+    def _free(blocks, shm):
+        del blocks[shm.name]
+        shm.close()
+        shm.unlink()
+
+    def find(self, array):
+        '''
+        Method that finds the shared memory block of a contiguous array.
+        Returns the name of the block and the byte offset of the array in it, or None if the array is not shared.
+        '''
+        if not array.flags.c_contiguous:
+            return None
+        start = array.__array_interface__['data'][0]
+        for name, (base, size) in self.blocks.items():
+            if base <= start and start + array.nbytes <= base + size:
+                return name, start - base
+        return None
+
+# Shared memory blocks the worker process has attached to, by name
+_attached = {}
+
+def _view(ref, dtype, count):
+    # The array with count elements at a block name and offset, attaching to the block the first time
+    name, offset = ref
+    if name not in _attached:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(count, dtype, _attached[name].buf, offset)
+
+def _work(task):
+    # Runs in a worker: accelerations of targets[lo:hi], written to out[lo:hi]
+    refs, n, lo, hi, targets, gravity = task
+    sx, sy, mass = (_view(ref, float, n) for ref in refs[:3])
+    ax, ay = (_view(ref, float, hi) for ref in refs[3:])
+    rows = np.arange(lo, hi) if targets is None else targets
+    if gravity[0] == "barneshut":
+        ax[lo:hi], ay[lo:hi] = barneshut.accelerations(sx, sy, mass, rows, *gravity[1:])
+    else:
+        ax[lo:hi], ay[lo:hi] = nbody.accelerations(sx, sy, mass, rows)
+    # Let go of blocks that are no longer used, e.g. columns replaced when the store grew
+    for name in set(_attached) - {ref[0] for ref in refs}:
+        _attached.pop(name).close()
+
+class parallelaccel:
+    '''
+    Class for an acceleration function (see nbody.accelerations) that splits the work over a process pool.
+    Inputs allocated with its arrays object are used in place; other inputs are copied to shared memory first.
+    '''
+    def __init__(self, workers, gravity="exact", theta=0.5, width=800, height=600, arrays=None):
+        '''
+        Constructor that starts the worker processes.
+            workers:            number of worker processes
+            gravity:            "exact" or "barneshut", see universe
+            theta:              opening angle for the Barnes-Hut approximation
+            width,height:       size of the universe, for the Barnes-Hut approximation
+            arrays:             the sharedarrays object the inputs are allocated with, a new one if None
+        '''
+        self.workers = workers
+        self.gravity = ("barneshut", theta, width, height) if gravity == "barneshut" else ("exact",)
+        self.arrays = sharedarrays() if arrays is None else arrays
+        # Worker processes are started fresh, the server has threads that must not be forked
+        self.pool = multiprocessing.get_context("spawn").Pool(workers)
+        self.out = (self.arrays.empty(0), self.arrays.empty(0))
+        self.scratch = {}
+
+    def _shared(self, key, array):
+        # Reference to the array in shared memory, copied to a scratch block if it is not there already
+        ref = self.arrays.find(array)
+        if ref is None:
+            if key not in self.scratch or len(self.scratch[key]) < len(array):
+                self.scratch[key] = self.arrays.empty(max(len(array), 64))
+            self.scratch[key][:len(array)] = array
+            ref = self.arrays.find(self.scratch[key])
+        return ref
+
+    def __call__(self, sx, sy, mass, targets=None):
+        '''
+        Function that computes the accelerations, see nbody.accelerations.
+        '''
+        count = len(sx) if targets is None else len(targets)
+        if len(self.out[0]) < count:
+            self.out = tuple(self.arrays.empty(max(count, 2 * len(self.out[0]))) for i in range(2))
+        refs = (self._shared('sx', sx), self._shared('sy', sy), self._shared('mass', mass),
+                self.arrays.find(self.out[0]), self.arrays.find(self.out[1]))
+        bounds = np.linspace(0, count, self.workers + 1).astype(int).tolist()
+        tasks = [(refs, len(sx), lo, hi, None if targets is None else targets[lo:hi], self.gravity)
+                 for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+        self.pool.map(_work, tasks)
+        # The output arrays are reused by the next call
+        return self.out[0][:count].copy(), self.out[1][:count].copy()
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+if __name__ == '__main__':
+    # Scaling of one exact step from 1 to the number of cores
+    import os
+    import time
+
+    def measure(accel, sx, sy, mass, repeat=3):
+        accel(sx, sy, mass)
+        t0 = time.perf_counter()
+        for i in range(repeat):
+            accel(sx, sy, mass)
+        return (time.perf_counter() - t0) / repeat
+
+    rng = np.random.default_rng(1)
+    cores = os.cpu_count()
+    print(f"{cores} cores")
+    print(f"{'bodies':>7} {'workers':>7} {'ms/step':>9} {'speedup':>8}")
+    for n in (2000, 5000, 10000):
+        arrays = sharedarrays()
+        sx, sy, mass = (arrays.empty(n) for i in range(3))
+        sx[:] = rng.uniform(0, 800, n)
+        sy[:] = rng.uniform(0, 600, n)
+        mass[:] = 1000
+        serial = measure(nbody.accelerations, sx, sy, mass)
+        print(f"{n:>7} {'serial':>7} {serial * 1000:>9.1f} {1.0:>8.2f}")
+        reference = nbody.accelerations(sx, sy, mass)
+        for workers in sorted({1, cores} | {1 << k for k in range(cores.bit_length()) if 1 << k < cores}):
+            accel = parallelaccel(workers, arrays=arrays)
+            elapsed = measure(accel, sx, sy, mass)
+            ax, ay = accel(sx, sy, mass)
+            assert np.allclose(ax, reference[0]) and np.allclose(ay, reference[1])
+            accel.close()
+            print(f"{n:>7} {workers:>7} {elapsed * 1000:>9.1f} {serial / elapsed:>8.2f}")
@@ -0,0 +1,360 @@
+#Module for compact planet storage for DVA248 Datorsystem
+#
+#   The server keeps all planets in one planetstore: a column (NumPy array) per
+#   numeric field and an id->slot index. Planets are packed in slots 0..n-1, so
+#   the columns can be handed to the vectorized step engine as they are.
+#
+import numpy as np
+from planet import planet
+
+COLUMNS = ('sx', 'sy', 'vx', 'vy', 'mass', 'life')
+
+class planethandle:
+    '''
+    Class for a lightweight reference to a planet in a planetstore.
+    It has the same attributes and methods as a planet object, reading and writing the store directly.
+    Two handles are equal if they refer to the same planet. A handle must not be used after its planet is removed.
+    '''
+    __slots__ = ('store', 'id')
+
+    def __init__(self, store, id):
+        self.store = store
+        self.id = id
+
+    def __eq__(self, other):
+        return isinstance(other, planethandle) and other.store is self.store and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def _get(column):
+        def get(self):
+            return getattr(self.store, '_' + column)[self.store.slotof(self.id)].item()
+        def set(self, value):
+            getattr(self.store, '_' + column)[self.store.slotof(self.id)] = value
+        return property(get, set)
+
+    sx = _get('sx')
+    sy = _get('sy')
+    vx = _get('vx')
+    vy = _get('vy')
+    mass = _get('mass')
+    life = _get('life')
+    del _get
+
+    @property
+    def name(self):
+        return self.store.names[self.store.slotof(self.id)]
+
+    @name.setter
+    def name(self, value):
+        self.store.names[self.store.slotof(self.id)] = value
+
+    @property
+    def owner(self):
+        return self.store.owners[self.store.slotof(self.id)]
+
+    @property
+    def cSock(self):
+        return self.store.socks[self.store.slotof(self.id)]
+
+    @cSock.setter
+    def cSock(self, value):
+        self.store.socks[self.store.slotof(self.id)] = value
+
+    def serverAddClientSock(self, cSock):
+        '''
+        Server-side method to add the socket of the corresponding client to the planet.
+            cSock:  The client socket to add to the planet
+        '''
+        self.cSock = cSock
+
+    def serverGetClientSock(self):
+        '''
+        Server-side method to retrieve the associated client socket from a planet.
+        The method returns the socket.
+        '''
+        return self.cSock
+
+class snapshot:
+    '''
+    Class for an immutable copy of all planets in a planetstore at one tick. The arrays sx, sy, vx, vy,
+    mass, life and ids are read-only and names and owners are tuples, all in the same (slot) order.
+    A snapshot is never changed after it is made, so it can be read from any thread without a lock.
+    '''
+    def __init__(self, store, tick):
+        '''
+        Constructor that copies the state of a store.
+            store:  the planetstore, must not change during the copy
+            tick:   the tick the state belongs to
+        '''
+        self.tick = tick
+        for column in COLUMNS + ('ids',):
+            values = getattr(store, column).copy()
+            values.flags.writeable = False
+            setattr(self, column, values)
+        self.names = tuple(store.names)
+        self.owners = tuple(store.owners)
+        self.next_id = store.next_id
+
+    def __len__(self):
+        return len(self.ids)
+
+class planetstore:
+    '''
+    Class that stores planets as columns. Removal moves the last planet into the freed slot,
+    so slots are always 0..len-1 but a planet's slot can change when another planet is removed.
+    Ids are handed out in increasing order and never reused. The id->slot index is a sorted array of ids that
+    is searched, removed planets are marked in it and dropped when they are half of it, so it stays compact.
+    Each planet also has a socket and an owner, the token of the client that created it (None if unknown).
+    The column properties (sx, sy, vx, vy, mass, life) are views of the used slots; they become
+    stale when planets are added, so fetch them again after adding.
+    '''
+    def __init__(self, capacity=64, empty=np.empty):
+        '''
+        Constructor that creates an empty store.
+            capacity:   number of planets that fit before the columns are grown
+            empty:      function that allocates the columns, called like numpy.empty,
+                        e.g. to place them in shared memory (see parallel.sharedarrays)
+        '''
+        self.n = 0
+        self.next_id = 0
+        self.empty = empty
+        for column in COLUMNS:
+            setattr(self, '_' + column, empty(capacity, np.int64 if column == 'life' else float))
+        self._ids = empty(capacity, np.int64)
+        self._keys = np.empty(capacity, np.int64)
+        self._slot = np.empty(capacity, np.int64)
+        self._used = 0
+        self.names = []
+        self.socks = []
+        self.owners = []
+
+    def __len__(self):
+        return self.n
+
+    def _column(column):
+        return property(lambda self: getattr(self, '_' + column)[:self.n])
+
+    sx = _column('sx')
+    sy = _column('sy')
+    vx = _column('vx')
+    vy = _column('vy')
+    mass = _column('mass')
+    life = _column('life')
+    ids = _column('ids')
+    del _column
+
+    def slotof(self, id):
+        '''
+        Method that returns the current slot of the planet with the given id.
+        '''
+        return self._slot[self._find(id)]
+
+    def _find(self, id):
+        # Position of an id in the index
+        keys = self._keys[:self._used]
+        i = keys.searchsorted(id)
+        if i == len(keys) or keys[i] != id or self._slot[i] < 0:
+            raise KeyError(f"No planet with id {id}")
+        return i
+
+    def _index(self, ids, slots):
+        # Add ids and their slots to the index, must be called before n counts them. Ids larger than all
+        # others are appended, otherwise (or when the removed planets are half the index) it is sorted again
+        ids = np.asarray(ids, np.int64)
+        slots = np.asarray(slots, np.int64)
+        order = np.argsort(ids, kind='stable')
+        ids, slots = ids[order], slots[order]
+        used = self._used
+        if used and (ids[0] <= self._keys[used - 1] or used - self.n > max(self.n, 32)):
+            live = self._slot[:used] >= 0
+            ids = np.concatenate((self._keys[:used][live], ids))
+            slots = np.concatenate((self._slot[:used][live], slots))
+            order = np.argsort(ids, kind='stable')
+            ids, slots = ids[order], slots[order]
+            used = 0
+        if used + len(ids) > len(self._keys):
+            capacity = max(2 * len(self._keys), used + len(ids))
+            for name in ('_keys', '_slot'):
+                new = np.empty(capacity, np.int64)
+                new[:used] = getattr(self, name)[:used]
+                setattr(self, name, new)
+        self._keys[used:used + len(ids)] = ids
+        self._slot[used:used + len(ids)] = slots
+        self._used = used + len(ids)
+
+    def _reserve(self, extra):
+        # Grow all columns so that extra more planets fit
+        capacity = len(self._ids)
+        if self.n + extra <= capacity:
+            return
+        capacity = max(2 * capacity, self.n + extra)
+        for column in COLUMNS + ('ids',):
+            old = getattr(self, '_' + column)
+            new = self.empty(capacity, old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, '_' + column, new)
+
+    def add_planets(self, planets, ids=None):
+        '''
+        Method that copies planet objects (or handles) into the store.
+            planets:    the planets to add
+            ids:        ids to give the planets, e.g. when they move from another store; they must not
+                        be in use in this store. New ids are handed out if None
+        Returns a list of handles to the new planets, in the same order
+        '''
+        count = len(planets)
+        self._reserve(count)
+        lo, hi = self.n, self.n + count
+        for column in COLUMNS:
+            getattr(self, '_' + column)[lo:hi] = [getattr(p, column) for p in planets]
+        if ids is None:
+            ids = range(self.next_id, self.next_id + count)
+        if count:
+            self._index(ids, np.arange(lo, hi))
+        self._ids[lo:hi] = ids
+        self.next_id = max(self.next_id, max(ids) + 1) if count else self.next_id
+        self.names.extend(p.name for p in planets)
+        self.socks.extend(p.cSock for p in planets)
+        self.owners.extend(getattr(p, 'owner', None) for p in planets)
+        self.n = hi
+        return [planethandle(self, id) for id in ids]
+
+    def add_planet(self, p):
+        '''
+        Method that copies one planet into the store, see add_planets.
+        Returns a handle to the new planet
+        '''
+        return self.add_planets([p])[0]
+
+    def load(self, state):
+        '''
+        Method that fills an empty store with saved planets, keeping their ids. The planets have no sockets
+        until their owners are bound again, see rebind.
+            state:  an object with the arrays sx, sy, vx, vy, mass, life and ids, the lists names and owners
+                    and next_id, e.g. a snapshot or a loaded checkpoint
+        '''
+        if self.n or self.next_id:
+            raise RuntimeError("Planets can only be loaded into an empty store")
+        count = len(state.ids)
+        self._reserve(count)
+        self.next_id = max(state.next_id, int(state.ids.max()) + 1 if count else 0)
+        for column in COLUMNS + ('ids',):
+            getattr(self, '_' + column)[:count] = getattr(state, column)
+        if count:
+            self._index(state.ids, np.arange(count))
+        self.names = list(state.names)
+        self.owners = list(state.owners)
+        self.socks = [None] * count
+        self.n = count
+
+    def rebind(self, owner, sock):
+        '''
+        Method that gives all planets of an owner a new socket, e.g. when the client has connected again.
+            owner:  the token of the client
+            sock:   the socket of its new connection
+        Returns the number of planets bound to the socket
+        '''
+        slots = [slot for slot, o in enumerate(self.owners) if o == owner]
+        for slot in slots:
+            self.socks[slot] = sock
+        return len(slots)
+
+    def unbind(self, sock):
+        '''
+        Method that removes a socket from all planets that use it, e.g. when the connection has closed.
+            sock:   the socket
+        '''
+        for slot, s in enumerate(self.socks):
+            if s is sock:
+                self.socks[slot] = None
+
+    def handle(self, id):
+        '''
+        Method that returns a handle to the planet with the given id.
+        '''
+        self.slotof(id)
+        return planethandle(self, id)
+
+    def handles(self):
+        '''
+        Method that returns handles to all planets, in slot order.
+        '''
+        return [planethandle(self, id) for id in self._ids[:self.n].tolist()]
+
+    def snapshot(self, tick):
+        '''
+        Method that returns an immutable copy of all planets, see snapshot.
+            tick:   the tick the state belongs to
+        '''
+        return snapshot(self, tick)
+
+    def detach(self, id):
+        '''
+        Method that removes a planet and returns it as a planet object (with its socket), so it can
+        still be used after removal. Costs O(log n), two searches of the id index: the last planet is moved
+        into the freed slot without shifting the others, and the index is compacted later, when planets are added.
+            id:     id of the planet to remove
+        '''
+        i = self._find(id)
+        slot = self._slot[i]
+        self._slot[i] = -1
+        p = planet(self.names[slot], *(getattr(self, '_' + column)[slot].item() for column in COLUMNS))
+        p.cSock = self.socks[slot]
+        p.owner = self.owners[slot]
+        last = self.n - 1
+        if slot != last:
+            for column in COLUMNS + ('ids',):
+                values = getattr(self, '_' + column)
+                values[slot] = values[last]
+            self.names[slot] = self.names[last]
+            self.socks[slot] = self.socks[last]
+            self.owners[slot] = self.owners[last]
+            self._slot[self._find(self._ids[slot])] = slot
+        self.names.pop()
+        self.socks.pop()
+        self.owners.pop()
+        self.n = last
+        return p
+
+    def remove(self, id):
+        '''
+        Method that removes a planet in O(log n), see detach.
+            id:     id of the planet to remove
+        '''
+        self.detach(id)
+
+
+if __name__ == '__main__':
+    import tracemalloc
+
+    store = planetstore()
+    handles = store.add_planets([planet(f"P{i}", i, 2 * i, 0, 0, 1000, 100) for i in range(5)])
+    handles[0].sx += 0.5
+    print("handle write, store.sx[0] == 0.5", store.sx[0] == 0.5)
+    store.remove(handles[1].id)
+    print("swap removal keeps slots packed", len(store) == 4 and store.names == ["P0", "P4", "P2", "P3"])
+    print("handles follow moved planets", handles[4].name == "P4" and handles[4].sy == 8.0)
+    p = store.detach(handles[0].id)
+    print("detached planet keeps its state", p.name == "P0" and p.sx == 0.5 and len(store) == 3)
+    snap = store.snapshot(1)
+    store.sx[0] = -1.0
+    print("snapshot does not follow the store", snap.sx[0] == 3.0 and not snap.sx.flags.writeable)
+    for i in range(10000):
+        store.remove(store.add_planet(planet("Comet", 1, 1, 0, 0, 1, 1)).id)
+    print("id index stays small", len(store._keys) == 64 and store.handle(2).sx == 2.0)
+
+    # Memory per body compared to planet objects in a list
+    n = 100000
+    tracemalloc.start()
+    objects = [planet("Comet", 1.0 * i, 2.0, 0.1, 0.2, 1000.0, 100) for i in range(n)]
+    per_object = tracemalloc.get_traced_memory()[0] / n
+    del objects
+    tracemalloc.stop()
+    tracemalloc.start()
+    big = planetstore(n)
+    big.add_planets([planet("Comet", 1.0 * i, 2.0, 0.1, 0.2, 1000.0, 100) for i in range(n)])
+    per_slot = tracemalloc.get_traced_memory()[0] / n
+    tracemalloc.stop()
+    print(f"bytes per body: planet objects {per_object:.0f}, planetstore {per_slot:.0f}")
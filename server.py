@@ -5,9 +5,24 @@
 import threading
 import time
 import os
-from space import space
-from cscomm import serverInitSocket, serverWaitForNewClient, serverRecvPlanet, serverSendString
+import numpy as np
+from collections import deque
+from functools import partial
+from cscomm import serverInitSocket, serverWaitForNewClient, serverRecvMessage, serverPostString, serverOutboxStats, serverForgetClient, KIND_PLANETS, KIND_HELLO, KIND_SUBSCRIBE
 from planet import planet
+import nbody
+import barneshut
+from integrators import INTEGRATORS
+import parallel
+from planetstore import planetstore
+from spatialgrid import spatialgrid
+import aioserver
+from trajectory import trajectorywriter, trajectoryring
+from checkpoint import checkpoint, checkpointwriter, writeCheckpoint
+from eventlog import eventlogwriter
+from streaming import streamer
+from shards import shardeduniverse
+import metrics
 from math import sqrt
 
 SPACEX = 800
@@ -15,125 +30,506 @@ SPACEX = 800
 SPACEY = 600
 '''Constant for height of the universe in pixels/coordinates'''
 
+REMOVAL_MESSAGES = ("Planet {} lämnade det kända universum (X)",
+                    "Planet {} lämnade det kända universum (Y)",
+                    "Planet {} har dött av ålder")
+'''Messages to the client when its planet leaves the universe in x or y, or dies of age'''
+GRAVITY_MODES = ("exact", "barneshut")
+'''Ways of computing gravity, see universe'''
+
 class universe:
-    planet_list = []
     DT : int
+    tick : int
 
-    def __init__(self, dt=10):
-        self.planet_list.clear()
+    def __init__(self, dt=10, gravity="exact", theta=0.5, merge_radius=None, integrator="euler", workers=None):
+        '''
+        Constructor that creates an empty universe.
+            dt:         the timestep
+            gravity:    "exact" sums the force from every planet, "barneshut" approximates
+                        distant groups of planets with a quadtree rebuilt every step
+            theta:      opening angle of the Barnes-Hut approximation, smaller is more exact
+            merge_radius:   planets closer than this merge into one, None turns merging off
+            integrator:     "euler", "leapfrog" or "block", see integrators
+            workers:        number of processes the force computation is split over, None computes it in this process
+        '''
+        if gravity not in GRAVITY_MODES:
+            raise ValueError(f"Unknown gravity {gravity!r}, use one of {', '.join(GRAVITY_MODES)}")
+        # Everything needed to create the same universe again, see eventlog.replay
+        self.settings = dict(dt=dt, gravity=gravity, theta=theta, merge_radius=merge_radius, integrator=integrator)
+        self.log = None
         self.DT = dt
+        self.tick = 0
         self.lock = threading.Lock()
+        self.pending = deque()
+        self.bindings = deque()
+        if workers:
+            # The columns live in shared memory so the workers read them without copying
+            arrays = parallel.sharedarrays()
+            self.store = planetstore(empty=arrays.empty)
+            self.accel = parallel.parallelaccel(workers, gravity, theta, SPACEX, SPACEY, arrays)
+        elif gravity == "barneshut":
+            self.store = planetstore()
+            self.accel = partial(barneshut.accelerations, theta=theta, width=SPACEX, height=SPACEY)
+        else:
+            self.store = planetstore()
+            self.accel = nbody.accelerations
+        self.integrator = INTEGRATORS[integrator]()
+        self.merge_radius = merge_radius
+        self.grid = spatialgrid(merge_radius, SPACEX, SPACEY) if merge_radius else None
+        self.published = self.store.snapshot(self.tick)
+
+    @property
+    def planet_list(self):
+        '''Handles to all planets, see planetstore. A new list is made on every access.'''
+        return self.store.handles()
 
     def add_planet(self, p):
+        '''Method to copy a planet into the universe. Returns a handle to it.'''
+        with self.lock:
+            return self.store.add_planet(p)
+
+    def add_planets(self, planets):
+        '''Method to copy planets into the universe. Returns a list of handles to them.'''
+        metrics.current.count("planets added", len(planets))
         with self.lock:
-            self.planet_list.append(p)
+            return self.store.add_planets(planets)
+
+    def submit(self, planets):
+        '''Method to hand planets to the simulation without waiting for the lock. The planets are added at the start of the next tick by advance.'''
+        self.pending.append(planets)
 
     def remove_planet(self, p):
         with self.lock:
-            self.planet_list.remove(p)
+            self.detach(p.id)
+
+    def detach(self, pid):
+        '''Method that removes a planet from the store, see planetstore.detach. The caller must hold the lock.'''
+        return self.store.detach(pid)
 
     def get_planets(self):
         with self.lock:
-            return list(self.planet_list)
+            return self.store.handles()
+
+    def restore(self, state):
+        '''Method that loads saved planets (e.g. a checkpoint) into an empty universe and continues from their tick. The planets get sockets when their clients connect again, see rebind.'''
+        with self.lock:
+            self.store.load(state)
+            self.tick = state.tick
+            self._publish()
+
+    def rebind(self, owner, sock):
+        '''Method that sends messages about the planets of a client to its new connection. Returns the number of planets.'''
+        with self.lock:
+            return self.store.rebind(owner, sock)
+
+    def unbind(self, sock):
+        '''Method that stops sending messages to a closed connection.'''
+        with self.lock:
+            self.store.unbind(sock)
+
+    def submit_rebind(self, owner, sock, done=None):
+        '''Method like rebind that does not wait for the lock. The planets are rebound at the start of the next tick by advance, which then calls done with their number, if given.'''
+        self.bindings.append((self.store.rebind, (owner, sock), done))
+
+    def submit_unbind(self, sock):
+        '''Method like unbind that does not wait for the lock. The connection is unbound at the start of the next tick by advance.'''
+        self.bindings.append((self.store.unbind, (sock,), None))
+
+    def publish(self):
+        '''Method that makes a snapshot of the current state available to latest. advance publishes after every tick, the thread-per-planet scheduler must call this itself.'''
+        with self.lock:
+            self._publish()
+
+    def _publish(self):
+        # Replacing the reference is atomic, readers see either the old or the new snapshot
+        self.published = self.store.snapshot(self.tick)
+
+    def latest(self):
+        '''Method that returns the last published snapshot (see planetstore.snapshot) without taking the lock. The snapshot is immutable, so it stays consistent while the simulation goes on.'''
+        return self.published
 
     def calculate_planet_pos(self, p: planet):
-        '''Method to calculate the position of planet p, relative to all other planets in the system. The method updates the position and age of planet p'''
+        '''Method to calculate the position of planet p (a handle from this universe), relative to all other planets in the system. The method updates the position and age of planet p'''
         Atotx = 0.0
         Atoty = 0.0
         G = 6.67259 * pow(10, -11)  # Gravitational constant
 
-        for cur in self.planet_list:
-            if cur != p:
-                x = cur.sx - p.sx
-                y = cur.sy - p.sy
+        s = self.store
+        i = s.slotof(p.id)
+        psx = s.sx[i].item()
+        psy = s.sy[i].item()
+        for j, (sx, sy, mass) in enumerate(zip(s.sx.tolist(), s.sy.tolist(), s.mass.tolist())):
+            if j != i:
+                x = sx - psx
+                y = sy - psy
                 r = sqrt(pow(x, 2) + pow(y, 2))
-                a = G * (cur.mass / pow(r, 2))
+                a = G * (mass / pow(r, 2))
                 Atotx += a * (x / r)
                 Atoty += a * (y / r)
 
-        p.vx += Atotx * self.DT
-        p.vy += Atoty * self.DT
-        p.sx += p.vx * self.DT
-        p.sy += p.vy * self.DT
-        p.life -= 1
+        s.vx[i] += Atotx * self.DT
+        s.vy[i] += Atoty * self.DT
+        s.sx[i] += s.vx[i] * self.DT
+        s.sy[i] += s.vy[i] * self.DT
+        s.life[i] -= 1
+
+    def step(self):
+        '''Method to advance all planets one timestep in a single vectorized pass with the integrator of the universe. The "euler" integrator uses the same formula as calculate_planet_pos. The caller must hold the lock.'''
+        s = self.store
+        self.integrator.step(s.sx, s.sy, s.vx, s.vy, s.mass, self.DT, self.accel, s.ids)
+        life = s.life
+        life -= 1
+
+    def merge(self):
+        '''Method that merges every group of planets closer than merge_radius into its heaviest planet. Mass and momentum are conserved and the merged planet is placed at the centre of mass. Returns a list of (planet, message) pairs for the absorbed planets. The caller must hold the lock.'''
+        s = self.store
+        self.grid.update(s.ids, s.sx, s.sy)
+        a, b = self.grid.pairs(self.merge_radius)
+        if len(a) == 0:
+            return []
+        # Group the planets that touch, directly or through others
+        parent = {}
+        def find(pid):
+            root = pid
+            while parent.get(root, root) != root:
+                root = parent[root]
+            while pid != root:
+                parent[pid], pid = root, parent[pid]
+            return root
+        for i, j in zip(a.tolist(), b.tolist()):
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                parent[ri] = rj
+        groups = {}
+        for pid in set(a.tolist()) | set(b.tolist()):
+            groups.setdefault(find(pid), []).append(pid)
 
-def graphic_thread(universe, canvas):
-    '''Dedicated thread for drawing all planets'''
+        events = []
+        for members in groups.values():
+            slots = np.array([s.slotof(pid) for pid in members])
+            m = s.mass[slots]
+            total = m.sum()
+            keep = slots[np.argmax(m)]
+            for column in (s.sx, s.sy, s.vx, s.vy):
+                column[keep] = (column[slots] * m).sum() / total
+            s.mass[keep] = total
+            survivor = s.ids[keep].item()
+            for pid in members:
+                if pid != survivor:
+                    p = self.detach(pid)
+                    events.append((p, f"Planet {p.name} kolliderade med {s.names[s.slotof(survivor)]} och slogs ihop"))
+        return events
+
+    def advance(self):
+        '''Method to advance the whole universe one tick. Submitted planets are added (and written to the event log, if any), all planets are stepped together, then planets closer than merge_radius are merged and planets that left the universe or died of age are removed. Returns a list of (planet, message) pairs for the removed planets; the planets are detached planet objects that keep their last state and socket.'''
+        events = []
+        m = metrics.current
+        t = m.clock()
+        with self.lock:
+            t = m.since("lock wait", t)
+            while self.pending:
+                planets = self.pending.popleft()
+                if self.log is not None:
+                    self.log.append(self.tick, planets)
+                self.store.add_planets(planets)
+                m.count("planets added", len(planets))
+            # After the planets, so a client that sends planets and closes is unbound from them
+            while self.bindings:
+                bind, args, done = self.bindings.popleft()
+                count = bind(*args)
+                if done is not None:
+                    done(count)
+            if self.log is not None:
+                self.log.flush()
+            t = m.since("ingest", t)
+            self.step()
+            t = m.since("physics", t)
+            if self.grid is not None:
+                events.extend(self.merge())
+                m.count("planets merged", len(events))
+                t = m.since("merge", t)
+            s = self.store
+            # Check if the planets have left the universe
+            out_x = (s.sx >= SPACEX) | (s.sx <= 0)
+            out_y = ~out_x & ((s.sy >= SPACEY) | (s.sy <= 0))
+            inside = ~(out_x | out_y)
+            # Decrease the life of the planets after each update
+            s.life[inside] -= 1
+            dead = inside & (s.life <= 0)
+            gone = np.flatnonzero(out_x | out_y | dead)
+            reasons = np.where(out_x[gone], 0, np.where(out_y[gone], 1, 2)).tolist()
+            for pid, reason in zip(s.ids[gone].tolist(), reasons):
+                p = self.detach(pid)
+                events.append((p, REMOVAL_MESSAGES[reason].format(p.name)))
+            m.count("planets removed", len(reasons) - reasons.count(2))
+            m.count("planets expired", reasons.count(2))
+            t = m.since("removal", t)
+            self.tick += 1
+            self._publish()
+            m.since("publish", t)
+        return events
+
+COLORS = {"Sun": "yellow", "Oops": "red", "Comet": "blue", "Earth": "green"}
+'''Colors of planets with known names, all other planets are white'''
+
+def graphic_thread(universe, canvas, fps=10, publish=False):
+    '''Dedicated thread for drawing all planets, at most fps frames per second. With publish, a snapshot is published before each frame (for the thread-per-planet scheduler, where no tick does it).'''
+    period = 1.0 / fps
+    next_frame = time.monotonic()
     while True:
-        # If there are no planets, sleep for 1 second and continue
+        if publish:
+            universe.publish()
+        state = universe.latest()
+        # If there are no planets, clear the canvas and sleep for 1 second
         # This is to prevent unnecessary computations
-        if (len(universe.planet_list) == 0):
+        if (len(state) == 0):
+            canvas.updatePlanets([])
             time.sleep(1)
+            next_frame = time.monotonic()
             continue
 
-        # Draw a black rectangle over the entire canvas to clear it
-        canvas.c.create_rectangle(0, 0, SPACEX, SPACEY, fill="black", outline="black")
-        
-        # Draw all planets
-        planets = universe.get_planets()
-        for planet in planets:
-            if planet.name == "Sun":
-                canvas.putPlanet(int(planet.sx), int(planet.sy), rad=5, color="yellow")
-            elif planet.name == "Oops":
-                canvas.putPlanet(int(planet.sx), int(planet.sy), rad=5, color="red")
-            elif planet.name == "Comet":
-                canvas.putPlanet(int(planet.sx), int(planet.sy), rad=5, color="blue")
-            elif planet.name == "Earth":
-                canvas.putPlanet(int(planet.sx), int(planet.sy), rad=5, color="green")
-            else:
-                canvas.putPlanet(int(planet.sx), int(planet.sy), rad=5, color="white")
-        
-        time.sleep(0.1)
-
-def main():
+        # Move every planet's item, items of planets that are gone are deleted
+        m = metrics.current
+        t = m.clock()
+        canvas.updatePlanets((key, int(x), int(y), 5, COLORS.get(name, "white"))
+                             for key, x, y, name in zip(state.ids.tolist(), state.sx.tolist(), state.sy.tolist(), state.names))
+        m.since("render", t)
+
+        next_frame += period
+        now = time.monotonic()
+        if now < next_frame:
+            time.sleep(next_frame - now)
+        else:
+            next_frame = now
+
+def simulation_thread(universe, period=0.1, on_tick=()):
+    '''Dedicated thread that advances all planets once every period seconds and notifies their clients. Every function in on_tick is called with the universe after each tick.'''
+    overruns = 0
+    next_tick = time.monotonic()
+    while True:
+        start = time.monotonic()
+        m = metrics.current
+        t = m.clock()
+        events = universe.advance()
+        t = m.since("tick", t)
+        for p, message in events:
+            # Every planet is removed once, so there is nothing to coalesce
+            serverPostString(p.cSock, message)
+        t = m.since("notify", t)
+        for f in on_tick:
+            f(universe)
+        m.since("export", t)
+
+        # Keep a fixed schedule, report ticks that did not fit in their period
+        next_tick += period
+        now = time.monotonic()
+        if now > next_tick:
+            overruns += 1
+            print(f"Tick {universe.tick} overran by {(now - next_tick) * 1000:.1f} ms "
+                  f"({(now - start) * 1000:.1f} ms for {len(universe.latest())} planets, {overruns} overruns)")
+            next_tick = now
+        else:
+            time.sleep(next_tick - now)
+
+def snapshot_exporter(output, every):
+    '''Returns a function for simulation_thread that writes a snapshot to output (a trajectorywriter or trajectoryring) every few ticks'''
+    def export(universe):
+        if universe.tick % every == 0:
+            state = universe.latest()
+            output.write(state.tick, state.ids, state.sx, state.sy, state.vx, state.vy, state.life)
+    return export
+
+def checkpoint_saver(writer, every):
+    '''Returns a function for simulation_thread that hands a snapshot to writer (a checkpointwriter) every few ticks'''
+    def save(universe):
+        if universe.tick % every == 0:
+            writer.submit(universe.latest())
+    return save
+
+def main(scheduler="tick", gravity="exact", theta=0.5, frontend="threads", fps=10,
+         headless=False, trajectory=None, ring=None, every=10, merge_radius=None, integrator="euler", dt=10, workers=None,
+         checkpoint_path=None, checkpoint_every=100, event_log=None,
+         use_metrics=True, stats_port=None, stats_every=None, shards=None, halo=100):
+    '''
+    Starts the planet server.
+        scheduler:  "tick" advances all planets in one fixed-timestep loop,
+                    "threads" runs one updater thread per planet
+        gravity:    "exact" or "barneshut", see universe
+        theta:      opening angle for the Barnes-Hut approximation
+        frontend:   "threads" serves each client from its own thread,
+                    "asyncio" serves all clients from one event loop (tick scheduler only)
+        fps:        maximum number of frames drawn per second
+        headless:   run without a window (tick scheduler only)
+        trajectory: name of a trajectory file to write snapshots to
+        ring:       name of a memory-mapped ring buffer to write snapshots to
+        every:      number of ticks between snapshots
+        merge_radius:   planets closer than this merge into one (tick scheduler only)
+        integrator:     "euler", "leapfrog" or "block" (tick scheduler only)
+        dt:             the timestep of the universe
+        workers:        number of processes for the force computation (tick scheduler only)
+        checkpoint_path:    name of a checkpoint file, the universe is restored from it at start
+                            and saved to it while running (tick scheduler only)
+        checkpoint_every:   number of ticks between checkpoints
+        event_log:          name of a file to log all received planets to, for eventlog.replay (tick scheduler only).
+                            A restored universe is also saved next to it, as event_log + ".start.pckp"
+        use_metrics:        collect timings and counters, see metrics
+        stats_port:         local port that answers every connection with the metrics
+        stats_every:        seconds between printing the metrics, None to not print them
+        shards:             number of processes the universe is split over, in vertical strips (tick scheduler only)
+        halo:               distance within which the shards see each other's planets exactly, see shardeduniverse
+    '''
+    metrics.enable(use_metrics)
     # Create the universe (i.e., an empty set of planets)
-    u = universe()
+    if shards:
+        u = shardeduniverse(shards, halo, dt=dt, gravity=gravity, theta=theta, integrator=integrator)
+    else:
+        u = universe(dt=dt, gravity=gravity, theta=theta, merge_radius=merge_radius, integrator=integrator,
+                     workers=workers)
     # Create the window on which to draw the universe
-    s = space(SPACEX, SPACEY)
+    # (tkinter is only imported when a window is used, batch nodes may not have it)
+    if not headless:
+        from space import space
+        s = space(SPACEX, SPACEY)
+
+    exporters = []
+    restored = False
+    if checkpoint_path is not None:
+        if os.path.exists(checkpoint_path):
+            u.restore(checkpoint(checkpoint_path))
+            restored = True
+            print(f"Restored {len(u.latest())} planets at tick {u.tick} from {checkpoint_path}")
+        exporters.append(checkpoint_saver(checkpointwriter(checkpoint_path), checkpoint_every))
+    if event_log is not None:
+        settings = dict(u.settings, tick=u.tick)
+        if restored:
+            # The checkpoint is overwritten while running, so the log gets its own copy of the start
+            start = event_log + ".start.pckp"
+            writeCheckpoint(start, u.latest())
+            settings["checkpoint"] = os.path.basename(start)
+        u.log = eventlogwriter(event_log, settings)
+    if trajectory is not None:
+        exporters.append(snapshot_exporter(trajectorywriter(trajectory), every))
+    if ring is not None:
+        exporters.append(snapshot_exporter(trajectoryring(ring), every))
 
     def planet_updater(p):
         '''Updates the position of a planet.'''
-        while p.life > 0:
-            # Calculate the position of the planet
+        while True:
+            # The handle reads the store, whose slots move when other planets are removed,
+            # so the update, the checks and the removal all hold the lock
+            m = metrics.current
+            t = m.clock()
             with u.lock:
-                u.calculate_planet_pos(p)
+                t = m.since("lock wait", t)
+                if p.life <= 0:
+                    reason = 2
+                else:
+                    # Calculate the position of the planet
+                    u.calculate_planet_pos(p)
+                    m.since("physics", t)
+                    # Check if the planet has left the universe
+                    if (p.sx >= SPACEX or p.sx <= 0):
+                        reason = 0
+                    elif (p.sy >= SPACEY or p.sy <= 0):
+                        reason = 1
+                    else:
+                        # Decrease the life of the planet after each update
+                        p.life -= 1
+                        reason = 2 if p.life <= 0 else None
+                if reason is not None:
+                    gone = u.detach(p.id)
 
-            # Check if the planet has left the universe
-            if (p.sx >= SPACEX or p.sx <= 0):
-                serverSendString(p.cSock, f"Planet {p.name} lämnade det kända universum (X)")
-                u.remove_planet(p)
+            if reason is not None: # Send a message to the client of the removed planet
+                serverPostString(gone.cSock, REMOVAL_MESSAGES[reason].format(gone.name))
+                metrics.current.count("planets expired" if reason == 2 else "planets removed")
                 return
-            elif (p.sy >= SPACEY or p.sy <= 0):
-                serverSendString(p.cSock, f"Planet {p.name} lämnade det kända universum (Y)")
-                u.remove_planet(p)
-                return
-                
-            # Decrease the life of the planet after each update
-            p.life -= 1
-        
-            if (p.life <= 0): # If the planet has no life left, send a message to the client
-                serverSendString(p.cSock, f"Planet {p.name} har dött av ålder")
-                u.remove_planet(p)
-                return
-            
+
             time.sleep(0.1)
 
+    def stats():
+        '''State of the universe and the outgoing queues, shown after the metrics.'''
+        state = u.latest()
+        return f"tick {state.tick}, {len(state)} planets\noutbox {serverOutboxStats()}\n"
+
+    if stats_port is not None:
+        metrics.serveStats(stats_port, extra=stats)
+    if stats_every is not None:
+        metrics.dumpStats(stats_every, extra=stats)
+
+    # Token of each connected client that has said who it is
+    owners = {}
+    # Delta updates for clients that subscribe to them
+    stream = streamer(u)
+
+    def reconnected(token, count):
+        '''Reports how many earlier planets a client got back.'''
+        if count:
+            print(f"Client {token} reconnected, {count} planets")
+
+    def receive_hello(token, client_socket):
+        '''Remembers who a client is and sends messages about its earlier planets to this connection.'''
+        owners[client_socket] = token
+        if scheduler == "threads":
+            reconnected(token, u.rebind(token, client_socket))
+        else:
+            # The asyncio front end calls this on the event loop, which must not wait for the lock
+            u.submit_rebind(token, client_socket, partial(reconnected, token))
+
+    def receive_subscribe(rate, region, client_socket):
+        '''Starts, changes or ends the delta updates of a client.'''
+        stream.subscribe(client_socket, owners.get(client_socket), rate, region)
+        print(f"Client {owners.get(client_socket)} subscribed at {rate} updates/s, region {region}")
+
+    def receive_message(kind, value, client_socket):
+        '''Handles the messages of a client that are not planets.'''
+        if kind == KIND_HELLO:
+            receive_hello(value, client_socket)
+        elif kind == KIND_SUBSCRIBE:
+            receive_subscribe(*value, client_socket)
+
+    def client_closed(client_socket):
+        '''Forgets a connection that has closed.'''
+        owners.pop(client_socket, None)
+        stream.unsubscribe(client_socket)
+        if scheduler == "threads":
+            u.unbind(client_socket)
+        else:
+            u.submit_unbind(client_socket)
+        serverForgetClient(client_socket)
+
+    def receive_planets(planets, client_socket):
+        '''Hands planets received from a client to the simulation.'''
+        for p in planets:
+            p.cSock = client_socket # Set the planet socket to the client socket for later use
+            p.owner = owners.get(client_socket)
+            if type(p.life) != int: # If the life is not an integer, convert it to an integer
+                p.life = int(p.life)
+        if len(planets) == 1:
+            print(f"Received Planet: {planets[0].name}")
+        else:
+            print(f"Received {len(planets)} planets")
+        if scheduler == "threads":
+            for p in u.add_planets(planets):
+                threading.Thread(target=planet_updater, args=(p,), daemon=True).start()
+        else:
+            u.submit(planets)
+
     def planet_handler(client_socket):
         '''Handles communication with a single client.'''
         while True:
             try:
-                p = serverRecvPlanet(client_socket)
-                if p is None:
+                message = serverRecvMessage(client_socket)
+                if message is None:
                     break
-                p.cSock = client_socket # Set the planet socket to the client socket for later use
-                if type(p.life) != int: # If the life is not an integer, convert it to an integer
-                    p.life = int(p.life)
-                print(f"Received Planet: {p.name}")
-                u.add_planet(p)
-                threading.Thread(target=planet_updater, args=(p,), daemon=True).start()
+                kind, value = message
+                if kind == KIND_PLANETS:
+                    receive_planets(value, client_socket)
+                else:
+                    receive_message(kind, value, client_socket)
             except Exception as e:
                 print(f"Error in client handler: {e}")
                 break
+        client_closed(client_socket)
         client_socket.close()
 
     def server_thread():
@@ -148,15 +544,80 @@ def main():
                 break
         server_socket.close()
 
+    # Start the server thread
+    if frontend == "asyncio":
+        threading.Thread(target=aioserver.run, args=(receive_planets,),
+                         kwargs={"on_message": receive_message, "on_close": client_closed}, daemon=True).start()
+    else:
+        threading.Thread(target=server_thread, daemon=True).start()
+
+    # Without a window the simulation loop runs until the process is stopped
+    if headless:
+        simulation_thread(u, on_tick=exporters)
+        return
+
     # Start the drawing thread
-    threading.Thread(target=graphic_thread, args=(u, s), daemon=True).start()
+    threading.Thread(target=graphic_thread, args=(u, s, fps, scheduler == "threads"), daemon=True).start()
 
-    # Start the server thread
-    threading.Thread(target=server_thread, daemon=True).start()
+    # Start the simulation thread
+    if scheduler == "tick":
+        threading.Thread(target=simulation_thread, args=(u,), kwargs={"on_tick": exporters}, daemon=True).start()
 
     # Last part of main function is the window management loop, will terminate when window is closed
     s.mainLoop()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Planet server")
+    parser.add_argument("--scheduler", choices=["tick", "threads"], default="tick",
+                        help="one fixed-timestep loop for all planets, or one thread per planet")
+    parser.add_argument("--gravity", choices=GRAVITY_MODES, default="exact",
+                        help="exact all-pairs gravity or the Barnes-Hut approximation (tick scheduler only)")
+    parser.add_argument("--theta", type=float, default=0.5,
+                        help="opening angle for the Barnes-Hut approximation")
+    parser.add_argument("--frontend", choices=["threads", "asyncio"], default="threads",
+                        help="one thread per client connection, or one asyncio event loop for all clients")
+    parser.add_argument("--fps", type=float, default=10,
+                        help="maximum number of frames drawn per second")
+    parser.add_argument("--headless", action="store_true",
+                        help="run the simulation without a window")
+    parser.add_argument("--trajectory", help="write snapshots to this trajectory file")
+    parser.add_argument("--ring", help="write snapshots to this memory-mapped ring buffer")
+    parser.add_argument("--every", type=int, default=10,
+                        help="number of ticks between snapshots")
+    parser.add_argument("--merge-radius", type=float,
+                        help="merge planets that come closer than this distance")
+    parser.add_argument("--integrator", choices=["euler", "leapfrog", "block"], default="euler",
+                        help="time integrator, leapfrog and block (adaptive sub-steps) allow larger timesteps")
+    parser.add_argument("--dt", type=float, default=10,
+                        help="timestep of the universe")
+    parser.add_argument("--workers", type=int,
+                        help="split the force computation over this many processes")
+    parser.add_argument("--checkpoint", help="restore the universe from this file at start and save it there while running")
+    parser.add_argument("--checkpoint-every", type=int, default=100,
+                        help="number of ticks between checkpoints")
+    parser.add_argument("--event-log", help="log all received planets to this file, replay it with eventlog.py")
+    parser.add_argument("--shards", type=int,
+                        help="split the universe into this many vertical strips, each stepped by its own process")
+    parser.add_argument("--halo", type=float, default=100,
+                        help="distance within which the shards see each other's planets exactly, farther planets are approximated")
+    parser.add_argument("--no-metrics", action="store_true",
+                        help="do not collect timings and counters")
+    parser.add_argument("--stats-port", type=int,
+                        help="local port that answers every connection with the metrics, e.g. nc localhost PORT")
+    parser.add_argument("--stats-every", type=float,
+                        help="print the metrics every this many seconds")
+    args = parser.parse_args()
+    if args.scheduler != "tick":
+        for option in ("gravity", "frontend", "headless", "trajectory", "ring", "merge_radius", "integrator", "workers", "checkpoint", "event_log", "shards"):
+            if getattr(args, option) not in (None, False, "exact", "threads", "euler"):
+                parser.error(f"--{option.replace('_', '-')} requires --scheduler tick")
+    if args.shards and (args.merge_radius is not None or args.workers):
+        parser.error("--shards cannot be combined with --merge-radius or --workers")
+    main(scheduler=args.scheduler, gravity=args.gravity, theta=args.theta, frontend=args.frontend, fps=args.fps,
+         headless=args.headless, trajectory=args.trajectory, ring=args.ring, every=args.every,
+         merge_radius=args.merge_radius, integrator=args.integrator, dt=args.dt,
+         workers=args.workers, checkpoint_path=args.checkpoint, checkpoint_every=args.checkpoint_every,
+         event_log=args.event_log, use_metrics=not args.no_metrics, stats_port=args.stats_port,
+         stats_every=args.stats_every, shards=args.shards, halo=args.halo)
@@ -0,0 +1,367 @@
+#Module for a sharded universe for DVA248 Datorsystem
+#
+#   The universe is cut into vertical strips, each stepped by its own worker
+#   process. A strip sees the planets of the other strips in two ways: planets
+#   within the halo of its edges exactly (ghosts), all others as the total mass
+#   of each cell of a coarse grid, placed at the centre of mass of the cell.
+#   Planets that cross the edge of their strip move to the strip they entered.
+#   The coordinator in the server process routes ghosts, cell masses and moving
+#   planets between the workers over pipes once per tick, and has the same
+#   methods as universe, so the server runs it the same way.
+#
+import itertools
+import multiprocessing
+import threading
+from collections import deque
+from functools import partial
+from types import SimpleNamespace
+import numpy as np
+import nbody
+import barneshut
+import metrics
+from integrators import INTEGRATORS
+from planet import planet
+from planetstore import planetstore, snapshot, COLUMNS
+
+CELL = 50
+'''Size of the cells of the mass summaries, in pixels'''
+
+class layout:
+    '''
+    Class for the cells of the mass summaries and the strips of the shards. Strips are whole columns of cells,
+    cells are numbered column by column, so the cells of a strip are consecutive.
+    '''
+    def __init__(self, shards, halo, width, height, cell=CELL):
+        '''
+        Constructor for the layout.
+            shards:         number of strips
+            halo:           distance from its edges within which a strip sees other planets exactly, rounded up to whole cells
+            width,height:   size of the universe
+            cell:           size of the cells
+        '''
+        self.width = width
+        self.height = height
+        self.cell = cell
+        self.cols = -(-width // cell)
+        self.rows = -(-height // cell)
+        if not 1 <= shards <= self.cols:
+            raise ValueError(f"The number of shards must be between 1 and {self.cols}")
+        self.halo = int(-(-halo // cell))
+        self.bounds = np.linspace(0, self.cols, shards + 1).round().astype(int).tolist()
+        self.owner = np.repeat(np.arange(shards), np.diff(self.bounds))
+        self.cell_col = np.arange(self.cols * self.rows) // self.rows
+
+    def columns(self, sx):
+        '''Method that returns the cell column of each x coordinate, planets outside the universe count as in the outermost column.'''
+        return np.clip(np.floor_divide(sx, self.cell).astype(np.int64), 0, self.cols - 1)
+
+    def cells(self, sx, sy):
+        '''Method that returns the cell of each position.'''
+        return self.columns(sx) * self.rows + np.clip(np.floor_divide(sy, self.cell).astype(np.int64), 0, self.rows - 1)
+
+    def shard(self, sx):
+        '''Method that returns the strip of each x coordinate.'''
+        return self.owner[self.columns(sx)]
+
+    def near(self, index):
+        '''Method that returns the first and last + 1 cell column a strip sees exactly.'''
+        return max(self.bounds[index] - self.halo, 0), min(self.bounds[index + 1] + self.halo, self.cols)
+
+def _row(id, p):
+    # A planet as sent between processes: id, name, owner and the columns, without the socket
+    return (id, p.name, getattr(p, 'owner', None)) + tuple(getattr(p, column) for column in COLUMNS)
+
+def _planet(row):
+    p = planet(row[1], *row[3:])
+    p.owner = row[2]
+    return p
+
+def _shard(conn, index, settings, grid):
+    # Runs in a shard process: steps the planets of one strip every time the coordinator sends a tick
+    lo, hi = grid.bounds[index], grid.bounds[index + 1]
+    store = planetstore()
+    integrator = INTEGRATORS[settings["integrator"]]()
+    if settings["gravity"] == "barneshut":
+        forces = partial(barneshut.accelerations, theta=settings["theta"], width=grid.width, height=grid.height)
+    else:
+        forces = nbody.accelerations
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            # The server has stopped
+            break
+        if message is None:
+            break
+        tick, incoming, gx, gy, gm = message
+        if incoming:
+            store.add_planets([_planet(row) for row in incoming], [row[0] for row in incoming])
+
+        def accel(sx, sy, mass, targets=None):
+            # Own planets first, then the ghosts and cell masses of the other strips
+            rows = np.arange(len(sx)) if targets is None else targets
+            return forces(np.concatenate((sx, gx)), np.concatenate((sy, gy)), np.concatenate((mass, gm)), rows)
+
+        s = store
+        integrator.step(s.sx, s.sy, s.vx, s.vy, s.mass, settings["dt"], accel, s.ids)
+        life = s.life
+        life -= 1
+        # Planets that left the universe or died of age, as in universe.advance
+        out_x = (s.sx >= grid.width) | (s.sx <= 0)
+        out_y = ~out_x & ((s.sy >= grid.height) | (s.sy <= 0))
+        inside = ~(out_x | out_y)
+        s.life[inside] -= 1
+        dead = inside & (s.life <= 0)
+        gone = np.flatnonzero(out_x | out_y | dead)
+        reasons = np.where(out_x[gone], 0, np.where(out_y[gone], 1, 2)).tolist()
+        removed = [(_row(pid, s.detach(pid)), reason) for pid, reason in zip(s.ids[gone].tolist(), reasons)]
+        state = s.snapshot(tick + 1)
+        # Planets that crossed into another strip
+        cols = grid.columns(s.sx)
+        migrants = [_row(pid, s.detach(pid)) for pid in s.ids[(cols < lo) | (cols >= hi)].tolist()]
+        # Ghosts for the strips nearby and cell masses for all of them, the planets' positions at the next tick
+        cols = grid.columns(s.sx)
+        edge = (cols < lo + grid.halo) | (cols >= hi - grid.halo)
+        ghosts = (s.sx[edge].copy(), s.sy[edge].copy(), s.mass[edge].copy())
+        cells = grid.cells(s.sx, s.sy) - lo * grid.rows
+        size = (hi - lo) * grid.rows
+        summary = tuple(np.bincount(cells, weights, size) for weights in (s.mass, s.mass * s.sx, s.mass * s.sy))
+        conn.send((removed, migrants, ghosts, summary, state))
+
+class shardeduniverse:
+    '''
+    Class for a universe stepped by several processes, one per vertical strip. It has the methods of universe
+    the tick scheduler uses (submit, advance, latest, restore, rebind, unbind, submit_rebind, submit_unbind); planets can only be added with submit.
+    The force on a planet from planets farther away than the halo is approximated by cell masses,
+    with a halo at least the width of the universe all forces are exact.
+    '''
+    DT : int
+    tick : int
+
+    def __init__(self, shards, halo=100, dt=10, gravity="exact", theta=0.5, integrator="euler"):
+        '''
+        Constructor that starts the shard processes.
+            shards:     number of strips, each stepped by its own process
+            halo:       distance within which planets of other strips are seen exactly
+            dt, gravity, theta, integrator:     see universe. The leapfrog integrators use the ghosts
+                                                and cell masses of the start of the tick for the whole tick
+        '''
+        # Imported here, the server imports this module
+        from server import SPACEX, SPACEY, REMOVAL_MESSAGES, GRAVITY_MODES
+        # Checked here, in a shard process a wrong setting would only stop that process
+        if gravity not in GRAVITY_MODES:
+            raise ValueError(f"Unknown gravity {gravity!r}, use one of {', '.join(GRAVITY_MODES)}")
+        if integrator not in INTEGRATORS:
+            raise ValueError(f"Unknown integrator {integrator!r}, use one of {', '.join(INTEGRATORS)}")
+        self.messages = REMOVAL_MESSAGES
+        # Everything needed to create the same universe again, see eventlog.replay
+        self.settings = dict(dt=dt, gravity=gravity, theta=theta, integrator=integrator, shards=shards, halo=halo)
+        self.log = None
+        self.DT = dt
+        self.tick = 0
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.bindings = deque()
+        self.next_id = 0
+        self.socks = {}
+        self.grid = layout(shards, halo, SPACEX, SPACEY)
+        g = self.grid
+        self.incoming = [[] for k in range(shards)]
+        self.ghosts = [(np.empty(0),) * 3 for k in range(shards)]
+        self.summary = [(np.zeros((hi - lo) * g.rows),) * 3 for lo, hi in zip(g.bounds[:-1], g.bounds[1:])]
+        # Shard processes are started fresh, the server has threads that must not be forked
+        context = multiprocessing.get_context("spawn")
+        worker_settings = dict(dt=dt, gravity=gravity, theta=theta, integrator=integrator)
+        self.conns = []
+        self.processes = []
+        for k in range(shards):
+            conn, child = context.Pipe()
+            process = context.Process(target=_shard, args=(child, k, worker_settings, g), daemon=True)
+            process.start()
+            child.close()
+            self.conns.append(conn)
+            self.processes.append(process)
+        self.published = planetstore().snapshot(self.tick)
+
+    def submit(self, planets):
+        '''Method to hand planets to the simulation without waiting for the lock. The planets are added at the start of the next tick by advance.'''
+        self.pending.append(planets)
+
+    def restore(self, state):
+        '''Method that loads saved planets (e.g. a checkpoint) into an empty universe and continues from their tick, see universe.restore.'''
+        with self.lock:
+            if self.next_id or len(self.published):
+                raise RuntimeError("Planets can only be restored into an empty universe")
+            columns = (getattr(state, column).tolist() for column in COLUMNS)
+            self._route(list(zip(state.ids.tolist(), state.names, state.owners, *columns)))
+            self.tick = state.tick
+            self.next_id = max(state.next_id, int(state.ids.max()) + 1 if len(state.ids) else 0)
+            self.published = snapshot(state, state.tick)
+
+    def rebind(self, owner, sock):
+        '''Method that sends messages about the planets of a client to its new connection. Returns the number of planets.'''
+        with self.lock:
+            return self._rebind(owner, sock)
+
+    def unbind(self, sock):
+        '''Method that stops sending messages to a closed connection.'''
+        with self.lock:
+            self._unbind(sock)
+
+    def submit_rebind(self, owner, sock, done=None):
+        '''Method like rebind that does not wait for the lock, see universe.submit_rebind.'''
+        self.bindings.append((self._rebind, (owner, sock), done))
+
+    def submit_unbind(self, sock):
+        '''Method like unbind that does not wait for the lock, see universe.submit_unbind.'''
+        self.bindings.append((self._unbind, (sock,), None))
+
+    def _rebind(self, owner, sock):
+        state = self.published
+        ids = [id for id, o in zip(state.ids.tolist(), state.owners) if o == owner]
+        for id in ids:
+            self.socks[id] = sock
+        return len(ids)
+
+    def _unbind(self, sock):
+        for id in [id for id, s in self.socks.items() if s is sock]:
+            del self.socks[id]
+
+    def latest(self):
+        '''Method that returns the last published snapshot, see universe.latest.'''
+        return self.published
+
+    def _route(self, rows):
+        # Queue planets for the strip they are in, they are added at the next tick
+        if rows:
+            for row, k in zip(rows, self.grid.shard(np.array([row[3] for row in rows])).tolist()):
+                self.incoming[k].append(row)
+
+    def _exchange(self):
+        # The ghosts and cell masses every strip gets: the state of the other strips at the end
+        # of the last tick, and the planets about to be added to them
+        g = self.grid
+        mass, mx, my = (np.concatenate(parts) for parts in zip(*self.summary))
+        sources = []
+        for ghosts, rows in zip(self.ghosts, self.incoming):
+            x, y, m = (np.array([row[column] for row in rows], float) for column in (3, 4, 7))
+            sources.append(tuple(np.concatenate(pair) for pair in zip(ghosts, (x, y, m))))
+            for total, weights in ((mass, m), (mx, m * x), (my, m * y)):
+                np.add.at(total, g.cells(x, y), weights)
+        messages = []
+        for k in range(len(self.conns)):
+            lo, hi = g.near(k)
+            parts = []
+            for j, (x, y, m) in enumerate(sources):
+                if j != k:
+                    cols = g.columns(x)
+                    seen = (cols >= lo) & (cols < hi)
+                    parts.append((x[seen], y[seen], m[seen]))
+            far = ((g.cell_col < lo) | (g.cell_col >= hi)) & (mass > 0)
+            parts.append((mx[far] / mass[far], my[far] / mass[far], mass[far]))
+            gx, gy, gm = (np.concatenate(column) for column in zip(*parts))
+            messages.append((self.tick, self.incoming[k], gx, gy, gm))
+        return messages
+
+    def advance(self):
+        '''Method to advance the whole universe one tick, see universe.advance. All strips are stepped at the same time.'''
+        events = []
+        m = metrics.current
+        t = m.clock()
+        with self.lock:
+            t = m.since("lock wait", t)
+            while self.pending:
+                planets = self.pending.popleft()
+                if self.log is not None:
+                    self.log.append(self.tick, planets)
+                rows = []
+                for id, p in zip(range(self.next_id, self.next_id + len(planets)), planets):
+                    if p.cSock is not None:
+                        self.socks[id] = p.cSock
+                    rows.append(_row(id, p))
+                self.next_id += len(planets)
+                self._route(rows)
+                m.count("planets added", len(planets))
+            while self.bindings:
+                bind, args, done = self.bindings.popleft()
+                count = bind(*args)
+                if done is not None:
+                    done(count)
+            if self.log is not None:
+                self.log.flush()
+            t = m.since("ingest", t)
+            for conn, message in zip(self.conns, self._exchange()):
+                conn.send(message)
+            self.incoming = [[] for conn in self.conns]
+            t = m.since("exchange", t)
+            replies = [conn.recv() for conn in self.conns]
+            t = m.since("physics", t)
+            states = []
+            migrants = []
+            reasons = [0, 0, 0]
+            for k, (removed, moved, ghosts, summary, state) in enumerate(replies):
+                for row, reason in removed:
+                    p = _planet(row)
+                    p.cSock = self.socks.pop(row[0], None)
+                    events.append((p, self.messages[reason].format(p.name)))
+                    reasons[reason] += 1
+                migrants.extend(moved)
+                self.ghosts[k] = ghosts
+                self.summary[k] = summary
+                states.append(state)
+            self._route(migrants)
+            m.count("planets migrated", len(migrants))
+            m.count("planets removed", reasons[0] + reasons[1])
+            m.count("planets expired", reasons[2])
+            t = m.since("removal", t)
+            self.tick += 1
+            columns = {column: np.concatenate([getattr(state, column) for state in states]) for column in COLUMNS + ('ids',)}
+            self.published = snapshot(SimpleNamespace(names=list(itertools.chain.from_iterable(state.names for state in states)),
+                                                      owners=list(itertools.chain.from_iterable(state.owners for state in states)),
+                                                      next_id=self.next_id, **columns), self.tick)
+            m.since("publish", t)
+        return events
+
+    def close(self):
+        '''Method that stops the shard processes.'''
+        for conn in self.conns:
+            conn.send(None)
+        for process in self.processes:
+            process.join()
+
+
+if __name__ == '__main__':
+    # Difference to the single-process universe and speed, for some shard counts and halos.
+    # The planets pass close to each other, so small differences grow fast: the error is taken after a few ticks
+    import os
+    import time
+    from server import universe
+
+    rng = np.random.default_rng(1)
+    n = 2000
+    planets = [planet("Comet", *rng.uniform(100, 700, 1), *rng.uniform(100, 500, 1), *rng.normal(0, 0.05, 2),
+                      *rng.uniform(1e6, 1e8, 1), 10**9) for i in range(n)]
+    compare = 5
+    ticks = 30
+
+    def run(u):
+        u.submit(planets)
+        for i in range(compare):
+            u.advance()
+        state = u.latest()
+        order = np.argsort(state.ids)
+        t0 = time.perf_counter()
+        for i in range(ticks):
+            u.advance()
+        return state.sx[order], state.sy[order], (time.perf_counter() - t0) / ticks
+
+    rx, ry, serial = run(universe())
+    print(f"{os.cpu_count()} cores, {n} planets, error after {compare} ticks, time over {ticks} ticks")
+    print(f"{'shards':>6} {'halo':>5} {'ms/tick':>8} {'max error px':>13}")
+    print(f"{'serial':>6} {'':>5} {serial * 1000:>8.1f} {0.0:>13.2e}")
+    for shards, halo in ((2, 800), (4, 800), (4, 100), (4, 50), (8, 100)):
+        u = shardeduniverse(shards, halo)
+        sx, sy, elapsed = run(u)
+        u.close()
+        error = max(np.abs(sx - rx).max(), np.abs(sy - ry).max())
+        print(f"{shards:>6} {halo:>5} {elapsed * 1000:>8.1f} {error:>13.2e}")
@@ -25,6 +25,7 @@ class space:
         self.c=tkinter.Canvas(self.tk,width=self.spacex, height=self.spacey)
         self.c.create_rectangle(0,0,self.spacex,self.spacey,fill="black",outline="black")
         self.c.place(x=0,y=0)
+        self.items={}
 
     def putPlanet(self,x,y,rad=5,color="white"):
         '''
@@ -35,6 +36,47 @@ class space:
         '''
         self.c.create_oval(x,y,x+rad,y+rad,fill=color,outline=color)
 
+    def movePlanet(self,key,x,y,rad=5,color="white"):
+        '''
+        Method that draws a planet that is kept on the canvas until it is removed.
+        The first call creates the planet, later calls with the same key move it.
+            key:    any hashable value that identifies the planet
+            x,y:    Integer-coordinates to draw the planet
+            rad:    size of the planet (default is 5pixels)
+            color:  color of the planet, (default is white)
+        '''
+        entry=self.items.get(key)
+        if entry is None:
+            self.items[key]=(self.c.create_oval(x,y,x+rad,y+rad,fill=color,outline=color),color)
+            return
+        item,old=entry
+        self.c.coords(item,x,y,x+rad,y+rad)
+        if old!=color:
+            self.c.itemconfigure(item,fill=color,outline=color)
+            self.items[key]=(item,color)
+
+    def removePlanet(self,key):
+        '''
+        Method that removes a planet drawn with movePlanet from the canvas
+            key:    the key the planet was drawn with
+        '''
+        entry=self.items.pop(key,None)
+        if entry is not None:
+            self.c.delete(entry[0])
+
+    def updatePlanets(self,planets):
+        '''
+        Method that makes the canvas show exactly the given planets.
+        Planets are moved or created with movePlanet, planets drawn earlier but not given are removed.
+            planets:    iterable of (key, x, y, rad, color) tuples
+        '''
+        seen=set()
+        for key,x,y,rad,color in planets:
+            self.movePlanet(key,x,y,rad,color)
+            seen.add(key)
+        for key in [key for key in self.items if key not in seen]:
+            self.removePlanet(key)
+
     def mainLoop(self):
         '''
         Method to manage the main loop of the canvas management. Is usually placed last in the main function.
@@ -0,0 +1,152 @@
+#Module for a uniform grid spatial index for DVA248 Datorsystem
+#
+#   The universe is divided into square cells. Each update sorts the planets
+#   by cell once, so a cell's planets are one run of the sorted arrays; pair
+#   searches and radius queries both read these runs. Close pairs are found by
+#   comparing each cell with itself and its neighbours only.
+#
+import numpy as np
+
+# Neighbour cells to compare with, each unordered pair of cells appears once
+_NEIGHBOURS = ((0, 0), (1, 0), (-1, 1), (0, 1), (1, 1))
+
+class spatialgrid:
+    '''
+    Class for a spatial hash over a width x height universe. Planets outside the universe are
+    kept in the nearest border cell.
+    '''
+    def __init__(self, cell, width=800, height=600):
+        '''
+        Constructor that creates an empty grid.
+            cell:           side of a cell, pair searches work for radii up to this size
+            width,height:   size of the universe
+        '''
+        self.cell = float(cell)
+        self.nx = max(1, int(np.ceil(width / self.cell)))
+        self.ny = max(1, int(np.ceil(height / self.cell)))
+        self.update(np.zeros(0, np.int64), np.zeros(0), np.zeros(0))
+
+    def cells(self, sx, sy):
+        '''
+        Method that returns the cell number of each position.
+        '''
+        cx = np.clip((sx / self.cell).astype(np.int64), 0, self.nx - 1)
+        cy = np.clip((sy / self.cell).astype(np.int64), 0, self.ny - 1)
+        return cy * self.nx + cx
+
+    def update(self, ids, sx, sy):
+        '''
+        Method that records the current positions of all planets, replacing the previous ones.
+            ids:    array with the ids of the planets
+            sx,sy:  arrays with their positions
+        '''
+        cells = self.cells(sx, sy)
+        order = np.argsort(cells, kind='stable')
+        # The planets sorted by cell, and where the run of each occupied cell starts
+        self._ids = np.asarray(ids)[order]
+        self._x = np.asarray(sx)[order]
+        self._y = np.asarray(sy)[order]
+        self._cells = cells[order]
+        self.occupied, self.starts, self.counts = np.unique(self._cells, return_index=True, return_counts=True)
+
+    def _run(self, target):
+        # Position in occupied of each target cell, and whether the cell has planets
+        k = np.minimum(np.searchsorted(self.occupied, target), max(len(self.occupied) - 1, 0))
+        return k, (self.occupied[k] == target) if len(self.occupied) else np.zeros(np.shape(target), bool)
+
+    def _square(self, x0, y0, x1, y1):
+        # Positions in the sorted arrays of the planets in the cells that cover a rectangle
+        corners = self.cells(np.array([x0, x1]), np.array([y0, y1])).tolist()
+        (cy0, cx0), (cy1, cx1) = (divmod(c, self.nx) for c in corners)
+        rows = np.arange(cy0, cy1 + 1) * self.nx
+        k, valid = self._run(rows[:, None] + np.arange(cx0, cx1 + 1))
+        k = k[valid]
+        counts = self.counts[k]
+        return np.repeat(self.starts[k] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+    def query(self, x, y, radius):
+        '''
+        Method that finds the planets within radius of a point, using the positions of the last update.
+            x,y:        the point
+            radius:     the search radius
+        Returns a list of planet ids
+        '''
+        first = self._square(x - radius, y - radius, x + radius, y + radius)
+        d2 = (self._x[first] - x) ** 2 + (self._y[first] - y) ** 2
+        return self._ids[first[d2 <= radius * radius]].tolist()
+
+    def within(self, x0, y0, x1, y1):
+        '''
+        Method that finds the planets in a rectangle, using the positions of the last update.
+            x0,y0,x1,y1:    the rectangle, x0 <= x < x1 and y0 <= y < y1
+        Returns an array of planet ids
+        '''
+        first = self._square(x0, y0, x1, y1)
+        x = self._x[first]
+        y = self._y[first]
+        return self._ids[first[(x >= x0) & (x < x1) & (y >= y0) & (y < y1)]]
+
+    def pairs(self, radius):
+        '''
+        Method that finds every pair of planets closer than radius, using the positions of the last update.
+            radius:     the distance, at most the cell size
+        Returns two arrays of planet ids (a, b), one entry per pair
+        '''
+        if radius > self.cell:
+            raise ValueError(f"Radius {radius} is larger than the cell size {self.cell}")
+        n = len(self._ids)
+        if n == 0:
+            return self._ids.copy(), self._ids.copy()
+        cells = self._cells
+        starts, counts = self.starts, self.counts
+        cx = cells % self.nx
+        cy = cells // self.nx
+        found_a, found_b = [], []
+        for dx, dy in _NEIGHBOURS:
+            nx = cx + dx
+            ny = cy + dy
+            valid = (nx >= 0) & (nx < self.nx) & (ny < self.ny)
+            target = ny * self.nx + nx
+            k, found = self._run(target)
+            valid &= found
+            first = (np.arange(n) + 1) if (dx, dy) == (0, 0) else starts[k]
+            last = starts[k] + counts[k]
+            number = np.where(valid, np.maximum(last - first, 0), 0)
+            a = np.repeat(np.arange(n), number)
+            b = np.repeat(first, number) + np.arange(len(a)) - np.repeat(np.cumsum(number) - number, number)
+            d2 = (self._x[a] - self._x[b]) ** 2 + (self._y[a] - self._y[b]) ** 2
+            close = d2 < radius * radius
+            found_a.append(self._ids[a[close]])
+            found_b.append(self._ids[b[close]])
+        return np.concatenate(found_a), np.concatenate(found_b)
+
+
+if __name__ == '__main__':
+    import time
+
+    rng = np.random.default_rng(1)
+    n = 20000
+    ids = np.arange(n)
+    sx = rng.uniform(0, 800, n)
+    sy = rng.uniform(0, 600, n)
+    grid = spatialgrid(2.0)
+    grid.update(ids, sx, sy)
+    t0 = time.perf_counter()
+    a, b = grid.pairs(2.0)
+    t1 = time.perf_counter()
+    found = set(zip(np.minimum(a, b).tolist(), np.maximum(a, b).tolist()))
+    brute = set()
+    for i in range(n):
+        d2 = (sx[i + 1:] - sx[i]) ** 2 + (sy[i + 1:] - sy[i]) ** 2
+        brute.update((i, j) for j in (np.flatnonzero(d2 < 4.0) + i + 1).tolist())
+    t2 = time.perf_counter()
+    print("pairs match brute force:", found == brute, len(found), "pairs")
+    print(f"grid: {(t1 - t0) * 1000:.1f} ms, brute force: {(t2 - t1) * 1000:.1f} ms")
+    print("query matches brute force:", sorted(grid.query(400, 300, 10)) ==
+          np.flatnonzero((sx - 400) ** 2 + (sy - 300) ** 2 <= 100).tolist())
+    print("within matches brute force:", np.sort(grid.within(100, 50, 300, 120)).tolist() ==
+          np.flatnonzero((sx >= 100) & (sx < 300) & (sy >= 50) & (sy < 120)).tolist())
+    sx += rng.uniform(-0.5, 0.5, n)
+    t0 = time.perf_counter()
+    grid.update(ids, sx, sy)
+    print(f"update: {(time.perf_counter() - t0) * 1000:.1f} ms")
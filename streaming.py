@@ -0,0 +1,267 @@
+#Module for streaming planet updates to subscribed clients for DVA248 Datorsystem
+#
+#   A subscribed client follows its own planets and the planets in a watched
+#   rectangle. For every client the server remembers the values it last sent,
+#   quantized as they are on the wire, and sends only the fields that changed
+#   since then. Each client has its own rate, and an update is only sent when
+#   the previous one has left the outbox, so slow clients get fewer updates
+#   instead of a growing queue. The planets of each owner and a spatial grid
+#   are indexed once per snapshot and shared by all subscriptions.
+#
+import struct
+import threading
+import time
+import numpy as np
+import metrics
+from spatialgrid import spatialgrid
+from cscomm import (serverPostFrame, serverOutboxPending, KIND_DELTA, DELTA_HEADER, DELTA_PLANET,
+                    DELTA_NAME, DELTA_GONE, POSITION_SCALE)
+
+MAX_RATE = 10.0
+'''Most updates per second sent to one client'''
+MIN_RATE = 0.1
+BUDGET = 1000
+'''Most planets in one update, the rest follow in the next updates'''
+REGION_CELL = 50
+'''Cell size of the grid that watched rectangles are looked up in'''
+
+# Encodings of the fields as integers: the fixed-point positions and the bit patterns of the floats
+_FORMATS = ('h', 'h', 'h', 'h', 'i', 'i')
+_BITS = 1 << np.arange(len(_FORMATS))
+_ALL = (1 << len(_FORMATS)) - 1
+_structs = {}
+
+def _struct(mask):
+    # Struct for the id, mask and fields of one planet with a given mask, made once per mask
+    s = _structs.get(mask)
+    if s is None:
+        fields = ''.join(fmt for bit, fmt in enumerate(_FORMATS) if mask >> bit & 1)
+        s = _structs[mask] = struct.Struct(DELTA_PLANET.format + fields)
+    return s
+
+def quantize(state, rows):
+    '''
+    Function that returns the fields of some planets of a snapshot as they are sent, one row of six integers per planet.
+        state:  a snapshot, see planetstore.snapshot
+        rows:   the rows of the planets in the snapshot
+    '''
+    q = np.empty((len(rows), len(_FORMATS)), np.int64)
+    q[:, 0] = np.clip(np.rint(state.sx[rows] * POSITION_SCALE), -32768, 32767)
+    q[:, 1] = np.clip(np.rint(state.sy[rows] * POSITION_SCALE), -32768, 32767)
+    q[:, 2] = state.vx[rows].astype(np.float16).view(np.int16)
+    q[:, 3] = state.vy[rows].astype(np.float16).view(np.int16)
+    q[:, 4] = state.mass[rows].astype(np.float32).view(np.int32)
+    q[:, 5] = np.clip(state.life[rows], -2**31, 2**31 - 1)
+    return q
+
+class interest:
+    '''
+    Class for the indexes subscriptions find their planets in: the rows of each owner and a spatial grid
+    of the rows. It is made once per snapshot and shared by all subscriptions.
+    '''
+    def __init__(self, state, cell=REGION_CELL):
+        '''
+        Constructor that indexes a snapshot.
+            state:  a snapshot, see planetstore.snapshot
+            cell:   cell size of the grid
+        '''
+        self.state = state
+        rows = {}
+        for row, owner in enumerate(state.owners):
+            if owner is not None:
+                rows.setdefault(owner, []).append(row)
+        self.rows = {owner: np.array(r, np.int64) for owner, r in rows.items()}
+        self.grid = spatialgrid(cell)
+        self.grid.update(np.arange(len(state), dtype=np.int64), state.sx, state.sy)
+
+    def owned(self, token):
+        '''Method that returns the rows of the planets of an owner.'''
+        return self.rows.get(token, np.empty(0, np.int64))
+
+    def within(self, region):
+        '''Method that returns the rows of the planets in a rectangle (x0, y0, x1, y1).'''
+        return self.grid.within(*region)
+
+class subscription:
+    '''
+    Class for what one client follows and what it has been sent.
+    '''
+    def __init__(self, token, rate, region):
+        '''
+        Constructor for a subscription.
+            token:  the token of the client, its planets are followed (None follows none)
+            rate:   updates per second
+            region: rectangle (x0, y0, x1, y1) whose planets are followed too
+        '''
+        self.token = token
+        self.rate = min(max(rate, MIN_RATE), MAX_RATE)
+        self.region = region
+        self.ids = np.empty(0, np.int64)
+        self.sent = np.empty((0, len(_FORMATS)), np.int64)
+        self.last = -1
+        self.due = 0.0
+        self.tick = None
+
+    def select(self, index):
+        '''
+        Method that returns the rows of the followed planets of a snapshot, ordered by planet id.
+            index:  the interest of the snapshot
+        '''
+        rows = index.owned(self.token) if self.token is not None else np.empty(0, np.int64)
+        x0, y0, x1, y1 = self.region
+        if x1 > x0 and y1 > y0:
+            rows = np.union1d(rows, index.within(self.region))
+        return rows[np.argsort(index.state.ids[rows], kind='stable')]
+
+    def delta(self, state, budget=BUDGET, index=None):
+        '''
+        Method that encodes the changes since the last update.
+            state:  a snapshot, see planetstore.snapshot
+            budget: most planets with changed fields to include
+            index:  the interest of the snapshot, made here if None
+        Returns the payload of a KIND_DELTA message (None if nothing changed) and a function to call
+        when it has been queued, which makes it the base of the next update
+        '''
+        rows = self.select(index if index is not None else interest(state))
+        ids = state.ids[rows]
+        q = quantize(state, rows)
+        # Match the followed planets against the ones the client has
+        known = np.zeros(len(ids), bool)
+        base = np.zeros_like(q)
+        if len(self.ids):
+            pos = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+            known = self.ids[pos] == ids
+            base[known] = self.sent[pos[known]]
+        masks = np.where(known, ((q != base) * _BITS).sum(axis=1), _ALL | DELTA_NAME)
+        gone = self.ids[~np.isin(self.ids, ids)]
+        changed = np.flatnonzero(masks)
+        if len(changed) > budget:
+            # Continue after the last planet sent, so every planet gets its turn
+            start = np.searchsorted(ids[changed], self.last, 'right')
+            changed = np.roll(changed, -start)[:budget]
+            changed.sort()
+        if len(changed) == 0 and len(gone) == 0:
+            return None, None
+
+        parts = [DELTA_HEADER.pack(state.tick, len(gone) + len(changed))]
+        for id in gone.tolist():
+            parts.append(DELTA_PLANET.pack(id, DELTA_GONE))
+        for row, id, mask, values in zip(rows[changed].tolist(), ids[changed].tolist(),
+                                          masks[changed].tolist(), q[changed].tolist()):
+            parts.append(_struct(mask & _ALL).pack(id, mask, *(v for bit, v in enumerate(values) if mask >> bit & 1)))
+            if mask & DELTA_NAME:
+                name = state.names[row].encode('utf-8')[:255]
+                parts.append(bytes((len(name),)) + name)
+
+        def commit():
+            have = known.copy()
+            have[changed] = True
+            base[changed] = q[changed]
+            self.ids = ids[have]
+            self.sent = base[have]
+            if len(changed):
+                self.last = int(ids[changed[-1]])
+        return b''.join(parts), commit
+
+class streamer:
+    '''
+    Class for the thread that sends delta updates to all subscribed clients.
+    '''
+    def __init__(self, universe, budget=BUDGET):
+        '''
+        Constructor that starts the thread.
+            universe:   the universe whose published snapshots are streamed, see universe.latest
+            budget:     most planets with changed fields in one update
+        '''
+        self.universe = universe
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def subscribe(self, client_socket, token, rate, region):
+        '''
+        Method that starts, changes (keeping what the client has) or with rate 0 ends the subscription of a client.
+            client_socket:  the socket of the client
+            token:          the token of the client, see cscomm.clientSendHello
+            rate:           updates per second
+            region:         watched rectangle (x0, y0, x1, y1)
+        '''
+        with self.lock:
+            if rate <= 0:
+                self.subscriptions.pop(client_socket, None)
+                return
+            old = self.subscriptions.get(client_socket)
+            sub = self.subscriptions[client_socket] = subscription(token, rate, region)
+            if old is not None:
+                sub.ids, sub.sent, sub.last = old.ids, old.sent, old.last
+
+    def unsubscribe(self, client_socket):
+        '''
+        Method that forgets a client, e.g. when its connection has closed.
+        '''
+        with self.lock:
+            self.subscriptions.pop(client_socket, None)
+
+    def _run(self):
+        while True:
+            time.sleep(1 / MAX_RATE)
+            state = self.universe.latest()
+            now = time.monotonic()
+            with self.lock:
+                subscriptions = list(self.subscriptions.items())
+            index = None
+            for client_socket, sub in subscriptions:
+                # Wait for the previous update to leave, a client that cannot keep up gets fewer updates
+                if now < sub.due or sub.tick == state.tick or serverOutboxPending(client_socket) != (0, 0):
+                    continue
+                m = metrics.current
+                t = m.clock()
+                if index is None:
+                    # Made for the first client that is due, shared by the others
+                    index = interest(state)
+                    t = m.since("interest", t)
+                payload, commit = sub.delta(state, self.budget, index)
+                sub.due = now + 1 / sub.rate
+                sub.tick = state.tick
+                if payload is not None and serverPostFrame(client_socket, KIND_DELTA, payload):
+                    commit()
+                    m.count("deltas sent")
+                    m.count("delta bytes", len(payload))
+                m.since("delta", t)
+
+
+if __name__ == '__main__':
+    # Size of full and delta updates, and that a client view follows the store
+    from cscomm import planetview
+    from planet import planet
+    from planetstore import planetstore
+
+    rng = np.random.default_rng(1)
+    store = planetstore()
+    store.add_planets([planet(f"P{i}", *rng.uniform(0, 600, 2), *rng.normal(0, 0.5, 2), 1000.0, 200) for i in range(2000)])
+    store.owners[:] = ["me" if i % 10 == 0 else None for i in range(len(store))]
+    sub = subscription("me", 10, (0, 0, 200, 200))
+    view = planetview()
+    for tick in range(6):
+        state = store.snapshot(tick)
+        payload, commit = sub.delta(state)
+        commit()
+        view.apply(payload)
+        print(f"tick {tick}: {len(sub.ids)} planets followed, update {len(payload)} bytes "
+              f"({len(payload) / len(sub.ids):.1f} bytes per planet)")
+        # Planets in the lower half move, the rest stand still
+        moving = store.sy > 300
+        store.sx[moving] += 1.0
+        store.life[:] -= 1
+        store.remove(int(store.ids[tick]))
+    rows = sub.select(interest(state))
+    error = max(max(abs(view.planets[id].sx - x), abs(view.planets[id].sy - y))
+                for id, x, y in zip(state.ids[rows].tolist(), state.sx[rows].tolist(), state.sy[rows].tolist()))
+    print(f"view has {len(view.planets)} planets, expected {len(rows)}, largest position error {error:.4f}")
+    # Ids are 64 bits, a long-running server passes 2**32
+    store = planetstore()
+    store.add_planets([planet("Far", 100.0, 100.0, 0.0, 0.0, 1000.0, 200)], ids=[2 ** 40])
+    view = planetview()
+    view.apply(subscription(None, 10, (0, 0, 200, 200)).delta(store.snapshot(0))[0])
+    print("ids past 2**32 reach the view", list(view.planets) == [2 ** 40])
@@ -0,0 +1,224 @@
+#Module for exporting simulation snapshots for DVA248 Datorsystem
+#
+#   Snapshots hold the ids, positions, velocities and life of all planets at one tick.
+#   Removals move planets to other slots, so a planet is followed by its id.
+#   They are written either to an append-only trajectory file, or to a
+#   memory-mapped ring buffer that another process can tail while it is written.
+#
+import mmap
+import struct
+import numpy as np
+
+FILE_HEADER = struct.Struct('<4sH')
+'''Start of a trajectory file: magic and format version'''
+RECORD_HEADER = struct.Struct('<qI')
+'''Start of each snapshot in a trajectory file: tick and number of planets, followed by the arrays ids, sx, sy, vx, vy, life'''
+RING_HEADER = struct.Struct('<4sHIIq')
+'''Start of a ring buffer: magic, format version, number of slots, planets per slot and number of snapshots written'''
+SLOT_HEADER = struct.Struct('<qqII')
+'''Start of each ring slot: sequence number (-1 while written), tick, planets stored and planets in the universe'''
+
+FILE_MAGIC = b'PTRJ'
+RING_MAGIC = b'PRNG'
+VERSION = 2
+
+FIELDS = ('ids', 'sx', 'sy', 'vx', 'vy', 'life')
+DTYPES = ('<i8', '<f8', '<f8', '<f8', '<f8', '<i8')
+
+class trajectorywriter:
+    '''
+    Class that appends snapshots to a trajectory file.
+    '''
+    def __init__(self, path):
+        '''
+        Constructor that creates (or truncates) the file.
+            path:   name of the trajectory file
+        '''
+        self.f = open(path, 'wb')
+        self.f.write(FILE_HEADER.pack(FILE_MAGIC, VERSION))
+        self.f.flush()
+
+    def write(self, tick, ids, sx, sy, vx, vy, life):
+        '''
+        Method that appends one snapshot.
+            tick:               the tick the snapshot was taken at
+            ids:                array with the id of each planet
+            sx,sy,vx,vy,life:   arrays with the state of all planets
+        '''
+        self.f.write(RECORD_HEADER.pack(tick, len(sx)))
+        for values, dtype in zip((ids, sx, sy, vx, vy, life), DTYPES):
+            self.f.write(np.ascontiguousarray(values, dtype).tobytes())
+        # Whole snapshots reach the file, so it can be read while the server runs
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+def readTrajectory(path):
+    '''
+    Generator that reads a trajectory file.
+        path:   name of the trajectory file
+    Yields the tick and a dict with the arrays ids, sx, sy, vx, vy and life of each snapshot
+    '''
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version = FILE_HEADER.unpack_from(data)
+    if magic != FILE_MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a trajectory file")
+    offset = FILE_HEADER.size
+    while offset + RECORD_HEADER.size <= len(data):
+        tick, count = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        if offset + 8 * len(FIELDS) * count > len(data):
+            break  # snapshot still being written
+        snap = {}
+        for name, dtype in zip(FIELDS, DTYPES):
+            snap[name] = np.frombuffer(data, dtype, count, offset)
+            offset += 8 * count
+        yield tick, snap
+
+class trajectoryring:
+    '''
+    Class for a ring buffer of snapshots in a memory-mapped file.
+    The writer never waits for readers; a reader that falls more than a full ring behind skips snapshots.
+    Each slot holds at most capacity planets, larger snapshots are cut to the first capacity planets.
+    '''
+    def __init__(self, path, slots=64, capacity=4096, create=True):
+        '''
+        Constructor that creates or opens a ring buffer file.
+            path:       name of the file
+            slots:      number of snapshots kept (only used when creating)
+            capacity:   planets per snapshot (only used when creating)
+            create:     True for the writer, False to open an existing ring for reading
+        '''
+        if create:
+            size = RING_HEADER.size + slots * (SLOT_HEADER.size + 8 * len(FIELDS) * capacity)
+            with open(path, 'wb') as f:
+                f.truncate(size)
+            with open(path, 'r+b') as f:
+                self.data = mmap.mmap(f.fileno(), size)
+            RING_HEADER.pack_into(self.data, 0, RING_MAGIC, VERSION, slots, capacity, 0)
+            for slot in range(slots):
+                SLOT_HEADER.pack_into(self.data, self._slot(slot, capacity), -1, 0, 0, 0)
+        else:
+            with open(path, 'rb') as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, slots, capacity, seq = RING_HEADER.unpack_from(self.data)
+            if magic != RING_MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a trajectory ring buffer")
+        self.slots = slots
+        self.capacity = capacity
+
+    def _slot(self, slot, capacity=None):
+        capacity = self.capacity if capacity is None else capacity
+        return RING_HEADER.size + slot * (SLOT_HEADER.size + 8 * len(FIELDS) * capacity)
+
+    def written(self):
+        '''
+        Method that returns the number of snapshots written so far.
+        '''
+        return RING_HEADER.unpack_from(self.data)[4]
+
+    def write(self, tick, ids, sx, sy, vx, vy, life):
+        '''
+        Method that stores one snapshot in the next slot, overwriting the oldest one.
+            tick:               the tick the snapshot was taken at
+            ids:                array with the id of each planet
+            sx,sy,vx,vy,life:   arrays with the state of all planets
+        '''
+        seq = self.written()
+        offset = self._slot(seq % self.slots)
+        count = min(len(sx), self.capacity)
+        # Mark the slot as being written so readers do not use it halfway
+        SLOT_HEADER.pack_into(self.data, offset, -1, tick, count, len(sx))
+        base = offset + SLOT_HEADER.size
+        for i, (values, dtype) in enumerate(zip((ids, sx, sy, vx, vy, life), DTYPES)):
+            start = base + 8 * i * self.capacity
+            self.data[start:start + 8 * count] = np.ascontiguousarray(values[:count], dtype).tobytes()
+        SLOT_HEADER.pack_into(self.data, offset, seq, tick, count, len(sx))
+        struct.pack_into('<q', self.data, RING_HEADER.size - 8, seq + 1)
+
+    def read(self, seq):
+        '''
+        Method that reads the snapshot with a given sequence number.
+            seq:    sequence number, 0 for the first snapshot ever written
+        Returns the tick, the number of planets in the universe and a dict with copies of the arrays,
+        or None if that snapshot is not available (not written yet, overwritten or being written)
+        '''
+        offset = self._slot(seq % self.slots)
+        stored, tick, count, total = SLOT_HEADER.unpack_from(self.data, offset)
+        if stored != seq:
+            return None
+        base = offset + SLOT_HEADER.size
+        snap = {}
+        for i, (name, dtype) in enumerate(zip(FIELDS, DTYPES)):
+            snap[name] = np.frombuffer(self.data, dtype, count, base + 8 * i * self.capacity).copy()
+        # The writer may have started on this slot while it was copied
+        if SLOT_HEADER.unpack_from(self.data, offset)[0] != seq:
+            return None
+        return tick, total, snap
+
+    def latest(self):
+        '''
+        Method that reads the newest complete snapshot, see read.
+        '''
+        seq = self.written()
+        while seq > 0:
+            snap = self.read(seq - 1)
+            if snap is not None:
+                return snap
+            seq = self.written()
+        return None
+
+    def close(self):
+        self.data.close()
+
+
+if __name__ == '__main__':
+    # Print the snapshots of a trajectory file, or follow a ring buffer as it is written
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Show planet server snapshots")
+    parser.add_argument("path", nargs="?", help="trajectory file or ring buffer, without it a self-check is run")
+    parser.add_argument("--ring", action="store_true", help="path is a ring buffer, follow it")
+    args = parser.parse_args()
+    if args.path is None:
+        # Follow a planet that another planet's removal moves to a new slot
+        from planet import planet
+        from planetstore import planetstore
+        store = planetstore()
+        store.add_planets([planet(f"p{i}", 10.0 * i, 20.0 * i, 1.0, 0.0, 1000.0, 100) for i in range(5)])
+        writer = trajectorywriter('/tmp/trajectory.ptrj')
+        ring = trajectoryring('/tmp/trajectory.prng', slots=4, capacity=8)
+        followed = int(store.ids[-1])
+        for tick in range(3):
+            if tick == 1:
+                store.remove(1)  # the last planet takes its slot
+            store.sx[:] += 1.0
+            state = store.snapshot(tick)
+            for output in (writer, ring):
+                output.write(state.tick, state.ids, state.sx, state.sy, state.vx, state.vy, state.life)
+        writer.close()
+        tracks = []
+        for arrays in [arrays for tick, arrays in readTrajectory('/tmp/trajectory.ptrj')] + [ring.read(seq)[2] for seq in range(3)]:
+            tracks.append(float(arrays['sx'][arrays['ids'] == followed][0]))
+        print("planet followed across a removal", tracks == [41.0, 42.0, 43.0] * 2)
+        ring.close()
+    elif args.ring:
+        ring = trajectoryring(args.path, create=False)
+        seq = ring.written()
+        while True:
+            if seq < ring.written() - ring.slots:
+                seq = ring.written() - ring.slots
+            snap = ring.read(seq) if seq < ring.written() else None
+            if snap is None:
+                time.sleep(0.05)
+                continue
+            tick, total, arrays = snap
+            print(f"tick {tick}: {total} planets, mean position "
+                  f"({arrays['sx'].mean() if total else 0:.1f}, {arrays['sy'].mean() if total else 0:.1f})")
+            seq += 1
+    else:
+        for tick, arrays in readTrajectory(args.path):
+            print(f"tick {tick}: {len(arrays['sx'])} planets")